@@ -0,0 +1,111 @@
+"""
+Micro-benchmark of GrcManager over the examples (examples/*.grc), plus a large synthetic flowgraph built
+by replicating the blocks of all of them.
+
+    $ python benchmarks/grc_manager_benchmark.py --repeat 50 --copies 20 --compare-with HEAD~1
+
+With --compare-with, the GrcManager of that git revision is measured too. The RELIA blocks path only
+needs the *.block.yml files of the RELIA blocks (a temporary one is created if not provided).
+"""
+import os
+import sys
+import copy
+import glob
+import time
+import tempfile
+import argparse
+import statistics
+import subprocess
+import importlib
+import importlib.util
+
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def load_module(name: str, filename: str):
+    # Loaded as part of the package, for the relative imports of grc_manager.py
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    importlib.import_module('relia_gr_runner')
+    spec = importlib.util.spec_from_file_location(f'relia_gr_runner.{name}', filename)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_revision(revision: str, directory: str):
+    source = subprocess.check_output(['git', 'show', f'{revision}:relia_gr_runner/grc_manager.py'], cwd=ROOT)
+    filename = os.path.join(directory, 'grc_manager_baseline.py')
+    open(filename, 'wb').write(source)
+    return load_module('grc_manager_baseline', filename)
+
+def large_flowgraph(contents, copies: int) -> str:
+    """
+    A flowgraph with the blocks of all the examples, copies times (with unique names).
+    """
+    graphs = [yaml.safe_load(content) for content in contents]
+    result = copy.deepcopy(graphs[0])
+    result['blocks'] = []
+    result['connections'] = []
+    for copy_number in range(copies):
+        for graph_number, graph in enumerate(graphs):
+            for block in graph['blocks']:
+                block = copy.deepcopy(block)
+                block['name'] = f"{block['name']}_{graph_number}_{copy_number}"
+                result['blocks'].append(block)
+    return yaml.safe_dump(result)
+
+def measure(grc_manager_class, content: str, blocks_path: str, directory: str, repeat: int):
+    """
+    Median time of process() + save(), once the YAML is loaded.
+    """
+    measurements = []
+    for _ in range(repeat):
+        grc_manager = grc_manager_class(content, 'target_file', blocks_path)
+        t0 = time.perf_counter()
+        grc_manager.process()
+        grc_manager.save(directory, 'user_file.grc')
+        measurements.append(time.perf_counter() - t0)
+    return statistics.median(measurements)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=10, help="Copies of the examples in the large flowgraph")
+    parser.add_argument('--blocks-path', default=os.environ.get('RELIA_GR_BLOCKS_PATH'))
+    parser.add_argument('--compare-with', default=None, help="git revision of the GrcManager to compare with")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='relia-benchmark-') as tmpdir:
+        current = load_module('grc_manager_current', os.path.join(ROOT, 'relia_gr_runner', 'grc_manager.py'))
+        implementations = {'current': current.GrcManager}
+        if args.compare_with:
+            implementations[args.compare_with] = load_revision(args.compare_with, tmpdir).GrcManager
+
+        blocks_path = args.blocks_path
+        if not blocks_path:
+            blocks_path = os.path.join(tmpdir, 'blocks')
+            os.mkdir(blocks_path)
+            for block_id in current.QT_TO_RELIA_CONVERSIONS.values():
+                open(os.path.join(blocks_path, f'{block_id}.block.yml'), 'w').close()
+
+        filenames = sorted(glob.glob(os.path.join(ROOT, 'examples', '*.grc')))
+        contents = [open(filename).read() for filename in filenames]
+        cases = list(zip([os.path.basename(filename) for filename in filenames], contents))
+        large = large_flowgraph(contents, args.copies)
+        cases.append((f"large ({len(yaml.safe_load(large)['blocks'])} blocks)", large))
+
+        # The YAML serialization in save() is the same for all of them: measure only the processing
+        yaml.dump = lambda content, Dumper=None: ''
+
+        print(f"{'flowgraph':40} " + ' '.join(f"{name:>14}" for name in implementations))
+        for name, content in cases:
+            results = [measure(implementation, content, blocks_path, tmpdir, args.repeat) for implementation in implementations.values()]
+            line = f"{name:40} " + ' '.join(f"{result * 1e6:12.1f}us" for result in results)
+            if len(results) > 1:
+                line += f"  x{results[1] / results[0]:.2f}"
+            print(line)
+
+if __name__ == '__main__':
+    main()
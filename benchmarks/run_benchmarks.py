@@ -0,0 +1,369 @@
+"""
+Benchmark suite of the runner, over the examples (examples/*.grc):
+
+- grc_manager: GrcManager parse, process and save of each example.
+- compile: grcc of each example (or a stub grcc if it is not installed, see --grcc).
+- turnaround: a Processor processing tasks from a local fake scheduler (and uploader), from the
+  assignment to the completion report. The flowgraphs are compiled by the same grcc.
+- scheduler_client: SchedulerClient calls against the fake scheduler, and the same requests with a
+  plain http.client connection (the difference is the overhead of the client).
+
+Every measurement is stored with its statistical summary in a JSON file, so two commits can be compared
+on the same machine:
+
+    $ python benchmarks/run_benchmarks.py --output before.json
+    $ git checkout my-branch
+    $ python benchmarks/run_benchmarks.py --output after.json
+    $ python benchmarks/run_benchmarks.py --compare before.json after.json
+
+The RELIA blocks path only needs the *.block.yml files of the RELIA blocks (a temporary one is created
+if not provided).
+"""
+import os
+import sys
+import glob
+import json
+import time
+import types
+import shutil
+import logging
+import platform
+import tempfile
+import argparse
+import importlib
+import statistics
+import subprocess
+import http.client
+import urllib.parse
+
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+BENCHMARKS = ('grc_manager', 'compile', 'turnaround', 'scheduler_client')
+
+# Used when grcc is not installed: it writes a flowgraph that prints as a GNU Radio no_gui one and finishes
+STUB_GRCC = '''#!{python}
+import os, sys, yaml
+grc_filename, directory = sys.argv[1], sys.argv[sys.argv.index('-o') + 1]
+flowgraph_id = yaml.safe_load(open(grc_filename))['options']['parameters']['id']
+open(os.path.join(directory, flowgraph_id + '.py'), 'w').write("import time\\nprint('Press Enter to quit: ', flush=True)\\ntime.sleep({run_seconds})\\n")
+'''
+
+def import_runner():
+    """
+    The benchmarked modules do not use GNU Radio, so if the package can not be imported (the __init__ of
+    older commits imports GNU Radio), it is registered without running its __init__.
+    """
+    sys.path.insert(0, ROOT)
+    try:
+        importlib.import_module('relia_gr_runner')
+    except ImportError:
+        package = types.ModuleType('relia_gr_runner')
+        package.__path__ = [os.path.join(ROOT, 'relia_gr_runner')]
+        sys.modules['relia_gr_runner'] = package
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    summary = {
+        'n': len(samples),
+        'min': min(samples),
+        'max': max(samples),
+        'mean': statistics.mean(samples),
+        'median': statistics.median(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+    if len(samples) > 1:
+        percentiles = statistics.quantiles(samples, n=100, method='inclusive')
+        summary['p90'] = percentiles[89]
+        summary['p99'] = percentiles[98]
+    else:
+        summary['p90'] = summary['p99'] = samples[0]
+    return summary
+
+def timed(function: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+def create_blocks_path(directory: str) -> str:
+    from relia_gr_runner.grc_manager import QT_TO_RELIA_CONVERSIONS
+
+    blocks_path = os.path.join(directory, 'blocks')
+    os.makedirs(blocks_path, exist_ok=True)
+    for block_id in QT_TO_RELIA_CONVERSIONS.values():
+        open(os.path.join(blocks_path, f'{block_id}.block.yml'), 'w').close()
+    return blocks_path
+
+def find_grcc(mode: str, directory: str, run_seconds: float) -> str:
+    """
+    grcc, or a stub that only writes a trivial flowgraph (mode: auto, real or stub).
+    """
+    grcc = shutil.which('grcc')
+    if mode == 'real' or (mode == 'auto' and grcc):
+        if not grcc:
+            raise SystemExit("grcc not found")
+        return grcc
+
+    stub_directory = os.path.join(directory, 'stub-bin')
+    os.makedirs(stub_directory, exist_ok=True)
+    stub = os.path.join(stub_directory, 'grcc')
+    open(stub, 'w').write(STUB_GRCC.format(python=sys.executable, run_seconds=run_seconds))
+    os.chmod(stub, 0o755)
+    return stub
+
+def benchmark_grc_manager(examples: Dict[str, str], blocks_path: str, directory: str, repeat: int) -> Dict[str, List[float]]:
+    from relia_gr_runner.grc_manager import GrcManager
+
+    results: Dict[str, List[float]] = {}
+    for name, content in examples.items():
+        parse, process, save = [], [], []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            grc_manager = GrcManager(content, 'target_file', blocks_path)
+            t1 = time.perf_counter()
+            grc_manager.process()
+            t2 = time.perf_counter()
+            grc_manager.save(directory, 'user_file.grc')
+            t3 = time.perf_counter()
+            parse.append(t1 - t0)
+            process.append(t2 - t1)
+            save.append(t3 - t2)
+        results[f'grc_manager.parse[{name}]'] = parse
+        results[f'grc_manager.process[{name}]'] = process
+        results[f'grc_manager.save[{name}]'] = save
+        results[f'grc_manager.total[{name}]'] = [a + b + c for a, b, c in zip(parse, process, save)]
+    return results
+
+def benchmark_compile(examples: Dict[str, str], blocks_path: str, directory: str, grcc: str, repeat: int) -> Dict[str, List[float]]:
+    from relia_gr_runner.grc_manager import GrcManager
+
+    results: Dict[str, List[float]] = {}
+    environment = dict(os.environ, GRC_BLOCKS_PATH=blocks_path)
+    for name, content in examples.items():
+        workspace = os.path.join(directory, 'compile', name)
+        os.makedirs(workspace, exist_ok=True)
+        GrcManager(content, 'target_file', blocks_path).save(workspace, 'user_file.grc')
+        command = [grcc, os.path.join(workspace, 'user_file.grc'), '-o', workspace]
+        results[f'compile[{name}]'] = timed(lambda: subprocess.run(command, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), repeat)
+    return results
+
+def create_app(scheduler_url: str, blocks_path: str, directory: str, use_caches: bool):
+    from flask import Flask
+    from config import configurations
+
+    app = Flask('relia-benchmarks')
+    app.config.from_object(configurations['default'])
+    app.config.update({
+        'SCHEDULER_BASE_URL': scheduler_url,
+        'DATA_UPLOADER_BASE_URL': scheduler_url,
+        'DEVICE_ID': 'benchmark:r',
+        'PASSWORD': 'password',
+        'DEVICE_TYPE': 'receiver',
+        'ADALM_PLUTO_IP_ADDRESS': 'ip:192.168.2.1',
+        'DEVICE_INVENTORY': None,
+        'USE_FIREJAIL': False,
+        'USE_ZYGOTE': False,
+        'USE_GRC_COMPILER_SERVICE': False,
+        'PLAN_FFT_WISDOM': False,
+        'PREFETCH_ASSIGNMENTS': False,
+        'MAX_CONCURRENT_DSP_TASKS': 0,
+        'METRICS_PORT': None,
+        'TASK_TRACES_DIRECTORY': None,
+        'TASK_LOGS_DIRECTORY': None,
+        # The fake scheduler learns the outcome of the tasks from their timelines
+        'SEND_TASK_TIMELINES': True,
+        'WORKSPACES_DIRECTORY': os.path.join(directory, 'workspaces'),
+        'USE_COMPILE_CACHE': use_caches,
+        'COMPILE_CACHE_DIRECTORY': os.path.join(directory, 'compile-cache'),
+        'USE_GRC_CACHE': use_caches,
+        'GRC_CACHE_DIRECTORY': os.path.join(directory, 'grc-cache'),
+    })
+    os.environ['RELIA_GR_BLOCKS_PATH'] = blocks_path
+    return app
+
+def benchmark_turnaround(examples: Dict[str, str], blocks_path: str, directory: str, grcc: str, repeat: int, use_caches: bool) -> Dict[str, List[float]]:
+    import threading
+    from relia_gr_runner.fake_scheduler import start_fake_scheduler
+
+    server = start_fake_scheduler()
+    app = create_app(server.base_url, blocks_path, directory, use_caches)
+    # The processor runs grcc from the PATH
+    os.environ['PATH'] = os.path.dirname(grcc) + os.pathsep + os.environ['PATH']
+
+    with app.app_context():
+        from relia_gr_runner.processor import Processor
+
+        processor = Processor(running_single_task=False)
+
+    def run():
+        with app.app_context():
+            processor.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+
+    results: Dict[str, List[float]] = {}
+    try:
+        for name, content in examples.items():
+            samples = []
+            for run_number in range(repeat):
+                task_identifier = f'benchmark.{name}.{run_number}'
+                server.assign(task_identifier, content)
+                turnaround = server.wait_for_completion(task_identifier, timeout=120)
+                if turnaround is None:
+                    raise SystemExit(f"The task {task_identifier} was not completed")
+                # A failed task is also reported as completed, but its turnaround is not the one measured
+                outcome = server.get_outcome(task_identifier)
+                if outcome != 'completed':
+                    raise SystemExit(f"The task {task_identifier} did not run successfully (outcome: {outcome})")
+                samples.append(turnaround)
+            results[f'turnaround[{name}]'] = samples
+    finally:
+        # Without a scheduler, the processor stops taking tasks (and creating workspaces)
+        server.shutdown()
+    return results
+
+def benchmark_scheduler_client(directory: str, repeat: int) -> Dict[str, List[float]]:
+    from relia_gr_runner.fake_scheduler import start_fake_scheduler
+
+    server = start_fake_scheduler(events=False)
+    app = create_app(server.base_url, directory, directory, use_caches=False)
+    with app.app_context():
+        from relia_gr_runner.scheduler import SchedulerClient
+
+        scheduler = SchedulerClient()
+
+        def get_assignment():
+            server.assign('benchmark.task', '')
+            scheduler.get_assignments()
+
+        results = {
+            'scheduler_client.get_assignments': timed(get_assignment, repeat),
+            'scheduler_client.check_assignment_status': timed(lambda: scheduler.check_assignment_status('benchmark.task'), repeat),
+            'scheduler_client.complete_assignments': timed(lambda: scheduler.complete_assignments('benchmark.task'), repeat),
+        }
+
+    # The same status request with a plain keep-alive connection
+    url = urllib.parse.urlparse(server.base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+
+    def raw_request():
+        connection.request('GET', '/scheduler/devices/tasks/receiver/benchmark.task', headers={'relia-device': 'benchmark:r', 'relia-password': 'password'})
+        json.loads(connection.getresponse().read())
+
+    results['scheduler_client.raw_http_baseline'] = timed(raw_request, repeat)
+    connection.close()
+    server.shutdown()
+    return results
+
+def metadata(grcc: Optional[str]) -> Dict:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT).strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'grcc': grcc,
+    }
+
+def compare(base_filename: str, new_filename: str, threshold: float):
+    """
+    Compare the medians of two result files. A difference is marked as significant if it is over the
+    threshold and over two standard errors of the difference of the means.
+    """
+    base = json.load(open(base_filename))
+    new = json.load(open(new_filename))
+    print(f"base: {base['metadata']['commit']} ({base['metadata']['time']})")
+    print(f"new:  {new['metadata']['commit']} ({new['metadata']['time']})")
+    if (base['metadata']['platform'], base['metadata']['cpus']) != (new['metadata']['platform'], new['metadata']['cpus']):
+        print("Warning: the results are from different machines")
+
+    print(f"{'benchmark':60} {'base':>12} {'new':>12} {'new/base':>9}")
+    for name in sorted(set(base['results']) & set(new['results'])):
+        b, n = base['results'][name], new['results'][name]
+        ratio = n['median'] / b['median'] if b['median'] else float('inf')
+        standard_error = (b['stdev'] ** 2 / b['n'] + n['stdev'] ** 2 / n['n']) ** 0.5
+        significant = abs(ratio - 1) > threshold and abs(n['mean'] - b['mean']) > 2 * standard_error
+        mark = (' faster' if ratio < 1 else ' slower') if significant else ''
+        print(f"{name:60} {b['median'] * 1000:10.3f}ms {n['median'] * 1000:10.3f}ms {ratio:8.2f}x{mark}")
+
+    for name in sorted(set(base['results']) ^ set(new['results'])):
+        print(f"{name:60} only in {'base' if name in base['results'] else 'new'}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f"Comma separated benchmarks (default: {','.join(BENCHMARKS)})")
+    parser.add_argument('--repeat', type=int, default=20, help="Measurements of each benchmark (turnaround and compile: a fifth of them)")
+    parser.add_argument('--examples', default='*.grc', help="Glob of the examples used (in examples/)")
+    parser.add_argument('--blocks-path', default=os.environ.get('RELIA_GR_BLOCKS_PATH'))
+    parser.add_argument('--grcc', choices=('auto', 'real', 'stub'), default='auto', help="Use grcc or a stub (auto: grcc if installed)")
+    parser.add_argument('--run-seconds', type=float, default=0.05, help="Duration of the flowgraphs compiled by the stub grcc")
+    parser.add_argument('--caches', action='store_true', help="Use the GRC and compile caches in the turnaround benchmark")
+    parser.add_argument('--output', default=None, help="JSON file for the results (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files instead of running the benchmarks")
+    parser.add_argument('--threshold', type=float, default=0.05, help="Minimum relative difference reported as significant")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare[0], args.compare[1], args.threshold)
+        return
+
+    selected = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    import_runner()
+    logging.getLogger('relia_gr_runner').setLevel(logging.WARNING)
+    slow_repeat = max(1, args.repeat // 5)
+
+    results: Dict[str, List[float]] = {}
+    grcc = None
+    with tempfile.TemporaryDirectory(prefix='relia-benchmarks-') as tmpdir:
+        blocks_path = args.blocks_path or create_blocks_path(tmpdir)
+        filenames = sorted(glob.glob(os.path.join(ROOT, 'examples', args.examples)))
+        examples = {os.path.splitext(os.path.basename(filename))[0]: open(filename).read() for filename in filenames}
+        if 'compile' in selected or 'turnaround' in selected:
+            grcc = find_grcc(args.grcc, tmpdir, args.run_seconds)
+
+        for name in selected:
+            print(f"[{time.asctime()}] Running the {name} benchmark...", file=sys.stderr, flush=True)
+            if name == 'grc_manager':
+                results.update(benchmark_grc_manager(examples, blocks_path, tmpdir, args.repeat))
+            elif name == 'compile':
+                results.update(benchmark_compile(examples, blocks_path, tmpdir, grcc, slow_repeat))
+            elif name == 'turnaround':
+                results.update(benchmark_turnaround(examples, blocks_path, tmpdir, grcc, slow_repeat, args.caches))
+            elif name == 'scheduler_client':
+                results.update(benchmark_scheduler_client(tmpdir, args.repeat))
+
+    report = {
+        'metadata': metadata(grcc),
+        'settings': {'repeat': args.repeat, 'examples': args.examples, 'caches': args.caches, 'run_seconds': args.run_seconds},
+        'results': {name: dict(summarize(samples), samples=samples) for name, samples in results.items()},
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(ROOT, 'benchmarks', 'results'), exist_ok=True)
+        output = os.path.join(ROOT, 'benchmarks', 'results', f"{(report['metadata']['commit'] or 'unknown')[:12]}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+
+    print(f"{'benchmark':60} {'median':>12} {'p90':>12} {'n':>5}")
+    for name, summary in report['results'].items():
+        print(f"{name:60} {summary['median'] * 1000:10.3f}ms {summary['p90'] * 1000:10.3f}ms {summary['n']:5}")
+    print(f"Results stored in {output}")
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,77 @@ class Config:
     ADALM_PLUTO_IP_ADDRESS = os.environ.get('ADALM_PLUTO_IP_ADDRESS')
     RED_PITAYA_IP_ADDRESS = os.environ.get('RED_PITAYA_IP_ADDRESS')
     RED_PITAYA_RATE = os.environ.get('RED_PITAYA_RATE')
+    # Run several devices in one process (see devices.load_inventory) instead of DEVICE_ID, PASSWORD...
+    DEVICE_INVENTORY = os.environ.get('DEVICE_INVENTORY')
     MAX_GR_PYTHON_EXECUTION_TIME = float(os.environ.get('MAX_GR_PYTHON_EXECUTION_TIME') or '20')
     USE_FIREJAIL = os.environ.get('USE_FIREJAIL') in ('1', 'true')
     FIREJAIL_IP_ADDRESS = os.environ.get('FIREJAIL_IP_ADDRESS') or '10.10.20.2'
     FIREJAIL_INTERFACE = os.environ.get('FIREJAIL_INTERFACE') or 'br0'
+    # firejail (a new jail per command), firejail-join (a persistent jail per workspace for the commands without network)
+    # or bubblewrap (for the commands without network; the flowgraphs run in firejail, see sandbox_manager.py)
+    SANDBOX_BACKEND = os.environ.get('SANDBOX_BACKEND') or 'firejail'
+    USE_COMPILE_CACHE = os.environ.get('USE_COMPILE_CACHE', '1') in ('1', 'true')
+    COMPILE_CACHE_DIRECTORY = os.environ.get('COMPILE_CACHE_DIRECTORY') or os.path.expanduser('~/.cache/relia-gr-runner/compile-cache')
+    COMPILE_CACHE_MAX_BYTES = int(os.environ.get('COMPILE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    # Seconds between writes of the hit/miss counters of the runner to the shared ones (they are also written at exit)
+    COMPILE_CACHE_COUNTERS_FLUSH_INTERVAL = float(os.environ.get('COMPILE_CACHE_COUNTERS_FLUSH_INTERVAL') or 60)
+    USE_GRC_CACHE = os.environ.get('USE_GRC_CACHE', '1') in ('1', 'true')
+    GRC_CACHE_DIRECTORY = os.environ.get('GRC_CACHE_DIRECTORY') or os.path.expanduser('~/.cache/relia-gr-runner/grc-cache')
+    GRC_CACHE_MAX_MEMORY_BYTES = int(os.environ.get('GRC_CACHE_MAX_MEMORY_BYTES') or 16 * 1024 * 1024)
+    GRC_CACHE_MAX_DISK_BYTES = int(os.environ.get('GRC_CACHE_MAX_DISK_BYTES') or 64 * 1024 * 1024)
+    USE_GRC_VALIDATOR = os.environ.get('USE_GRC_VALIDATOR', '1') in ('1', 'true')
+    # Directories with the block.yml files of GNU Radio (separated by os.pathsep). By default, those of the GNU Radio installation
+    GRC_BLOCKS_PATHS = os.environ.get('GRC_BLOCKS_PATHS')
+    USE_GRC_COMPILER_SERVICE = os.environ.get('USE_GRC_COMPILER_SERVICE', '1') in ('1', 'true')
+    WORKSPACES_DIRECTORY = os.environ.get('WORKSPACES_DIRECTORY')
+    USE_WORKSPACE_POOL = os.environ.get('USE_WORKSPACE_POOL', '1') in ('1', 'true')
+    WORKSPACE_POOL_SIZE = int(os.environ.get('WORKSPACE_POOL_SIZE') or 2)
+    # e.g., 256m: mount a tmpfs of that size in WORKSPACES_DIRECTORY (see workspace_pool.mount_tmpfs)
+    WORKSPACES_TMPFS_SIZE = os.environ.get('WORKSPACES_TMPFS_SIZE')
+    USE_ZYGOTE = os.environ.get('USE_ZYGOTE') in ('1', 'true')
+    OUTPUT_HEAD_BYTES = int(os.environ.get('OUTPUT_HEAD_BYTES') or 16 * 1024)
+    OUTPUT_TAIL_BYTES = int(os.environ.get('OUTPUT_TAIL_BYTES') or 16 * 1024)
+    ERROR_MESSAGE_MAX_BYTES = int(os.environ.get('ERROR_MESSAGE_MAX_BYTES') or 32 * 1024)
+    TASK_LOGS_DIRECTORY = os.environ.get('TASK_LOGS_DIRECTORY')
+    TASK_LOG_MAX_BYTES = int(os.environ.get('TASK_LOG_MAX_BYTES') or 10 * 1024 * 1024)
+    TASK_LOG_BACKUPS = int(os.environ.get('TASK_LOG_BACKUPS') or 1)
+    # Upload the files written by the file sinks while the flowgraph runs (see file_streaming.py), in gzip chunks of
+    # up to FILE_STREAMING_CHUNK_BYTES every FILE_STREAMING_INTERVAL seconds and at most FILE_STREAMING_MAX_BYTES per task (0: no limit)
+    STREAM_FILE_SINKS = os.environ.get('STREAM_FILE_SINKS') in ('1', 'true')
+    FILE_STREAMING_INTERVAL = float(os.environ.get('FILE_STREAMING_INTERVAL') or 1)
+    FILE_STREAMING_CHUNK_BYTES = int(os.environ.get('FILE_STREAMING_CHUNK_BYTES') or 1024 * 1024)
+    FILE_STREAMING_MAX_BYTES = int(os.environ.get('FILE_STREAMING_MAX_BYTES') or 256 * 1024 * 1024)
+    FILE_STREAMING_COMPRESSION_LEVEL = int(os.environ.get('FILE_STREAMING_COMPRESSION_LEVEL') or 1)
+    # Free the disk space of what was uploaded (or dropped over the limit) as the flowgraph keeps writing
+    FILE_STREAMING_RELEASE_UPLOADED = os.environ.get('FILE_STREAMING_RELEASE_UPLOADED', '1') in ('1', 'true')
+    # DEBUG, INFO, WARNING or ERROR. The runner logs JSON lines to LOG_FILENAME (or stderr if not set)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FILENAME = os.environ.get('LOG_FILENAME')
+    # Timelines of the last tasks kept in memory (0: none), and where to export each of them as a Chrome trace
+    TASK_TIMELINES_KEPT = int(os.environ.get('TASK_TIMELINES_KEPT') or 100)
+    TASK_TRACES_DIRECTORY = os.environ.get('TASK_TRACES_DIRECTORY')
+    # Send the timeline summary in the body of the completion report (the RELIA Scheduler expects an empty one)
+    SEND_TASK_TIMELINES = os.environ.get('SEND_TASK_TIMELINES', '0') in ('1', 'true')
+    # If set, process-tasks serves the metrics (Prometheus text format) in http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_PORT = int(os.environ.get('METRICS_PORT') or 0) or None
+    METRICS_HOST = os.environ.get('METRICS_HOST') or '0.0.0.0'
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES') or 3)
+    HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE') or 0.5)
+    HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX') or 10)
+    HTTP_CIRCUIT_BREAKER_FAILURES = int(os.environ.get('HTTP_CIRCUIT_BREAKER_FAILURES') or 5)
+    HTTP_CIRCUIT_BREAKER_RESET = float(os.environ.get('HTTP_CIRCUIT_BREAKER_RESET') or 30)
+    USE_TASK_STATUS_EVENTS = os.environ.get('USE_TASK_STATUS_EVENTS', '1') in ('1', 'true')
+    PLAN_FFT_WISDOM = os.environ.get('PLAN_FFT_WISDOM', '1') in ('1', 'true')
+    FFT_WISDOM_PLANNING_TIMEOUT = float(os.environ.get('FFT_WISDOM_PLANNING_TIMEOUT') or 120)
+    # Flowgraphs without hardware blocks that can run at the same time (0: one task at a time, see concurrency.py)
+    MAX_CONCURRENT_DSP_TASKS = int(os.environ.get('MAX_CONCURRENT_DSP_TASKS') or 0)
+    # CPU time of a DSP task, over all its threads (0: MAX_GR_PYTHON_EXECUTION_TIME times the cores of its slot)
+    DSP_TASK_CPU_SECONDS = int(os.environ.get('DSP_TASK_CPU_SECONDS') or 0)
+    DSP_TASK_NICENESS = int(os.environ.get('DSP_TASK_NICENESS') or 10)
+    # With firejail, every DSP task needs its own sandbox IP address (comma separated, allowed by the firewall as FIREJAIL_IP_ADDRESS)
+    DSP_TASK_IP_ADDRESSES = os.environ.get('DSP_TASK_IP_ADDRESSES')
+    PREFETCH_ASSIGNMENTS = os.environ.get('PREFETCH_ASSIGNMENTS') in ('1', 'true')
+    ZYGOTE_PRELOAD_MODULES = os.environ.get('ZYGOTE_PRELOAD_MODULES') or 'numpy,pmt,gnuradio.gr,gnuradio.blocks,gnuradio.analog,gnuradio.filter,gnuradio.fft,gnuradio.digital,gnuradio.iio'
 
 class DevelopmentConfig(Config):
     DEBUG = True
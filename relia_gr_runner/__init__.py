@@ -1,12 +1,56 @@
 import os
+import sys
+import glob
+import json
 import time
 import click
-from flask import Flask
+import random
+import select
+import tempfile
+import statistics
+from typing import Optional
+from flask import Flask, Response
 
 from config import configurations
 
-from gnuradio import fft
-from gnuradio.fft import window
+def _report_import_time(ctx: click.Context, param: click.Parameter, value: bool):
+    """
+    Run the command again in a new interpreter with python -X importtime, and when it finishes, report the total
+    import time and the slowest modules imported (including the ones imported lazily while it was running).
+    """
+    if not value or ctx.resilient_parsing:
+        return
+
+    import subprocess
+
+    arguments = [argument for argument in sys.argv[1:] if argument != '--import-time']
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-m', 'flask'] + arguments, stderr=subprocess.PIPE, text=True)
+
+    # import time: self [us] | cumulative | imported package (indented by depth)
+    imports = []
+    try:
+        for line in process.stderr:
+            if not line.startswith('import time:'):
+                sys.stderr.write(line)
+                continue
+            try:
+                self_us, cumulative_us, name = line[len('import time:'):].split('|')
+                imports.append((int(self_us), int(cumulative_us), name.rstrip()))
+            except ValueError:
+                # The header
+                continue
+    except KeyboardInterrupt:
+        # The command got it too (same process group), so it stops by itself
+        pass
+    returncode = process.wait()
+
+    # Top level imports are indented by one space
+    total_us = sum(cumulative_us for _, cumulative_us, name in imports if not name.startswith('  '))
+    print(f"Import time: {total_us / 1000:.1f}ms ({len(imports)} modules)", file=sys.stderr)
+    for self_us, cumulative_us, name in sorted(imports, reverse=True)[:10]:
+        print(f"    {self_us / 1000:8.1f}ms self {cumulative_us / 1000:8.1f}ms cumulative  {name.strip()}", file=sys.stderr)
+
+    ctx.exit(returncode)
 
 def create_app(config_name: str = 'default'):
     # Based on Flasky https://github.com/miguelgrinberg/flasky
@@ -14,18 +58,49 @@ def create_app(config_name: str = 'default'):
     app = Flask(__name__)
     app.config.from_object(configurations[config_name])
 
-    from .processor import Processor
-    from .grc_manager import GrcManager
-    from .scheduler import TaskAssignment
+    from .logs import configure_logging
+    configure_logging(app.config['LOG_LEVEL'], app.config['LOG_FILENAME'])
+
+    # GNU Radio and the Processor (with the scheduler and requests) are only imported by the commands that
+    # use them, so the rest start fast (see the --import-time option)
+
+    @app.route('/metrics')
+    def metrics():
+        from .metrics import REGISTRY
+
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
     @app.cli.command('process-tasks')
-    def process_tasks():
+    @click.option("--inventory", type=click.Path(exists=True, dir_okay=False), default=None,
+                  help="YAML file with the devices to run (see devices.load_inventory). By default, DEVICE_INVENTORY or the single device of the configuration")
+    def process_tasks(inventory: Optional[str]):
         """
         Process tasks
         """
+        from gnuradio import fft
+        from gnuradio.fft import window
+
         print(f"[{time.asctime()}] Creating cache for fft.fft_vcc with 1024...")
         fft.fft_vcc(1024, True, window.blackmanharris(1024), True, 1)
         print(f"[{time.asctime()}] Cache created")
+
+        if app.config['METRICS_PORT']:
+            from .metrics import serve_metrics
+
+            serve_metrics(app, app.config['METRICS_HOST'], app.config['METRICS_PORT'])
+
+        inventory = inventory or app.config['DEVICE_INVENTORY']
+        if inventory:
+            from .devices import load_inventory
+            from .multi_device import MultiDeviceRunner
+
+            devices = load_inventory(inventory)
+            print(f"[{time.asctime()}] Running {len(devices)} devices from {inventory}", flush=True)
+            MultiDeviceRunner(devices).run_forever()
+            return
+
+        from .processor import Processor
+
         processor = Processor(running_single_task=False)
         processor.run_forever()
 
@@ -33,28 +108,24 @@ def create_app(config_name: str = 'default'):
     @click.option("--start", type=int, default=1)
     @click.option("--end", type=int, default=2**14 + 1)
     @click.option("--step", type=int, default=1)
-    def create_caches(start, end, step):
+    @click.option("--jobs", type=int, default=None, help="Number of processes (default: one per CPU)")
+    @click.option("--batch-size", type=int, default=16, help="Sizes planned by each process before merging its wisdom")
+    @click.option("--max-temperature", type=float, default=75, help="Do not start new batches while the CPU is hotter (Celsius)")
+    @click.option("--max-load", type=float, default=None, help="Do not start new batches while the 1 minute load average is higher")
+    def create_caches(start, end, step, jobs, batch_size, max_temperature, max_load):
         """
         These files take a long time to be created, but then they are cached.
+
+        Powers of two and other common sizes are planned first, in parallel. If interrupted, the next run
+        continues where it stopped.
         """
-        for num in range(start, end + 1, step):
-            print(f"[{time.asctime()}] Creating cache for fft.fft_vcc with {num}...", flush=True)
-            t0 = time.time()
-            fft.fft_vcc(num, True, window.blackmanharris(num), True, 1)
-            tf = time.time()
-            elapsed = tf - t0
-            print(f"[{time.asctime()}] Cache created", flush=True)
-
-            if elapsed > 5:
-                # If the CPU has been running for a while, give it a break to avoid increasing temperature
-                time.sleep(1)
-
-            if num % 256 == 0:
-                print(f"[{time.asctime()}] Creating backup...", flush=True)
-                backup_content = open(os.path.expanduser("~/.gr_fftw_wisdom"), 'r').read()
-                new_filename = os.path.expanduser(f"~/.backup-{num}-gr_fftw_wisdom")
-                open(new_filename, 'w').write(backup_content)
-                print(f"[{time.asctime()}] Backup created and stored at: {new_filename}", flush=True)
+        from .fft_wisdom import ResourceBudget, WisdomGenerator, planning_order, wisdom_key
+
+        budget = ResourceBudget(max_temperature=max_temperature, max_load=max_load)
+        generator = WisdomGenerator(jobs=jobs, batch_size=batch_size, budget=budget)
+        keys = [wisdom_key(size) for size in planning_order(range(start, end + 1, step))]
+        planned = generator.generate(keys)
+        print(f"[{time.asctime()}] {planned} FFTs planned. Wisdom stored at {generator.wisdom_filename}", flush=True)
 
     @app.cli.command("process-single-task")
     @click.option("--grc-filename", type=click.Path(exists=True))
@@ -64,6 +135,10 @@ def create_app(config_name: str = 'default'):
         """
         Compile and run a GRC file, without interacting servers.
         """
+        from .processor import Processor
+        from .grc_manager import GrcManager
+        from .scheduler import TaskAssignment
+
         processor = Processor(running_single_task=True)
 
         grc_original_content = open(grc_filename).read()
@@ -80,11 +155,59 @@ def create_app(config_name: str = 'default'):
     @app.cli.command("compile-grc")
     @click.option("--grc-filename", type=click.Path(exists=True))
     @click.option("--directory", type=click.Path(exists=True))
-    def compile_grc(grc_filename: str, directory: str):
+    @click.option("--batch", multiple=True, help="Compile every .grc file in these directories, files or glob patterns in parallel instead")
+    @click.option("--output-directory", type=click.Path(file_okay=False), default=None, help="Where each file of the batch is compiled, in its own directory (by default, a temporary one)")
+    @click.option("--jobs", type=int, default=None, help="Processes compiling the batch (default: one per CPU)")
+    @click.option("--timeout", type=float, default=120, help="Maximum seconds compiling each file of the batch")
+    @click.option("--report", type=click.Path(dir_okay=False), default=None, help="JSON file for the report of the batch")
+    @click.option("--slowest", type=int, default=10, help="Slowest files of the batch shown")
+    def compile_grc(grc_filename: str, directory: str, batch, output_directory: Optional[str], jobs: Optional[int], timeout: float,
+                    report: Optional[str], slowest: int):
         """
         Compile, without running, a grc file on a folder.
+
+        With --batch, compile many files in a pool of processes and report the result, the duration and the
+        compile cache hits of each one (see batch_compile).
         """
+        if batch:
+            from .batch_compile import compile_files, find_grc_files, report as batch_report
+
+            grc_filenames = find_grc_files(batch)
+            if not grc_filenames:
+                raise click.ClickException(f"No .grc files found in {', '.join(batch)}")
+
+            output_directory = output_directory or tempfile.mkdtemp(prefix='relia-compile-grc-')
+            jobs = jobs or os.cpu_count()
+            print(f"[{time.asctime()}] Compiling {len(grc_filenames)} files in {output_directory} with {jobs} processes...", flush=True)
+            t0 = time.perf_counter()
+            results = compile_files(grc_filenames, output_directory, dict(app.config), jobs=jobs, timeout=timeout)
+            summary = batch_report(results, time.perf_counter() - t0, jobs, slowest)
+
+            for result in results:
+                if not result.success:
+                    print(f"[{time.asctime()}] Failed: {result.grc_filename}: {result.error}")
+            print(f"[{time.asctime()}] {summary['succeeded']} compiled, {summary['failed']} failed, {summary['cache_hits']} compile cache hits in {summary['seconds']:.1f} seconds")
+            print("Slowest:")
+            for entry in summary['slowest']:
+                print(f"    {entry['seconds']:8.2f}s {entry['grc_filename']}")
+
+            if report:
+                with open(report, 'w') as f:
+                    json.dump(summary, f, indent=4)
+            if summary['failed']:
+                sys.exit(1)
+            return
+
+        if not grc_filename or not directory:
+            raise click.UsageError("--grc-filename and --directory are required (or --batch)")
+
+        from .processor import Processor
+        from .grc_manager import GrcManager
+        from .scheduler import TaskAssignment
+
         processor = Processor(running_single_task=True)
+        if processor.grc_compiler is not None and not processor.grc_compiler.wait_until_ready():
+            print(f"[{time.asctime()}] The GRC compiler service is not available. Using grcc.")
 
         grc_original_content = open(grc_filename).read()
         grc_manager = GrcManager(grc_original_content)
@@ -94,6 +217,353 @@ def create_app(config_name: str = 'default'):
 
         device_data = TaskAssignment(sessionIdentifier="non.existing.session", taskIdentifier="invalid.task.id", maxTime=3600, file="foo.grc", fileContent=grc_original_content, fileType="grc")
         processor.compile_grc_filename_into_python(directory,  grc_manager, device_data, init_time=time.perf_counter())
-        
+
+    @app.cli.command("measure-startup")
+    @click.option("--grc-filename", type=click.Path(exists=True), required=True)
+    @click.option("--runs", type=int, default=5)
+    @click.option("--timeout", type=float, default=60)
+    def measure_startup(grc_filename: str, runs: int, timeout: float):
+        """
+        Measure the time to the first sample of a flowgraph launched as a new process and from the zygote.
+
+        GNU Radio no_gui flowgraphs print "Press Enter to quit" right after starting the top block, so the
+        time until the first byte in stdout is used.
+        """
+        from .processor import Processor
+        from .grc_manager import GrcManager
+        from .scheduler import TaskAssignment
+
+        processor = Processor(running_single_task=True)
+
+        grc_original_content = open(grc_filename).read()
+        grc_manager = GrcManager(grc_original_content, 'target_file', processor.default_hier_block_lib_dir)
+        device_data = TaskAssignment(sessionIdentifier="non.existing.session", taskIdentifier="invalid.task.id", maxTime=3600, file=os.path.basename(grc_filename), fileContent=grc_original_content, fileType="grc")
+
+        with tempfile.TemporaryDirectory(prefix='relia-', dir=processor.workspaces_directory) as tmpdir:
+            if processor.compile_grc_filename_into_python(tmpdir, grc_manager, device_data, init_time=time.perf_counter()):
+                print(f"[{time.asctime()}] Error compiling {grc_filename}")
+                return
+
+            py_filename = os.path.join(tmpdir, 'target_file.py')
+
+            def measure(launch):
+                measurements = []
+                for _ in range(runs):
+                    t0 = time.perf_counter()
+                    p = launch()
+                    readable, _, _ = select.select([p.stdout], [], [], timeout)
+                    if readable and p.stdout.read(1):
+                        measurements.append(time.perf_counter() - t0)
+                    else:
+                        print(f"[{time.asctime()}] No output after {timeout} seconds")
+                    p.terminate()
+                    try:
+                        p.wait(timeout=10)
+                    except Exception:
+                        p.kill()
+                    p.communicate()
+                return measurements
+
+            results = {}
+            if processor.zygote is not None:
+                # Inside the sandbox, the zygote and a new process can not have the same IP address at the same time
+                processor.zygote.stop()
+            results['process'] = measure(lambda: processor.run_in_sandbox([sys.executable, py_filename], tmpdir))
+
+            if processor.zygote is not None:
+                processor.zygote.start()
+                if processor.zygote.wait_until_ready():
+                    results['zygote'] = measure(lambda: processor.zygote.spawn(tmpdir, py_filename))
+            else:
+                print(f"[{time.asctime()}] The zygote is disabled (USE_ZYGOTE). Only measuring new processes.")
+
+        for mode, measurements in results.items():
+            if measurements:
+                print(f"{mode}: runs={len(measurements)} min={min(measurements):.3f}s median={statistics.median(measurements):.3f}s mean={statistics.mean(measurements):.3f}s max={max(measurements):.3f}s")
+            else:
+                print(f"{mode}: no measurements")
+
+    @app.cli.group("compile-cache")
+    def compile_cache():
+        """
+        Manage the cache of GRC files compiled by grcc.
+        """
+
+    @compile_cache.command("stats")
+    def compile_cache_stats():
+        """
+        Show the hits, misses and size of the compile cache.
+        """
+        from .compile_cache import CompileCache
+
+        cache = CompileCache(app.config['COMPILE_CACHE_DIRECTORY'], app.config['COMPILE_CACHE_MAX_BYTES'], os.environ.get('RELIA_GR_BLOCKS_PATH') or os.path.expanduser("~/.grc_gnuradio"))
+        print(json.dumps(cache.stats(), indent=4))
+
+    @compile_cache.command("purge")
+    def compile_cache_purge():
+        """
+        Remove every entry of the compile cache.
+        """
+        from .compile_cache import CompileCache
+
+        cache = CompileCache(app.config['COMPILE_CACHE_DIRECTORY'], app.config['COMPILE_CACHE_MAX_BYTES'], os.environ.get('RELIA_GR_BLOCKS_PATH') or os.path.expanduser("~/.grc_gnuradio"))
+        removed = cache.purge()
+        print(f"[{time.asctime()}] {removed} entries removed from {cache.directory}")
+
+    @compile_cache.command("prewarm")
+    @click.option("--directory", type=click.Path(exists=True, file_okay=False), default="examples")
+    def compile_cache_prewarm(directory: str):
+        """
+        Compile every GRC file in a directory (e.g., examples) so the next tasks using them skip grcc.
+        """
+        from .processor import Processor
+        from .grc_manager import GrcManager
+        from .scheduler import TaskAssignment
+
+        processor = Processor(running_single_task=True)
+        if processor.compile_cache is None:
+            print(f"[{time.asctime()}] The compile cache is disabled (USE_COMPILE_CACHE)")
+            return
+
+        for grc_filename in sorted(glob.glob(os.path.join(directory, '*.grc'))):
+            print(f"[{time.asctime()}] Compiling {grc_filename}...", flush=True)
+            grc_original_content = open(grc_filename).read()
+            grc_manager = GrcManager(grc_original_content, 'target_file', processor.default_hier_block_lib_dir)
+            device_data = TaskAssignment(sessionIdentifier="non.existing.session", taskIdentifier="invalid.task.id", maxTime=3600, file=os.path.basename(grc_filename), fileContent=grc_original_content, fileType="grc")
+            with tempfile.TemporaryDirectory(prefix='relia-') as tmpdir:
+                try:
+                    processor.compile_grc_filename_into_python(tmpdir, grc_manager, device_data, init_time=time.perf_counter())
+                except Exception as err:
+                    print(f"[{time.asctime()}] Error compiling {grc_filename}: {err}", flush=True)
+
+        print(json.dumps(processor.compile_cache.stats(), indent=4))
+
+    @app.cli.group("grc-cache")
+    def grc_cache():
+        """
+        Manage the cache of processed GRC files.
+        """
+
+    @grc_cache.command("stats")
+    def grc_cache_stats():
+        """
+        Show the size of the processed GRC cache.
+        """
+        from .grc_cache import ProcessedGrcCache
+
+        cache = ProcessedGrcCache(app.config['GRC_CACHE_DIRECTORY'], app.config['GRC_CACHE_MAX_MEMORY_BYTES'], app.config['GRC_CACHE_MAX_DISK_BYTES'])
+        print(json.dumps(cache.stats(), indent=4))
+
+    @grc_cache.command("purge")
+    def grc_cache_purge():
+        """
+        Remove every entry of the processed GRC cache.
+        """
+        from .grc_cache import ProcessedGrcCache
+
+        cache = ProcessedGrcCache(app.config['GRC_CACHE_DIRECTORY'], app.config['GRC_CACHE_MAX_MEMORY_BYTES'], app.config['GRC_CACHE_MAX_DISK_BYTES'])
+        removed = cache.purge()
+        print(f"[{time.asctime()}] {removed} entries removed from {cache.directory}")
+
+    @app.cli.command("benchmark-http")
+    @click.option("--requests", "number_of_requests", type=int, default=200)
+    @click.option("--delay", type=float, default=0, help="Latency added by the fake scheduler to every response (seconds)")
+    @click.option("--failure-rate", type=float, default=0, help="Ratio of responses that are a 503 error")
+    @click.option("--scheduler-url", default=None, help="Use a running scheduler instead of a local fake one")
+    def benchmark_http(number_of_requests: int, delay: float, failure_rate: float, scheduler_url: str):
+        """
+        Compare the task status requests with a new connection each time (requests.get) and with the
+        shared HttpTransport, against a local fake scheduler.
+        """
+        import requests
+        from .http_transport import HttpTransport
+        from .fake_scheduler import start_fake_scheduler
+
+        server = None
+        if scheduler_url is None:
+            server = start_fake_scheduler(delay=delay, failure_rate=failure_rate)
+            scheduler_url = server.base_url
+
+        url = f"{scheduler_url}scheduler/devices/tasks/{app.config['DEVICE_TYPE']}/benchmark.task"
+        headers = {'relia-device': app.config['DEVICE_ID'], 'relia-password': app.config['PASSWORD']}
+        transport = HttpTransport.from_config('scheduler', timeouts={'check_assignment_status': (5, 10)})
+
+        def measure(get):
+            measurements = []
+            errors = 0
+            for _ in range(number_of_requests):
+                t0 = time.perf_counter()
+                try:
+                    if get().status_code != 200:
+                        errors += 1
+                except Exception:
+                    errors += 1
+                measurements.append(time.perf_counter() - t0)
+            return measurements, errors
+
+        results = {
+            'requests.get': measure(lambda: requests.get(url, headers=headers, timeout=(30,30))),
+            'HttpTransport': measure(lambda: transport.get(url, 'check_assignment_status', headers=headers)),
+        }
+
+        for mode, (measurements, errors) in results.items():
+            print(f"{mode}: requests={len(measurements)} errors={errors} min={min(measurements) * 1000:.2f}ms median={statistics.median(measurements) * 1000:.2f}ms mean={statistics.mean(measurements) * 1000:.2f}ms max={max(measurements) * 1000:.2f}ms")
+
+        print(json.dumps(transport.stats(), indent=4))
+        transport.close()
+        if server is not None:
+            server.shutdown()
+
+    @app.cli.command("measure-cancellation")
+    @click.option("--runs", type=int, default=5)
+    @click.option("--events/--no-events", default=True, help="Whether the fake scheduler supports task status events")
+    @click.option("--remaining-time", type=float, default=60, help="Time until the deadline of the task when it is cancelled (seconds)")
+    def measure_cancellation(runs: int, events: bool, remaining_time: float):
+        """
+        Measure the time since a task is cancelled in a local fake scheduler until the runner is notified.
+        """
+        import threading
+        from .scheduler import SchedulerClient
+        from .task_status import watch_task_status
+        from .fake_scheduler import start_fake_scheduler
+
+        server = start_fake_scheduler(events=events)
+        scheduler = SchedulerClient(base_url=server.base_url)
+
+        measurements = []
+        for run in range(runs):
+            task_identifier = f"cancellation.task.{run}"
+            finished_event = threading.Event()
+            cancelled_event = threading.Event()
+            thread = threading.Thread(target=watch_task_status, args=(scheduler, task_identifier, finished_event, cancelled_event.set, time.perf_counter() + remaining_time), daemon=True)
+            thread.start()
+
+            # Cancel at a random point of the polling interval
+            time.sleep(1 + random.random())
+            t0 = time.perf_counter()
+            server.set_status(task_identifier, 'deleted')
+            if cancelled_event.wait(timeout=30):
+                measurements.append(time.perf_counter() - t0)
+            else:
+                print(f"[{time.asctime()}] The cancellation of {task_identifier} was not received")
+            finished_event.set()
+            thread.join()
+
+        server.shutdown()
+        if measurements:
+            print(f"{'events' if events else 'polling'}: runs={len(measurements)} min={min(measurements) * 1000:.1f}ms median={statistics.median(measurements) * 1000:.1f}ms mean={statistics.mean(measurements) * 1000:.1f}ms max={max(measurements) * 1000:.1f}ms")
+
+    @app.cli.command("load-test")
+    @click.option("--corpus", multiple=True, help="Directories, files or glob patterns of the tasks (.grc or .py) assigned. By default, examples/")
+    @click.option("--runners", type=int, default=1, help="Runners (flask process-tasks) started against the fake scheduler. With 0, it waits for external runners")
+    @click.option("--runner-command", default="flask process-tasks", help="Command of each runner")
+    @click.option("--host", default="127.0.0.1")
+    @click.option("--port", type=int, default=0, help="Port of the fake scheduler and uploader (by default, a random one)")
+    @click.option("--duration", type=float, default=600, help="Seconds of the test")
+    @click.option("--tasks", type=int, default=None, help="Stop after completing these tasks")
+    @click.option("--arrival-rate", type=float, default=None, help="Tasks per hour (Poisson arrivals). By default, a task whenever a runner asks")
+    @click.option("--max-time", type=float, default=60, help="maxTime of the tasks (seconds)")
+    @click.option("--delay", type=float, default=0, help="Latency added to every response (seconds)")
+    @click.option("--delay-jitter", type=float, default=0, help="Random latency up to this one added to every response (seconds)")
+    @click.option("--failure-rate", type=float, default=0, help="Ratio of responses that are a 503 error")
+    @click.option("--cancellation-rate", type=float, default=0, help="Ratio of tasks cancelled while running")
+    @click.option("--cancellation-delay", type=float, default=5, help="Tasks are cancelled up to these seconds after being assigned")
+    @click.option("--max-long-poll", type=float, default=None, help="Maximum wait of the get_assignments long polling (0: answer immediately)")
+    @click.option("--events/--no-events", default=True, help="Whether the fake scheduler supports task status events")
+    @click.option("--report-interval", type=float, default=30, help="Seconds between progress reports")
+    @click.option("--output", type=click.Path(dir_okay=False), default=None, help="JSON file for the final report")
+    def load_test(corpus, runners: int, runner_command: str, host: str, port: int, duration: float, tasks: Optional[int],
+                  arrival_rate: Optional[float], max_time: float, delay: float, delay_jitter: float, failure_rate: float,
+                  cancellation_rate: float, cancellation_delay: float, max_long_poll: Optional[float], events: bool,
+                  report_interval: float, output: Optional[str]):
+        """
+        Run runners against a local fake scheduler and uploader assigning the tasks of a corpus, and report
+        the tasks per hour, the turnaround and the idle gaps of the runners.
+        """
+        import shlex
+        import subprocess
+        from .fake_scheduler import load_corpus, start_fake_scheduler
+
+        root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        corpus_paths = list(corpus) or [os.path.join(root_directory, 'examples')]
+        tasks_corpus = load_corpus(corpus_paths)
+        if not tasks_corpus:
+            raise click.ClickException(f"No .grc or .py files found in {', '.join(corpus_paths)}")
+
+        server = start_fake_scheduler(host, port, delay=delay, failure_rate=failure_rate, events=events, delay_jitter=delay_jitter,
+                                      max_long_poll=max_long_poll, corpus=tasks_corpus, arrival_rate=arrival_rate, max_tasks=tasks,
+                                      max_time=max_time, cancellation_rate=cancellation_rate, cancellation_delay=cancellation_delay)
+        print(f"[{time.asctime()}] Fake scheduler and uploader in {server.base_url} with {len(tasks_corpus)} tasks in the corpus", flush=True)
+
+        directory = tempfile.mkdtemp(prefix='relia-load-test-')
+        device_type = app.config['DEVICE_TYPE'] or 'receiver'
+        processes = []
+        for runner in range(runners):
+            runner_directory = os.path.join(directory, f'runner-{runner}')
+            os.mkdir(runner_directory)
+            environment = dict(os.environ,
+                               SCHEDULER_BASE_URL=server.base_url,
+                               DATA_UPLOADER_BASE_URL=server.base_url,
+                               DEVICE_ID=f'load-test-{runner}:{device_type[0]}',
+                               DEVICE_TYPE=device_type,
+                               PASSWORD='password',
+                               WORKSPACES_DIRECTORY=os.path.join(runner_directory, 'workspaces'),
+                               DEVICE_INVENTORY='',
+                               METRICS_PORT='',
+                               # The outcomes in the report come from the timelines
+                               SEND_TASK_TIMELINES='1')
+            environment.setdefault('FLASK_APP', 'autoapp')
+            log_file = open(os.path.join(runner_directory, 'runner.log'), 'w')
+            process = subprocess.Popen(shlex.split(runner_command), env=environment, cwd=root_directory, stdout=log_file, stderr=subprocess.STDOUT)
+            processes.append((process, log_file))
+        if runners:
+            print(f"[{time.asctime()}] {runners} runners started (logs in {directory})", flush=True)
+
+        deadline = time.perf_counter() + duration
+        next_report = time.perf_counter() + report_interval
+        try:
+            while time.perf_counter() < deadline:
+                time.sleep(0.5)
+                summary = server.summary()
+                if tasks is not None and summary['completed'] >= tasks:
+                    break
+                if processes and all(process.poll() is not None for process, _ in processes):
+                    print(f"[{time.asctime()}] All the runners finished (see their logs in {directory})", flush=True)
+                    break
+                if time.perf_counter() >= next_report:
+                    next_report += report_interval
+                    print(f"[{time.asctime()}] served={summary['served']} completed={summary['completed']} cancelled={summary['cancelled']} tasks/hour={summary['tasks_per_hour']:.1f}", flush=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            summary = server.summary()
+            for process, _ in processes:
+                process.terminate()
+            for process, log_file in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                log_file.close()
+            server.shutdown()
+
+        report = json.dumps(summary, indent=4)
+        print(report)
+        if output:
+            with open(output, 'w') as f:
+                f.write(report)
+
+    # Every command accepts --import-time
+    commands = list(app.cli.commands.values())
+    while commands:
+        command = commands.pop()
+        if isinstance(command, click.Group):
+            commands.extend(command.commands.values())
+        else:
+            command.params.append(click.Option(["--import-time"], is_flag=True, expose_value=False, is_eager=True,
+                                               callback=_report_import_time,
+                                               help="Run the command with python -X importtime and report the slowest imports when it finishes"))
+
     return app
 
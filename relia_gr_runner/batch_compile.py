@@ -0,0 +1,168 @@
+"""
+Compilation of many GRC files at once (e.g., every lab of a course after a relia-blocks release, see
+compile-grc --batch) in a pool of processes.
+
+Each worker process has its own Processor (so its own GRC compiler service, if enabled), and shares the
+caches on disk with the rest. Every file is compiled in its own directory.
+"""
+import os
+import glob
+import time
+import logging
+import multiprocessing
+import multiprocessing.util
+import concurrent.futures
+import concurrent.futures.process
+
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .timeline import TaskTimeline, recording
+
+logger = logging.getLogger(__name__)
+
+class CompilationResult(NamedTuple):
+    grc_filename: str
+    directory: str
+    success: bool
+    # Why grcc stopped (see supervise), 'invalid' if the file did not pass the GrcValidator or 'error' if it could not run
+    reason: str
+    returncode: Optional[int]
+    seconds: float
+    # Whether the Python code came from the compile cache (so grcc did not run)
+    cache_hit: bool
+    # Milliseconds per phase (parse_yaml, rewrite, save, grcc...)
+    phases: Dict[str, float]
+    error: Optional[str]
+
+def find_grc_files(patterns: Iterable[str]) -> List[str]:
+    """
+    The .grc files in patterns: files, directories (searched recursively) or glob patterns.
+    """
+    filenames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            filenames.update(glob.glob(os.path.join(pattern, '**', '*.grc'), recursive=True))
+        else:
+            filenames.update(filename for filename in glob.glob(pattern, recursive=True) if os.path.isfile(filename))
+    return sorted(os.path.abspath(filename) for filename in filenames)
+
+def output_directories(grc_filenames: List[str], output_directory: str) -> Dict[str, str]:
+    """
+    A directory for each file inside output_directory, with the same structure as the files (e.g.,
+    labs/lab1/rx.grc is compiled in <output_directory>/lab1/rx when all the files are in labs/).
+    """
+    if not grc_filenames:
+        return {}
+    common = os.path.commonpath([os.path.dirname(filename) for filename in grc_filenames])
+    return {filename: os.path.join(output_directory, os.path.splitext(os.path.relpath(filename, common))[0]) for filename in grc_filenames}
+
+_worker_app = None
+_worker_processor = None
+
+def _initialize_worker(config: Dict):
+    global _worker_app, _worker_processor
+
+    from flask import Flask
+    from .logs import configure_logging
+    from .processor import Processor, SharedResources
+
+    _worker_app = Flask('relia_gr_runner')
+    _worker_app.config.update(config)
+    configure_logging(config['LOG_LEVEL'], config['LOG_FILENAME'])
+    with _worker_app.app_context():
+        _worker_processor = Processor(running_single_task=True, shared=SharedResources())
+        if _worker_processor.grc_compiler is not None and not _worker_processor.grc_compiler.wait_until_ready():
+            logger.warning("The GRC compiler service is not available. Using grcc.")
+        # The workers exit without running the atexit functions
+        if _worker_processor.compile_cache is not None:
+            multiprocessing.util.Finalize(_worker_processor.compile_cache, _worker_processor.compile_cache.flush_counters, exitpriority=10)
+        multiprocessing.util.Finalize(_worker_processor.shared, _worker_processor.shared.stop, exitpriority=0)
+
+def _compile(grc_filename: str, directory: str, timeout: float) -> CompilationResult:
+    from .grc_manager import GrcManager
+    from .grc_validator import format_errors
+    from .output_capture import truncate_message
+    from .supervision import EXITED
+
+    processor = _worker_processor
+    timeline = TaskTimeline(grc_filename)
+    t0 = time.perf_counter()
+    with _worker_app.app_context(), recording(timeline):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            grc_manager = GrcManager(open(grc_filename).read(), processor.target_filename, processor.default_hier_block_lib_dir, cache=processor.grc_cache)
+            errors = processor.validate_grc(grc_manager)
+            if errors:
+                reason, returncode, stdout, stderr = 'invalid', None, '', format_errors(errors)
+            else:
+                grc_manager.process()
+                reason, returncode, stdout, stderr = processor.compile_grc(directory, grc_manager, None, time.perf_counter() + timeout,
+                                                                           log_prefix=f"{os.path.basename(directory)}-grcc")
+        except Exception as err:
+            logger.error("Error compiling %s: %s", grc_filename, err)
+            reason, returncode, stdout, stderr = 'error', None, '', f"{type(err).__name__}: {err}"
+
+    timeline.finish()
+    phases = {name: phase['ms'] for name, phase in timeline.summary()['phases'].items()}
+    success = reason == EXITED and returncode == 0
+    error = None
+    if not success:
+        error = truncate_message(f"{stdout}\n{stderr}".strip(), _worker_app.config['ERROR_MESSAGE_MAX_BYTES']) or f"grcc stopped ({reason})"
+    return CompilationResult(grc_filename, directory, success, reason, returncode, time.perf_counter() - t0,
+                             # When the Python code is in the compile cache, grcc does not run
+                             cache_hit=success and processor.compile_cache is not None and 'grcc' not in phases,
+                             phases=phases, error=error)
+
+def compile_files(grc_filenames: List[str], output_directory: str, config: Dict, jobs: Optional[int] = None, timeout: float = 120) -> List[CompilationResult]:
+    """
+    Compile the files in a pool of jobs processes (by default, one per CPU) with the app config, each one
+    in its own directory inside output_directory (see output_directories).
+    """
+    output_directory = os.path.abspath(output_directory)
+    directories = output_directories(grc_filenames, output_directory)
+
+    config = dict(config)
+    # Every file is compiled in its own directory inside output_directory, which is the workspaces directory
+    config.update({
+        'WORKSPACES_DIRECTORY': output_directory,
+        'USE_ZYGOTE': False,
+        'USE_WORKSPACE_POOL': False,
+        'PLAN_FFT_WISDOM': False,
+        'PREFETCH_ASSIGNMENTS': False,
+        'METRICS_PORT': None,
+    })
+
+    results = []
+    # The parent might have threads (e.g., the logging one), so the workers do not fork it
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_initialize_worker, initargs=(config,)) as executor:
+        futures = {executor.submit(_compile, filename, directories[filename], timeout): filename for filename in grc_filenames}
+        for future in concurrent.futures.as_completed(futures):
+            filename = futures[future]
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                # E.g., the Processor of a worker could not start (see the log)
+                result = CompilationResult(filename, directories[filename], False, 'error', None, 0.0, False, {}, "The worker process stopped unexpectedly")
+            except Exception as err:
+                result = CompilationResult(filename, directories[filename], False, 'error', None, 0.0, False, {}, f"{type(err).__name__}: {err}")
+            logger.info("%s %s in %.2f seconds%s", 'Compiled' if result.success else 'Failed to compile', result.grc_filename, result.seconds, ' (cache hit)' if result.cache_hit else '')
+            results.append(result)
+
+    return sorted(results, key=lambda result: result.grc_filename)
+
+def report(results: List[CompilationResult], seconds: float, jobs: int, slowest: int = 10) -> Dict:
+    """
+    Machine readable summary of the results of compile_files.
+    """
+    return {
+        'files': len(results),
+        'succeeded': sum(1 for result in results if result.success),
+        'failed': sum(1 for result in results if not result.success),
+        'cache_hits': sum(1 for result in results if result.cache_hit),
+        'seconds': round(seconds, 3),
+        'jobs': jobs,
+        'slowest': [{'grc_filename': result.grc_filename, 'seconds': round(result.seconds, 3)}
+                    for result in sorted(results, key=lambda result: result.seconds, reverse=True)[:slowest]],
+        'results': [dict(result._asdict(), seconds=round(result.seconds, 3)) for result in results],
+    }
@@ -0,0 +1,260 @@
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import fcntl
+import threading
+import shutil
+import hashlib
+import functools
+import subprocess
+import contextlib
+
+from typing import Dict, Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# grcc writes absolute paths of the workspace (e.g. the blocks_file_sink files) in the generated code.
+# They are replaced by this placeholder in the cache, and back when the entry is copied into a new workspace.
+WORKSPACE_DIRECTORY_PLACEHOLDER = '**RELIA_REPLACE_WITH_WORKSPACE_DIRECTORY**'
+
+@functools.lru_cache(maxsize=None)
+def gnuradio_version() -> str:
+    """
+    Return the installed GNU Radio version without importing gnuradio.
+    """
+    try:
+        return subprocess.check_output(['gnuradio-config-info', '--version'], text=True, timeout=30).strip()
+    except Exception:
+        return 'unknown'
+
+def blocks_fingerprint(gr_blocks_path: str) -> str:
+    """
+    Return a hash of the block definitions installed in gr_blocks_path (typically by relia-blocks).
+
+    If any block.yml is added, removed or modified, the fingerprint changes.
+    """
+    fingerprint = hashlib.sha256()
+    for block_yml in sorted(glob.glob(os.path.join(gr_blocks_path, '*.block.yml'))):
+        try:
+            stat = os.stat(block_yml)
+        except FileNotFoundError:
+            continue
+        fingerprint.update(f"{os.path.basename(block_yml)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return fingerprint.hexdigest()
+
+class CompileCache:
+    """
+    CompileCache stores the Python files generated by grcc, indexed by a hash of the processed GRC file
+    and of the installed GNU Radio and relia-blocks versions. When it grows over max_bytes, the least
+    recently used entries are removed.
+
+    The counters (hits, misses...) are kept in memory and added to the ones shared in the cache directory every
+    counters_flush_interval seconds and at exit, so lookups do not lock and rewrite a file.
+    """
+    def __init__(self, directory: str, max_bytes: int, gr_blocks_path: str, counters_flush_interval: float = 60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.gr_blocks_path = gr_blocks_path
+        self.counters_flush_interval = counters_flush_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Counters not written to counters.json yet
+        self.pending_counters: Dict[str, int] = {}
+        self.counters_flushed_at = time.monotonic()
+        self.counters_lock = threading.Lock()
+        atexit.register(self.flush_counters)
+
+    @staticmethod
+    def from_config(gr_blocks_path: str) -> Optional["CompileCache"]:
+        """
+        Build the CompileCache from the Flask configuration, or return None if it is disabled.
+        """
+        if not current_app.config['USE_COMPILE_CACHE']:
+            return None
+        return CompileCache(current_app.config['COMPILE_CACHE_DIRECTORY'], current_app.config['COMPILE_CACHE_MAX_BYTES'], gr_blocks_path,
+                            current_app.config['COMPILE_CACHE_COUNTERS_FLUSH_INTERVAL'])
+
+    def key_for(self, grc_content: str, directory: str) -> str:
+        """
+        Return the cache key of a GRC file (as saved by GrcManager in directory).
+        """
+        key = hashlib.sha256()
+        key.update(grc_content.replace(directory, WORKSPACE_DIRECTORY_PLACEHOLDER).encode())
+        key.update(f"\ngnuradio:{gnuradio_version()}".encode())
+        key.update(f"\nrelia-blocks:{blocks_fingerprint(self.gr_blocks_path)}".encode())
+        return key.hexdigest()
+
+    def _entry_directory(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key: str, directory: str) -> bool:
+        """
+        If the key is in the cache, copy the cached Python files into directory and return True.
+        """
+        entry_directory = self._entry_directory(key)
+        try:
+            py_filenames = os.listdir(entry_directory)
+        except FileNotFoundError:
+            self._increment('misses')
+            return False
+
+        try:
+            for py_filename in py_filenames:
+                code = open(os.path.join(entry_directory, py_filename)).read()
+                open(os.path.join(directory, py_filename), 'w').write(code.replace(WORKSPACE_DIRECTORY_PLACEHOLDER, directory))
+        except FileNotFoundError:
+            # Evicted by other runner while reading it
+            self._increment('misses')
+            return False
+
+        # The modification time is used for the LRU eviction
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(entry_directory)
+
+        self._increment('hits')
+        return True
+
+    def store(self, key: str, directory: str) -> None:
+        """
+        Store the Python files generated by grcc in directory (the flowgraph and its embedded Python blocks, if any).
+        """
+        entry_directory = self._entry_directory(key)
+        tmp_directory = f"{entry_directory}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.mkdir(tmp_directory)
+        for py_filename in glob.glob(os.path.join(directory, '*.py')):
+            code = open(py_filename).read()
+            open(os.path.join(tmp_directory, os.path.basename(py_filename)), 'w').write(code.replace(directory, WORKSPACE_DIRECTORY_PLACEHOLDER))
+
+        try:
+            os.rename(tmp_directory, entry_directory)
+        except OSError:
+            # Other runner stored the same entry in the meanwhile
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+            return
+
+        self._increment('stores')
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for entry_directory in glob.glob(os.path.join(self.directory, '*')):
+            if not os.path.isdir(entry_directory) or entry_directory.endswith('.tmp'):
+                continue
+            try:
+                mtime = os.stat(entry_directory).st_mtime
+                size = sum(os.path.getsize(py_filename) for py_filename in glob.glob(os.path.join(entry_directory, '*.py')))
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, size, entry_directory))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache is below max_bytes. Return the number of entries removed.
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_directory in entries:
+            if total_size <= self.max_bytes:
+                break
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            total_size -= size
+            removed += 1
+
+        if removed:
+            self._increment('evictions', removed)
+        return removed
+
+    def purge(self) -> int:
+        """
+        Remove all the entries and counters. Return the number of entries removed.
+        """
+        entries = self._entries()
+        for _, _, entry_directory in entries:
+            shutil.rmtree(entry_directory, ignore_errors=True)
+        with self.counters_lock:
+            self.pending_counters.clear()
+        with self._locked_counters() as counters:
+            counters.clear()
+        return len(entries)
+
+    @contextlib.contextmanager
+    def _locked_counters(self, write: bool = True):
+        """
+        The counters are shared by all the runners using the same cache directory (e.g., receiver and transmitter).
+        If write, the changes to counters are saved.
+        """
+        counters_filename = os.path.join(self.directory, 'counters.json')
+        with open(os.path.join(self.directory, 'counters.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                counters = json.load(open(counters_filename))
+            except (FileNotFoundError, ValueError):
+                counters = {}
+
+            yield counters
+
+            if write:
+                tmp_filename = f"{counters_filename}.{os.getpid()}.tmp"
+                open(tmp_filename, 'w').write(json.dumps(counters))
+                os.replace(tmp_filename, counters_filename)
+
+    def _increment(self, counter: str, value: int = 1) -> None:
+        with self.counters_lock:
+            self.pending_counters[counter] = self.pending_counters.get(counter, 0) + value
+            flush = time.monotonic() - self.counters_flushed_at >= self.counters_flush_interval
+        if flush:
+            self.flush_counters()
+
+    def flush_counters(self) -> None:
+        """
+        Add the counters kept in memory to the shared ones.
+        """
+        with self.counters_lock:
+            pending, self.pending_counters = self.pending_counters, {}
+            self.counters_flushed_at = time.monotonic()
+        if not pending:
+            return
+
+        try:
+            with self._locked_counters() as counters:
+                for counter, value in pending.items():
+                    counters[counter] = counters.get(counter, 0) + value
+        except OSError as err:
+            logger.error("Error updating the compile cache counters: %s", err)
+            # They are added the next time
+            with self.counters_lock:
+                for counter, value in pending.items():
+                    self.pending_counters[counter] = self.pending_counters.get(counter, 0) + value
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the counters (the shared ones plus those of this runner not flushed yet) and the size of the cache.
+        """
+        with self._locked_counters(write=False) as shared_counters:
+            counters = dict(shared_counters)
+        with self.counters_lock:
+            for counter, value in self.pending_counters.items():
+                counters[counter] = counters.get(counter, 0) + value
+
+        stats = {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+        }
+
+        entries = self._entries()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['entries'] = len(entries)
+        stats['size_bytes'] = sum(size for _, size, _ in entries)
+        stats['max_bytes'] = self.max_bytes
+        return stats
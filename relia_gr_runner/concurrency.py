@@ -0,0 +1,179 @@
+import os
+import math
+import time
+import logging
+import queue
+import threading
+
+from typing import List, NamedTuple, Optional, Tuple
+
+from flask import current_app
+
+from .scheduler import TaskAssignment
+from .prefetch import PrefetchedTask
+from .timeline import recording
+
+logger = logging.getLogger(__name__)
+
+class ProcessLimits(NamedTuple):
+    """
+    Limits of a flowgraph process: CPU time (RLIMIT_CPU), cores where it can run and niceness, plus the IP
+    address of its sandbox (None: FIREJAIL_IP_ADDRESS).
+    """
+    max_cpu_seconds: Optional[int] = None
+    cores: Optional[List[int]] = None
+    niceness: Optional[int] = None
+    ip_address: Optional[str] = None
+
+    def wrap(self, command: List[str]) -> List[str]:
+        """
+        Return the command that runs command with the limits. They are set by prlimit, taskset and nice rather than
+        in a preexec_fn, which is not safe in the threads of the runner.
+        """
+        if self.niceness:
+            command = ['nice', '-n', str(self.niceness)] + command
+        if self.cores:
+            command = ['taskset', '-c', ','.join(str(core) for core in self.cores)] + command
+        if self.max_cpu_seconds:
+            command = ['prlimit', f'--cpu={self.max_cpu_seconds}:{self.max_cpu_seconds}'] + command
+        return command
+
+def assign_cores(cores: List[int], slots: int) -> Tuple[List[int], List[List[int]]]:
+    """
+    Split the cores between the hardware task and slots DSP tasks. If there are enough cores, each DSP task
+    gets the same number of the last cores and the hardware task the rest. Otherwise, the DSP tasks share
+    all but the first core, which is left for the hardware task.
+    """
+    cores = sorted(cores)
+    per_slot = max(1, len(cores) // (slots + 1))
+    if per_slot * slots < len(cores):
+        slot_cores = [cores[len(cores) - (slot + 1) * per_slot:len(cores) - slot * per_slot] for slot in range(slots)]
+    else:
+        shared_cores = cores[1:] or cores
+        slot_cores = [[shared_cores[-1 - slot % len(shared_cores)]] for slot in range(slots)]
+
+    dsp_cores = {core for assigned in slot_cores for core in assigned}
+    hardware_cores = [core for core in cores if core not in dsp_cores] or cores[:1]
+    return hardware_cores, slot_cores
+
+class ConcurrentTaskRunner:
+    """
+    Runs up to MAX_CONCURRENT_DSP_TASKS flowgraphs that do not use the hardware (see GrcManager.is_hardware_bound)
+    while the one that does (if any) holds the hardware.
+
+    Each DSP slot has its own Processor (so its own task state) with its own cores, CPU budget and sandbox IP
+    address (if given). New assignments are requested while there is a free slot. A flowgraph that uses the
+    hardware waits until the hardware is free; a DSP flowgraph without a free DSP slot runs as the hardware task.
+    """
+    def __init__(self, processor, slots: int, ip_addresses: Optional[List[str]] = None):
+        self.processor = processor
+        self.app = current_app._get_current_object()
+        self.hardware_lock = threading.Lock()
+        # The hardware task plus the DSP slots
+        self.capacity = threading.Semaphore(slots + 1)
+
+        hardware_cores, slot_cores = assign_cores(list(os.sched_getaffinity(0)), slots)
+        self.processor.process_limits = ProcessLimits(cores=hardware_cores)
+        self.free_slots: "queue.Queue" = queue.Queue()
+        for slot, cores in enumerate(slot_cores):
+            slot_processor = type(processor)(running_single_task=False, device=processor.device, shared=processor.shared)
+            # RLIMIT_CPU adds up the time of every thread, so by default a flowgraph can use all its cores until the deadline
+            max_cpu_seconds = current_app.config['DSP_TASK_CPU_SECONDS'] or math.ceil(current_app.config['MAX_GR_PYTHON_EXECUTION_TIME'] * len(cores)) + 1
+            slot_processor.process_limits = ProcessLimits(max_cpu_seconds=max_cpu_seconds,
+                                                          cores=cores, niceness=current_app.config['DSP_TASK_NICENESS'] or None,
+                                                          ip_address=ip_addresses[slot] if ip_addresses else None)
+            self.free_slots.put(slot_processor)
+
+        logger.info("Running up to %s DSP tasks at the same time (cores: %s; hardware task cores: %s)", slots, slot_cores, hardware_cores)
+
+    @staticmethod
+    def from_config(processor) -> Optional["ConcurrentTaskRunner"]:
+        """
+        Build the ConcurrentTaskRunner from the Flask configuration, or return None if tasks run one at a time.
+
+        The flowgraphs use the network (e.g., the RELIA blocks upload their data), so if every sandbox with
+        network uses the same IP address (firejail), each DSP slot needs its own (DSP_TASK_IP_ADDRESSES).
+        """
+        slots = current_app.config['MAX_CONCURRENT_DSP_TASKS']
+        if not slots:
+            return None
+
+        ip_addresses = [address.strip() for address in (current_app.config['DSP_TASK_IP_ADDRESSES'] or '').split(',') if address.strip()]
+        if processor.sandbox.exclusive_ip_address and len(ip_addresses) < slots:
+            logger.error("MAX_CONCURRENT_DSP_TASKS=%s needs an IP address per DSP task in DSP_TASK_IP_ADDRESSES with the %s sandbox (found %s). Running one task at a time.",
+                         slots, processor.sandbox.name, len(ip_addresses))
+            return None
+        return ConcurrentTaskRunner(processor, slots, ip_addresses if processor.sandbox.exclusive_ip_address else None)
+
+    def _run_task(self, processor, task: PrefetchedTask, on_finish):
+        with self.app.app_context():
+            try:
+                processor.run_task(task.device_data, task)
+            except Exception as err:
+                logger.exception("Uncaught error processing the task %s: %s", task.device_data.taskIdentifier, err)
+            finally:
+                try:
+                    processor.stop_scheduler_polling()
+                finally:
+                    on_finish()
+
+    def run_forever(self):
+        while True:
+            self.capacity.acquire()
+            try:
+                logger.info("%s requesting assignment...", self.processor.device_type.title())
+                fetch_start = time.perf_counter()
+                device_data: Optional[TaskAssignment] = self.processor.scheduler.get_assignments()
+                if not device_data:
+                    logger.error("Error trying to get assignments. Waiting a bit...")
+                    self.capacity.release()
+                    time.sleep(5)
+                    continue
+
+                if not device_data.taskIdentifier:
+                    logger.info("No assignments")
+                    self.processor.record_idle_time(time.perf_counter() - fetch_start)
+                    self.capacity.release()
+                    continue
+
+                task = PrefetchedTask(device_data, time.perf_counter(), self.processor.release_workspace, fetch_start, self.processor.device_id)
+                hardware_bound = True
+                if device_data.fileType != 'py':
+                    try:
+                        with recording(task.timeline):
+                            task.grc_manager = self.processor.create_grc_manager(device_data)
+                            hardware_bound = task.grc_manager.is_hardware_bound()
+                    except Exception as err:
+                        # The errors are reported when the task runs
+                        logger.error("Error classifying the task %s: %s", device_data.taskIdentifier, err)
+                        task.grc_manager = None
+
+                slot_processor = None
+                if not hardware_bound:
+                    try:
+                        slot_processor = self.free_slots.get_nowait()
+                    except queue.Empty:
+                        pass
+
+                if slot_processor is not None:
+                    logger.info("Task %s does not use the hardware. Running it on cores %s", device_data.taskIdentifier, slot_processor.process_limits.cores)
+
+                    def on_finish(slot_processor=slot_processor):
+                        self.free_slots.put(slot_processor)
+                        self.capacity.release()
+
+                    threading.Thread(target=self._run_task, args=(slot_processor, task, on_finish), daemon=True).start()
+                else:
+                    if not self.hardware_lock.acquire(blocking=False):
+                        logger.info("Task %s waiting for the hardware...", device_data.taskIdentifier)
+                        self.hardware_lock.acquire()
+
+                    def on_finish():
+                        self.hardware_lock.release()
+                        self.capacity.release()
+
+                    threading.Thread(target=self._run_task, args=(self.processor, task, on_finish), daemon=True).start()
+            except Exception as err:
+                logger.exception("Uncaught processing tasks: %s", err)
+                self.capacity.release()
+                time.sleep(2)
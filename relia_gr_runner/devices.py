@@ -0,0 +1,86 @@
+import os
+
+from typing import Dict, List, NamedTuple, Optional
+
+import yaml
+from flask import current_app
+
+DEVICE_TYPES = ('receiver', 'transmitter')
+
+class DeviceConfig(NamedTuple):
+    """
+    The identity of a device in the scheduler and the address of its hardware.
+    """
+    device_id: str
+    password: str
+    device_type: str
+    adalm_pluto_ip_address: Optional[str] = None
+    red_pitaya_ip_address: Optional[str] = None
+    red_pitaya_rate: Optional[str] = None
+
+    @staticmethod
+    def from_config() -> "DeviceConfig":
+        """
+        The device configured in the Flask configuration (DEVICE_ID, PASSWORD...), when there is only one.
+        """
+        return DeviceConfig(device_id=current_app.config['DEVICE_ID'],
+                            password=current_app.config['PASSWORD'],
+                            device_type=current_app.config['DEVICE_TYPE'],
+                            adalm_pluto_ip_address=current_app.config['ADALM_PLUTO_IP_ADDRESS'],
+                            red_pitaya_ip_address=current_app.config['RED_PITAYA_IP_ADDRESS'],
+                            red_pitaya_rate=current_app.config['RED_PITAYA_RATE'])
+
+    def rules_environment(self) -> Dict[str, Optional[str]]:
+        """
+        The values of grc_manager.RULES_ENVIRONMENT_VARIABLES for this device.
+        """
+        return {
+            'ADALM_PLUTO_IP_ADDRESS': self.adalm_pluto_ip_address,
+            'RED_PITAYA_IP_ADDRESS': self.red_pitaya_ip_address,
+            'RED_PITAYA_RATE': self.red_pitaya_rate,
+        }
+
+def load_inventory(filename: str) -> List[DeviceConfig]:
+    """
+    Load the devices of an inventory file (YAML or JSON), e.g.:
+
+        devices:
+          - device_id: uw-s1i1:r
+            password_env: RELIA_PASSWORD_S1I1_R
+            device_type: receiver
+            adalm_pluto_ip_address: ip:192.168.2.1
+          - device_id: uw-s1i1:t
+            password_env: RELIA_PASSWORD_S1I1_T
+            device_type: transmitter
+            adalm_pluto_ip_address: ip:192.168.3.1
+
+    Instead of password, password_env can be used to take it from an environment variable.
+    """
+    inventory = yaml.safe_load(open(filename)) or {}
+    fields = set(DeviceConfig._fields)
+    devices = []
+    for position, entry in enumerate(inventory.get('devices') or []):
+        entry = dict(entry)
+        password_env = entry.pop('password_env', None)
+        if password_env and 'password' not in entry:
+            entry['password'] = os.environ.get(password_env)
+
+        unknown = set(entry) - fields
+        if unknown:
+            raise Exception(f"Unknown fields in the device {position + 1} of {filename}: {', '.join(sorted(unknown))}")
+
+        missing = [field for field in ('device_id', 'password', 'device_type') if not entry.get(field)]
+        if missing:
+            raise Exception(f"Missing fields in the device {position + 1} of {filename}: {', '.join(missing)}")
+
+        if entry.get('red_pitaya_rate') is not None:
+            entry['red_pitaya_rate'] = str(entry['red_pitaya_rate'])
+        devices.append(DeviceConfig(**entry))
+
+    device_ids = [device.device_id for device in devices]
+    duplicated = sorted({device_id for device_id in device_ids if device_ids.count(device_id) > 1})
+    if duplicated:
+        raise Exception(f"Duplicated devices in {filename}: {', '.join(duplicated)}")
+    if not devices:
+        raise Exception(f"No devices in {filename}")
+    return devices
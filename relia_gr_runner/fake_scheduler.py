@@ -0,0 +1,416 @@
+"""
+Local fake of the RELIA Scheduler and data uploader HTTP APIs, used to benchmark and load test the runner
+without the real servers (see the load-test command).
+
+It assigns the tasks queued with assign() and, if it has a corpus (see load_corpus), new tasks from it:
+one whenever a device asks (as a saturated scheduler), or arriving at arrival_rate tasks per hour. If
+there is none, get_assignments waits (up to its max_seconds, as the real long polling request, or up to
+max_long_poll) and returns that there are none. Every task is reported as assigned until set_status()
+changes it, it is cancelled (with a probability of cancellation_rate, after up to cancellation_delay
+seconds) or it is completed. Status changes are also sent as server-sent events (unless events is False,
+as in schedulers without them). Every response can be delayed (delay plus up to delay_jitter seconds) or
+fail (with a probability of failure_rate). Error messages and data deletions are accepted.
+"""
+import os
+import glob
+import gzip
+import json
+import time
+import random
+import threading
+import statistics
+import collections
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import parse_qs
+
+class FakeSchedulerHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, as the real servers. Headers and body are written separately, so without
+    # TCP_NODELAY every response of a reused connection would wait for the delayed ACK of the client
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, content: Union[dict, Callable[[], dict]]):
+        """
+        Send content (if it is a function, what it returns, so it is not called if the request fails).
+        """
+        server: FakeSchedulerServer = self.server
+        with server.lock:
+            server.requests += 1
+
+        if server.delay or server.delay_jitter:
+            time.sleep(server.delay + random.uniform(0, server.delay_jitter))
+
+        if server.failure_rate and random.random() < server.failure_rate:
+            with server.lock:
+                server.failures += 1
+            status, content = 503, {'success': False, 'message': 'Service unavailable (fake failure)'}
+        else:
+            status = 200
+            if callable(content):
+                content = content()
+
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            return self.rfile.read(length)
+        return b''
+
+    def _send_event(self, content: dict):
+        # One chunk per event
+        event = f"data: {json.dumps(content)}\n\n".encode()
+        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_status_events(self, task_identifier: str):
+        server: FakeSchedulerServer = self.server
+        if not server.events:
+            self._respond_not_found()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        # The lock is only held to read the status, so a slow client does not block the rest of the server
+        sent_status = None
+        try:
+            while True:
+                with server.condition:
+                    status = server.get_status(task_identifier)
+                    if status == sent_status:
+                        server.condition.wait(timeout=server.heartbeat_interval)
+                        status = server.get_status(task_identifier)
+
+                if status != sent_status:
+                    sent_status = status
+                    self._send_event({'status': status})
+                    if status in ('deleted', 'completed'):
+                        break
+                else:
+                    heartbeat = b": heartbeat\n\n"
+                    self.wfile.write(f"{len(heartbeat):x}\r\n".encode() + heartbeat + b"\r\n")
+                    self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped listening
+            self.close_connection = True
+
+    def _respond_not_found(self):
+        body = json.dumps({'success': False, 'message': 'Not found'}).encode()
+        self.send_response(404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/').split('/')
+        if path[:3] == ['scheduler', 'devices', 'tasks'] and len(path) == 4:
+            query = parse_qs(self.path.split('?', 1)[1]) if '?' in self.path else {}
+            max_seconds = float(query.get('max_seconds', ['0'])[0])
+            device_id = self.headers.get('relia-device') or 'unknown'
+            self._respond(lambda: self.server.next_assignment(max_seconds, device_id) or {'success': True, 'taskIdentifier': None})
+        elif path[:3] == ['scheduler', 'devices', 'tasks'] and len(path) == 5:
+            self._respond({'success': True, 'status': self.server.get_status(path[4])})
+        elif path[:3] == ['scheduler', 'devices', 'tasks'] and len(path) == 6 and path[5] == 'events':
+            self._stream_status_events(path[4])
+        else:
+            self._respond_not_found()
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split('?')[0].strip('/').split('/')
+        if path[:3] == ['scheduler', 'devices', 'tasks'] and len(path) == 5 and path[3] != 'error_message':
+            try:
+                timeline = json.loads(body).get('timeline') if body else None
+            except ValueError:
+                timeline = None
+            self._respond(lambda: self.server.complete(path[4], timeline) or {'success': True})
+        elif path[:2] == ['api', 'upload']:
+            # Chunks of the files of the file sinks (see file_streaming.py)
+            data = gzip.decompress(body) if self.headers.get('Content-Encoding') == 'gzip' else body
+            self._respond(lambda: self.server.receive_file_chunk(len(data)) or {'success': True})
+        elif path[:4] == ['scheduler', 'devices', 'tasks', 'error_message'] and len(path) == 5:
+            self._respond(lambda: self.server.fail(path[4]) or {'success': True})
+        else:
+            self._respond({'success': True})
+
+    def do_DELETE(self):
+        self._respond({'success': True})
+
+def load_corpus(paths: List[str]) -> List[Tuple[str, str]]:
+    """
+    The (filename, content) of the .grc and .py files in paths (files, directories or glob patterns).
+    """
+    filenames: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, '*.grc')) + glob.glob(os.path.join(path, '*.py'))))
+        else:
+            filenames.extend(sorted(glob.glob(path)))
+
+    corpus = []
+    for filename in filenames:
+        with open(filename) as f:
+            corpus.append((os.path.basename(filename), f.read()))
+    return corpus
+
+def percentiles(samples: List[float]) -> Optional[Dict[str, float]]:
+    if not samples:
+        return None
+    if len(samples) > 1:
+        quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+        p50, p90, p99 = quantiles[49], quantiles[89], quantiles[98]
+    else:
+        p50 = p90 = p99 = samples[0]
+    return {'n': len(samples), 'min': min(samples), 'p50': p50, 'p90': p90, 'p99': p99, 'max': max(samples), 'mean': statistics.mean(samples)}
+
+class FakeSchedulerServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], delay: float = 0, failure_rate: float = 0, events: bool = True, heartbeat_interval: float = 15,
+                 delay_jitter: float = 0, max_long_poll: Optional[float] = None, corpus: Optional[List[Tuple[str, str]]] = None,
+                 arrival_rate: Optional[float] = None, max_tasks: Optional[int] = None, max_time: float = 60,
+                 cancellation_rate: float = 0, cancellation_delay: float = 5):
+        super().__init__(address, FakeSchedulerHandler)
+        self.delay = delay
+        self.delay_jitter = delay_jitter
+        self.failure_rate = failure_rate
+        self.events = events
+        self.heartbeat_interval = heartbeat_interval
+        self.max_long_poll = max_long_poll
+        self.corpus = corpus or []
+        self.max_tasks = max_tasks
+        self.max_time = max_time
+        self.cancellation_rate = cancellation_rate
+        self.cancellation_delay = cancellation_delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.streamed_bytes = 0
+        self.condition = threading.Condition()
+        self.statuses: Dict[str, str] = {}
+        # Assignments not taken yet, and when (time.perf_counter()) each task was assigned (queued), served
+        # to a device and completed
+        self.assignments: "collections.deque[dict]" = collections.deque()
+        self.created = 0
+        self.assigned_at: Dict[str, float] = {}
+        self.served_at: Dict[str, float] = {}
+        self.served_to: Dict[str, str] = {}
+        self.completed_at: Dict[str, float] = {}
+        self.cancelled: Dict[str, float] = {}
+        # The timeline summary sent by the runner when completing the task
+        self.timelines: Dict[str, dict] = {}
+        # The tasks with an error message delivered by the runner
+        self.failed: Set[str] = set()
+        self.started_at = time.perf_counter()
+
+        if self.corpus and arrival_rate:
+            threading.Thread(target=self._generate_arrivals, args=(arrival_rate,), daemon=True).start()
+        # Without an arrival rate, a corpus task is created whenever a device asks
+        self.on_demand = bool(self.corpus) and not arrival_rate
+
+    def assign(self, task_identifier: str, file_content: str, file_type: str = 'grc', max_time: float = 60,
+               session_identifier: str = 'fake.session'):
+        """
+        Queue a task, given to the next device asking for an assignment.
+        """
+        with self.condition:
+            self.assignments.append({
+                'success': True,
+                'taskIdentifier': task_identifier,
+                'sessionIdentifier': session_identifier,
+                'file': f'{task_identifier}.{file_type}',
+                'fileContent': file_content,
+                'filetype': file_type,
+                'maxTime': max_time,
+            })
+            self.assigned_at[task_identifier] = time.perf_counter()
+            self.condition.notify_all()
+
+    def _assign_from_corpus(self) -> bool:
+        """
+        Queue a random task of the corpus, unless max_tasks were already created. Called with the condition held.
+        """
+        if self.max_tasks is not None and self.created >= self.max_tasks:
+            return False
+        self.created += 1
+        filename, content = random.choice(self.corpus)
+        file_type = 'py' if filename.endswith('.py') else 'grc'
+        self.assign(f'fake.{self.created}.{os.path.splitext(filename)[0]}', content, file_type, self.max_time, f'fake.session.{self.created}')
+        return True
+
+    def _generate_arrivals(self, arrival_rate: float):
+        # Poisson arrivals of arrival_rate tasks per hour
+        while True:
+            time.sleep(random.expovariate(arrival_rate / 3600))
+            with self.condition:
+                if not self._assign_from_corpus():
+                    return
+
+    def next_assignment(self, max_seconds: float, device_id: str = 'unknown') -> Optional[dict]:
+        if self.max_long_poll is not None:
+            max_seconds = min(max_seconds, self.max_long_poll)
+        deadline = time.perf_counter() + max_seconds
+        with self.condition:
+            while not self.assignments:
+                if self.on_demand and self._assign_from_corpus():
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            assignment = self.assignments.popleft()
+            task_identifier = assignment['taskIdentifier']
+            self.served_at[task_identifier] = time.perf_counter()
+            self.served_to[task_identifier] = device_id
+
+        if self.cancellation_rate and random.random() < self.cancellation_rate:
+            timer = threading.Timer(random.uniform(0, self.cancellation_delay), self.cancel, (task_identifier,))
+            timer.daemon = True
+            timer.start()
+        return assignment
+
+    def cancel(self, task_identifier: str):
+        """
+        Cancel the task (as when the user cancels it), unless it was already completed.
+        """
+        with self.condition:
+            if task_identifier in self.completed_at:
+                return
+            self.cancelled[task_identifier] = time.perf_counter()
+            self.set_status(task_identifier, 'deleted')
+
+    def complete(self, task_identifier: str, timeline: Optional[dict] = None):
+        with self.condition:
+            self.completed_at.setdefault(task_identifier, time.perf_counter())
+            if timeline is not None:
+                self.timelines[task_identifier] = timeline
+        self.set_status(task_identifier, 'completed')
+
+    def fail(self, task_identifier: str):
+        with self.condition:
+            self.failed.add(task_identifier)
+
+    def get_outcome(self, task_identifier: str) -> Optional[str]:
+        """
+        How the task ended according to the timeline sent by the runner ('failed' if it delivered an error message
+        instead; None if it sent neither, see SEND_TASK_TIMELINES).
+        """
+        with self.condition:
+            timeline = self.timelines.get(task_identifier)
+            if timeline is None:
+                return 'failed' if task_identifier in self.failed else None
+            return timeline.get('outcome')
+
+    def wait_for_completion(self, task_identifier: str, timeout: float) -> Optional[float]:
+        """
+        Wait until the task is completed, and return the seconds since it was assigned (None if it timed out).
+        """
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            while task_identifier not in self.completed_at:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.completed_at[task_identifier] - self.assigned_at[task_identifier]
+
+    def get_status(self, task_identifier: str) -> str:
+        return self.statuses.get(task_identifier, 'receiver assigned')
+
+    def set_status(self, task_identifier: str, status: str):
+        """
+        Change the status of a task (e.g., 'deleted' as when the user cancels it) and notify the subscribers.
+        """
+        with self.condition:
+            self.statuses[task_identifier] = status
+            self.condition.notify_all()
+
+    def receive_file_chunk(self, length: int):
+        with self.lock:
+            self.streamed_bytes += length
+
+    def summary(self) -> Dict:
+        """
+        Throughput, turnaround (from being served to a device until completed), queue time (from being
+        assigned until served) and idle gaps of the devices (from completing a task until being served
+        the next one), in seconds.
+        """
+        with self.condition:
+            served_at = dict(self.served_at)
+            served_to = dict(self.served_to)
+            completed_at = dict(self.completed_at)
+            assigned_at = dict(self.assigned_at)
+            cancelled = set(self.cancelled)
+            timelines = dict(self.timelines)
+            pending = len(self.assignments)
+
+        elapsed = time.perf_counter() - self.started_at
+        completed = [task for task in completed_at if task in served_at]
+
+        tasks_by_device: Dict[str, List[str]] = {}
+        for task in sorted(served_at, key=served_at.get):
+            tasks_by_device.setdefault(served_to[task], []).append(task)
+
+        idle_gaps = []
+        devices = {}
+        for device_id, tasks in tasks_by_device.items():
+            gaps = [served_at[following] - completed_at[task] for task, following in zip(tasks, tasks[1:]) if task in completed_at]
+            idle_gaps.extend(gaps)
+            devices[device_id] = {'served': len(tasks), 'completed': sum(1 for task in tasks if task in completed_at), 'idle_gaps': percentiles(gaps)}
+
+        outcomes: Dict[str, int] = {}
+        for task in completed:
+            outcome = timelines.get(task, {}).get('outcome', 'unknown')
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        with self.lock:
+            requests, failures, streamed_bytes = self.requests, self.failures, self.streamed_bytes
+
+        return {
+            'elapsed_seconds': elapsed,
+            'served': len(served_at),
+            'completed': len(completed),
+            'cancelled': len(cancelled),
+            'pending': pending,
+            'tasks_per_hour': len(completed) / elapsed * 3600 if elapsed else 0,
+            'outcomes': outcomes,
+            'turnaround': percentiles([completed_at[task] - served_at[task] for task in completed]),
+            'queue_time': percentiles([served_at[task] - assigned_at[task] for task in served_at if task in assigned_at]),
+            'idle_gaps': percentiles(idle_gaps),
+            'devices': devices,
+            'requests': requests,
+            'injected_failures': failures,
+            'streamed_bytes': streamed_bytes,
+        }
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+def start_fake_scheduler(host: str = '127.0.0.1', port: int = 0, delay: float = 0, failure_rate: float = 0, events: bool = True, **kwargs) -> FakeSchedulerServer:
+    """
+    Start the fake scheduler in a background thread (on a random port by default). Stop it with shutdown().
+    The rest of the arguments are those of FakeSchedulerServer.
+    """
+    server = FakeSchedulerServer((host, port), delay, failure_rate, events, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import logging
+import fcntl
+import ctypes
+import ctypes.util
+import shutil
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import fft_wisdom_worker
+
+logger = logging.getLogger(__name__)
+
+# Where GNU Radio stores the FFTW wisdom (and the lock it uses while writing it)
+DEFAULT_WISDOM_FILENAME = os.path.expanduser('~/.gr_fftw_wisdom')
+
+# Sources of the CPU temperature, in millidegrees (Raspberry Pi and most Linux boards)
+THERMAL_ZONE_FILENAME = '/sys/class/thermal/thermal_zone0/temp'
+
+def wisdom_key(size: int, forward: bool = True, nthreads: int = 1, fft_type: str = 'complex') -> str:
+    """
+    Identifier of an FFT in the WisdomIndex. FFTW wisdom depends on the size, the direction, the number of threads
+    and whether the input is complex or float (a real to complex plan).
+    """
+    key = f"{'forward' if forward else 'reverse'}:{size}"
+    if nthreads != 1:
+        key += f":{nthreads}"
+    if fft_type == 'float':
+        key = f"float-{key}"
+    return key
+
+def _is_smooth(number: int) -> bool:
+    """
+    Whether all the prime factors of number are 2, 3, 5 or 7 (sizes that FFTW plans efficiently and are common).
+    """
+    for factor in (2, 3, 5, 7):
+        while number % factor == 0:
+            number //= factor
+    return number == 1
+
+def planning_order(sizes: Iterable[int]) -> List[int]:
+    """
+    Powers of two first, then the rest of the smooth sizes, then everything else, each group in increasing order.
+    """
+    def priority(size: int) -> Tuple[int, int]:
+        if size & (size - 1) == 0:
+            return 0, size
+        if _is_smooth(size):
+            return 1, size
+        return 2, size
+
+    return sorted(set(sizes), key=priority)
+
+class WisdomIndex:
+    """
+    Persistent index of the FFTs already planned in the wisdom file (key: seconds that the planning took).
+
+    It is stored next to the wisdom file, and considered empty if the wisdom file does not exist.
+    """
+    def __init__(self, wisdom_filename: str = DEFAULT_WISDOM_FILENAME):
+        self.wisdom_filename = wisdom_filename
+        self.filename = f"{wisdom_filename}.index.json"
+        self.entries: Dict[str, float] = {}
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if os.path.exists(self.wisdom_filename) and os.path.exists(self.filename):
+            try:
+                self.entries = json.load(open(self.filename))
+            except ValueError:
+                logger.warning("Corrupted FFT wisdom index %s. Ignoring it.", self.filename)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def missing(self, keys: Iterable[str]) -> List[str]:
+        return [key for key in keys if key not in self.entries]
+
+    def add(self, entries: Dict[str, float]):
+        """
+        Add entries and save the index (atomically, merging what other processes might have saved).
+        """
+        stored = {}
+        if os.path.exists(self.filename):
+            try:
+                stored = json.load(open(self.filename))
+            except ValueError:
+                pass
+        stored.update(self.entries)
+        stored.update(entries)
+        self.entries = stored
+
+        temporary_filename = f"{self.filename}.{os.getpid()}.tmp"
+        with open(temporary_filename, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temporary_filename, self.filename)
+
+class WisdomFileLock:
+    """
+    The lock GNU Radio takes (a fcntl lock on wisdom_filename.lock) while it reads or writes the wisdom.
+    """
+    def __init__(self, wisdom_filename: str):
+        self.lock_filename = f"{wisdom_filename}.lock"
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_filename, 'a')
+        fcntl.lockf(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+def _load_fftwf() -> ctypes.CDLL:
+    library = ctypes.CDLL(ctypes.util.find_library('fftw3f') or 'libfftw3f.so.3')
+    library.fftwf_import_wisdom_from_filename.argtypes = [ctypes.c_char_p]
+    library.fftwf_import_wisdom_from_filename.restype = ctypes.c_int
+    library.fftwf_export_wisdom_to_filename.argtypes = [ctypes.c_char_p]
+    library.fftwf_export_wisdom_to_filename.restype = ctypes.c_int
+    library.fftwf_forget_wisdom.argtypes = []
+    library.fftwf_forget_wisdom.restype = None
+    return library
+
+def merge_wisdom(wisdom_filename: str, sources: List[str]):
+    """
+    Merge the wisdom of the sources into wisdom_filename, replacing it atomically.
+
+    GNU Radio uses single precision FFTW, so libfftw3f is used to read and write the files.
+    """
+    fftwf = _load_fftwf()
+    with WisdomFileLock(wisdom_filename):
+        fftwf.fftwf_forget_wisdom()
+        if os.path.exists(wisdom_filename) and not fftwf.fftwf_import_wisdom_from_filename(wisdom_filename.encode()):
+            raise Exception(f"Could not read the FFTW wisdom in {wisdom_filename}")
+
+        for source in sources:
+            if not fftwf.fftwf_import_wisdom_from_filename(source.encode()):
+                logger.warning("Could not read the FFTW wisdom in %s. Skipping it.", source)
+
+        temporary_filename = f"{wisdom_filename}.{os.getpid()}.tmp"
+        if not fftwf.fftwf_export_wisdom_to_filename(temporary_filename.encode()):
+            raise Exception(f"Could not write the FFTW wisdom in {temporary_filename}")
+        os.replace(temporary_filename, wisdom_filename)
+        fftwf.fftwf_forget_wisdom()
+
+def read_temperature() -> Optional[float]:
+    try:
+        return int(open(THERMAL_ZONE_FILENAME).read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+class ResourceBudget:
+    """
+    Holds back new work while the CPU is too hot (degrees Celsius) or too loaded (1 minute load average).
+    """
+    def __init__(self, max_temperature: Optional[float] = None, max_load: Optional[float] = None, check_interval: float = 2):
+        self.max_temperature = max_temperature
+        self.max_load = max_load
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+
+    def exceeded(self) -> Optional[str]:
+        if self.max_temperature is not None:
+            temperature = read_temperature()
+            if temperature is not None and temperature > self.max_temperature:
+                return f"temperature {temperature:.1f}C > {self.max_temperature}C"
+        if self.max_load is not None:
+            load = os.getloadavg()[0]
+            if load > self.max_load:
+                return f"load {load:.2f} > {self.max_load}"
+        return None
+
+    def wait(self):
+        # Only one waiting thread checks, so they start one by one when the CPU is back within budget
+        with self.lock:
+            reason = self.exceeded()
+            if reason:
+                logger.info("Waiting for the CPU to be within budget (%s)...", reason)
+            while reason:
+                time.sleep(self.check_interval)
+                reason = self.exceeded()
+
+class WisdomGenerator:
+    """
+    Plans FFT sizes in parallel: each batch of sizes is planned by a worker process (fft_wisdom_worker)
+    with its own HOME (so its own wisdom file). Then, one at a time, each wisdom file is merged into the
+    main one and the planned sizes are added to the WisdomIndex, which works as a checkpoint: if the
+    generation is interrupted, the next run only plans what is missing.
+    """
+    def __init__(self, wisdom_filename: str = DEFAULT_WISDOM_FILENAME, jobs: Optional[int] = None, batch_size: int = 16,
+                 budget: Optional[ResourceBudget] = None):
+        self.wisdom_filename = wisdom_filename
+        self.jobs = jobs or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.budget = budget or ResourceBudget()
+        self.index = WisdomIndex(wisdom_filename)
+        self.timeout: Optional[float] = None
+
+    def _plan_batch(self, keys: List[str]) -> Tuple[str, Dict[str, float]]:
+        self.budget.wait()
+        home = tempfile.mkdtemp(prefix='relia-fft-wisdom-')
+        env = dict(os.environ)
+        env['HOME'] = home
+        command = [sys.executable, fft_wisdom_worker.__file__] + keys
+        try:
+            result = subprocess.run(command, env=env, stdout=subprocess.PIPE, universal_newlines=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("The FFTW wisdom worker did not finish in %s seconds. Stopped.", self.timeout)
+            return home, {}
+
+        planned = {}
+        for line in result.stdout.splitlines():
+            if line.startswith('planned '):
+                _, key, elapsed = line.split()
+                planned[key] = float(elapsed)
+
+        if result.returncode != 0:
+            logger.warning("The FFTW wisdom worker stopped with code %s after planning %s of %s sizes", result.returncode, len(planned), len(keys))
+        return home, planned
+
+    def generate(self, keys: Iterable[str], timeout: Optional[float] = None) -> int:
+        """
+        Plan the FFTs (see wisdom_key) that are not in the index yet. Return how many were planned.
+
+        If timeout is set, workers still planning after it are stopped (what they did is lost).
+        """
+        self.timeout = timeout
+        keys = self.index.missing(keys)
+        batches = [keys[position:position + self.batch_size] for position in range(0, len(keys), self.batch_size)]
+        logger.info("Planning %s FFTs in %s batches with %s processes", len(keys), len(batches), self.jobs)
+
+        total = 0
+        t0 = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self._plan_batch, batch) for batch in batches]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    home, planned = future.result()
+                    try:
+                        if planned:
+                            merge_wisdom(self.wisdom_filename, [os.path.join(home, '.gr_fftw_wisdom')])
+                            self.index.add(planned)
+                    finally:
+                        shutil.rmtree(home, ignore_errors=True)
+
+                    total += len(planned)
+                    slowest = max(planned, key=planned.get) if planned else None
+                    if slowest:
+                        logger.info("%s/%s FFTs planned (%.1f seconds). Slowest of the batch: %s (%.1f seconds)", total, len(keys), time.time() - t0, slowest, planned[slowest])
+                    else:
+                        logger.info("%s/%s FFTs planned (%.1f seconds)", total, len(keys), time.time() - t0)
+            except BaseException:
+                # Interrupted: what was merged is kept in the index, the rest is planned next time
+                for future in futures:
+                    future.cancel()
+                raise
+
+        return total
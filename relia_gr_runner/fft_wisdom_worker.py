@@ -0,0 +1,35 @@
+"""
+Worker of the FFTW wisdom generator (see fft_wisdom.py).
+
+It plans the FFTs of the given sizes with GNU Radio, which stores the wisdom in $HOME/.gr_fftw_wisdom,
+so each worker runs with its own HOME and the wisdom files are merged afterwards. It prints a line per
+plan: "planned <key> <seconds>", where key is "[float-]<forward|reverse>:<size>[:<nthreads>]" (float- for
+the FFTs of float inputs, planned as fft_vfc).
+
+    $ HOME=/tmp/worker-1 python fft_wisdom_worker.py forward:1024 forward:2048 reverse:1024 forward:4096:2 float-forward:1024
+"""
+import sys
+import time
+
+def plan(size: int, forward: bool, nthreads: int, float_input: bool = False) -> float:
+    # Imported here, since the runner imports this module to find the script
+    from gnuradio import fft
+    from gnuradio.fft import window
+
+    t0 = time.perf_counter()
+    if float_input:
+        # As the fft_vxx block of GRC builds it for type: float
+        fft.fft_vfc(size, forward, window.blackmanharris(size), nthreads)
+    else:
+        fft.fft_vcc(size, forward, window.blackmanharris(size), True, nthreads)
+    return time.perf_counter() - t0
+
+def main(keys):
+    for key in keys:
+        direction, size, *nthreads = key.split(':')
+        float_input = direction.startswith('float-')
+        elapsed = plan(int(size), direction.split('-')[-1] == 'forward', int(nthreads[0]) if nthreads else 1, float_input)
+        print(f"planned {key} {elapsed:.3f}", flush=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,227 @@
+"""
+Streaming of the files written by the file sinks of a flowgraph (in <workspace>/files, see
+GrcManager._apply_file_conversions) to the data uploader while the flowgraph runs, so large captures
+are neither kept in the workspace until the end of the task nor uploaded in a long step after it.
+
+The new bytes of each file are sent every interval in gzip chunks (each one a gzip member, so their
+concatenation is the compressed file) with their offset in the file, so retrying a chunk is safe.
+"""
+import os
+import gzip
+import time
+import ctypes
+import ctypes.util
+import logging
+import threading
+import contextvars
+
+from stat import S_ISREG
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from .http_transport import HttpTransport
+
+logger = logging.getLogger(__name__)
+
+# fallocate(2) flags to free the blocks of a range of a file without changing its size
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+_fallocate = None
+
+def release_range(fd: int, offset: int, length: int) -> bool:
+    """
+    Free the disk space of a range of a file already uploaded (the writer keeps writing after it, and reads
+    of the range return zeros). Return False if the platform or the filesystem does not support it.
+    """
+    global _fallocate
+    if _fallocate is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            _fallocate = libc.fallocate
+            _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+            _fallocate.restype = ctypes.c_int
+        except (OSError, AttributeError):
+            _fallocate = False
+    if not _fallocate or length <= 0:
+        return False
+    return _fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+class StreamedFile:
+    """
+    What has been read (offset) and uploaded of a file.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.offset = 0
+        self.uploaded_bytes = 0
+        self.compressed_bytes = 0
+        # Bytes over the limit of the task, which were not uploaded
+        self.dropped_bytes = 0
+        self.release_supported = True
+        # Not a regular file of the flowgraph (e.g., a link), so it is never uploaded
+        self.rejected = False
+
+class FileSinkStreamer:
+    """
+    Tails the files of directory in a background thread and uploads their new bytes to url_prefix/<filename>
+    until finish(), which uploads what is left and marks the files as complete.
+
+    At most max_bytes (uncompressed) are uploaded per task; the rest is dropped. If release_uploaded, the
+    disk space of what was uploaded (or dropped) is freed as it goes.
+    """
+    def __init__(self, directory: str, transport: HttpTransport, url_prefix: str, task_identifier: str, interval: float = 1,
+                 chunk_bytes: int = 1024 * 1024, max_bytes: int = 0, compression_level: int = 1, release_uploaded: bool = True):
+        self.directory = directory
+        self.transport = transport
+        self.url_prefix = url_prefix
+        self.task_identifier = task_identifier
+        self.interval = interval
+        self.chunk_bytes = chunk_bytes
+        self.max_bytes = max_bytes
+        self.compression_level = compression_level
+        self.release_uploaded = release_uploaded
+
+        self.files: Dict[str, StreamedFile] = {}
+        self.uploaded_bytes = 0
+        self.limit_reached = False
+
+        self.stop_event = threading.Event()
+        # It runs in a copy of the context, so its uploads are recorded in the timeline of the task
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def from_config(directory: str, transport: HttpTransport, uploader_base_url: str, session_id: str, device_id: str, task_identifier: str) -> Optional["FileSinkStreamer"]:
+        from flask import current_app
+
+        if not current_app.config['STREAM_FILE_SINKS'] or not uploader_base_url:
+            return None
+
+        url_prefix = uploader_base_url + f"api/upload/sessions/{quote(str(session_id), safe='')}/devices/{quote(device_id, safe='')}/tasks/{quote(task_identifier, safe='')}/files/"
+        return FileSinkStreamer(os.path.join(directory, 'files'), transport, url_prefix, task_identifier,
+                                interval=current_app.config['FILE_STREAMING_INTERVAL'],
+                                chunk_bytes=current_app.config['FILE_STREAMING_CHUNK_BYTES'],
+                                max_bytes=current_app.config['FILE_STREAMING_MAX_BYTES'],
+                                compression_level=current_app.config['FILE_STREAMING_COMPRESSION_LEVEL'],
+                                release_uploaded=current_app.config['FILE_STREAMING_RELEASE_UPLOADED'])
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as err:
+                logger.exception("Error streaming the files of %s: %s", self.directory, err)
+
+    def _upload(self, streamed_file: StreamedFile, data: bytes, final: bool) -> bool:
+        body = gzip.compress(data, compresslevel=self.compression_level)
+        params = {'offset': streamed_file.offset}
+        if final:
+            params.update({'final': 'true', 'size': streamed_file.offset + len(data), 'dropped': streamed_file.dropped_bytes})
+        try:
+            # The offset makes it idempotent: the uploader writes the chunk where it belongs
+            response = self.transport.post(self.url_prefix + quote(streamed_file.filename, safe=''), 'file_stream_chunk', idempotent=True, params=params, data=body,
+                                           headers={'Content-Type': 'application/octet-stream', 'Content-Encoding': 'gzip'})
+            response.raise_for_status()
+        except Exception as err:
+            logger.warning("Error uploading %s bytes of %s (offset %s): %s", len(data), streamed_file.filename, streamed_file.offset, err)
+            return False
+
+        streamed_file.uploaded_bytes += len(data)
+        streamed_file.compressed_bytes += len(body)
+        self.uploaded_bytes += len(data)
+        return True
+
+    def _stream(self, streamed_file: StreamedFile, final: bool):
+        path = os.path.join(self.directory, streamed_file.filename)
+        try:
+            # The flowgraph might replace the file by a link to a file of the runner (outside the sandbox)
+            fd = os.open(path, (os.O_RDWR if self.release_uploaded else os.O_RDONLY) | os.O_NOFOLLOW | os.O_NONBLOCK)
+        except OSError as err:
+            logger.warning("Error opening %s: %s. It is not uploaded.", path, err)
+            streamed_file.rejected = True
+            return
+
+        try:
+            stat = os.fstat(fd)
+            if not S_ISREG(stat.st_mode) or stat.st_nlink != 1:
+                logger.warning("%s is not a regular file with a single link. It is not uploaded.", path)
+                streamed_file.rejected = True
+                return
+            size = stat.st_size
+            while streamed_file.offset < size:
+                start = streamed_file.offset
+                last = False
+                if self.max_bytes and self.uploaded_bytes >= self.max_bytes:
+                    if not self.limit_reached:
+                        self.limit_reached = True
+                        logger.warning("The files of task %s are over %s bytes. The rest is not uploaded.", self.task_identifier, self.max_bytes)
+                    streamed_file.dropped_bytes += size - start
+                    streamed_file.offset = size
+                else:
+                    length = min(self.chunk_bytes, size - start)
+                    if self.max_bytes:
+                        length = min(length, self.max_bytes - self.uploaded_bytes)
+                    data = os.pread(fd, length, start)
+                    if not data:
+                        break
+                    last = final and start + len(data) >= size
+                    if not self._upload(streamed_file, data, last):
+                        # The same bytes are sent again the next time
+                        return
+                    streamed_file.offset += len(data)
+
+                if self.release_uploaded and streamed_file.release_supported:
+                    streamed_file.release_supported = release_range(fd, start, streamed_file.offset - start)
+                if last:
+                    return
+
+            if final:
+                # Nothing left (or everything dropped): an empty chunk marks the file as complete
+                self._upload(streamed_file, b'', final=True)
+        finally:
+            os.close(fd)
+
+    def poll(self, final: bool = False):
+        """
+        Upload the new bytes of every file (and, if final, mark them as complete).
+        """
+        try:
+            entries = [entry.name for entry in os.scandir(self.directory) if entry.is_file(follow_symlinks=False)]
+        except FileNotFoundError:
+            entries = []
+
+        for filename in sorted(entries):
+            streamed_file = self.files.get(filename)
+            if streamed_file is None:
+                streamed_file = self.files[filename] = StreamedFile(filename)
+            if not streamed_file.rejected:
+                self._stream(streamed_file, final)
+
+    def finish(self) -> Dict:
+        """
+        Stop the background thread, upload the tail of the files and return what was uploaded. Call it once the
+        flowgraph has stopped and before the workspace is removed.
+        """
+        t0 = time.perf_counter()
+        self.stop_event.set()
+        self.thread.join()
+        try:
+            self.poll(final=True)
+        except Exception as err:
+            logger.exception("Error uploading the tail of the files of %s: %s", self.directory, err)
+
+        summary = self.summary()
+        if self.files:
+            logger.info("Streamed %s files (%s bytes, %s compressed, %s dropped); the tail in %.2f seconds",
+                        len(self.files), summary['uploaded_bytes'], summary['compressed_bytes'], summary['dropped_bytes'], time.perf_counter() - t0)
+        return summary
+
+    def summary(self) -> Dict:
+        return {
+            'files': len(self.files),
+            'uploaded_bytes': self.uploaded_bytes,
+            'compressed_bytes': sum(streamed_file.compressed_bytes for streamed_file in self.files.values()),
+            'dropped_bytes': sum(streamed_file.dropped_bytes for streamed_file in self.files.values()),
+            'limit_reached': self.limit_reached,
+        }
@@ -0,0 +1,177 @@
+import os
+import glob
+import json
+import logging
+import contextlib
+import threading
+import collections
+
+from typing import Dict, List, NamedTuple, Optional
+
+from flask import current_app
+
+from .compile_cache import WORKSPACE_DIRECTORY_PLACEHOLDER
+
+logger = logging.getLogger(__name__)
+
+class ProcessedGrc(NamedTuple):
+    """
+    A GRC file as GrcManager saves it (with the workspace directory replaced by a placeholder), its FFT plans and
+    whether it uses the hardware.
+    """
+    grc: str
+    fft_plans: List[list]
+    hardware_bound: bool = True
+
+    def grc_for(self, directory: str) -> str:
+        return self.grc.replace(WORKSPACE_DIRECTORY_PLACEHOLDER, directory)
+
+    def size(self) -> int:
+        return len(self.grc) + 64 * len(self.fft_plans)
+
+class ProcessedGrcCache:
+    """
+    Students submit the same GRC file many times. ProcessedGrcCache keeps the result of processing it
+    (see GrcManager.cache_key) in memory and on disk, so GrcManager does not need to parse, rewrite and
+    serialize it again. Both are bounded (in bytes), removing the least recently used entries.
+    """
+    def __init__(self, directory: str, max_memory_bytes: int, max_disk_bytes: int):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.memory: "collections.OrderedDict[str, ProcessedGrc]" = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.counters: Dict[str, int] = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    @staticmethod
+    def from_config() -> Optional["ProcessedGrcCache"]:
+        """
+        Build the ProcessedGrcCache from the Flask configuration, or return None if it is disabled.
+        """
+        if not current_app.config['USE_GRC_CACHE']:
+            return None
+        return ProcessedGrcCache(current_app.config['GRC_CACHE_DIRECTORY'], current_app.config['GRC_CACHE_MAX_MEMORY_BYTES'], current_app.config['GRC_CACHE_MAX_DISK_BYTES'])
+
+    def _entry_filename(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key: str, processed_grc: ProcessedGrc):
+        # With the lock acquired
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key).size()
+        self.memory[key] = processed_grc
+        self.memory_bytes += processed_grc.size()
+        while self.memory_bytes > self.max_memory_bytes and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.size()
+
+    def lookup(self, key: str) -> Optional[ProcessedGrc]:
+        with self.lock:
+            processed_grc = self.memory.get(key)
+            if processed_grc is not None:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return processed_grc
+
+        entry_filename = self._entry_filename(key)
+        try:
+            entry = json.load(open(entry_filename))
+            processed_grc = ProcessedGrc(entry['grc'], entry['fft_plans'], entry.get('hardware_bound', True))
+        except (FileNotFoundError, ValueError, KeyError):
+            with self.lock:
+                self.counters['misses'] += 1
+            return None
+
+        # The modification time is used for the LRU eviction
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(entry_filename)
+
+        with self.lock:
+            self._remember(key, processed_grc)
+            self.counters['disk_hits'] += 1
+        return processed_grc
+
+    def store(self, key: str, grc: str, directory: str, fft_plans: List[list], hardware_bound: bool = True):
+        """
+        Store the GRC file as saved in directory, its FFT plans and whether it uses the hardware.
+        """
+        processed_grc = ProcessedGrc(grc.replace(directory, WORKSPACE_DIRECTORY_PLACEHOLDER), [list(plan) for plan in fft_plans], hardware_bound)
+        with self.lock:
+            self._remember(key, processed_grc)
+            self.counters['stores'] += 1
+
+        entry_filename = self._entry_filename(key)
+        tmp_filename = f"{entry_filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_filename, 'w') as f:
+                json.dump(processed_grc._asdict(), f)
+            os.replace(tmp_filename, entry_filename)
+        except OSError as err:
+            logger.error("Error storing the processed GRC file in the cache: %s", err)
+            return
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for entry_filename in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                stat = os.stat(entry_filename)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_filename))
+        return entries
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the disk cache is below max_disk_bytes. Return the number of entries removed.
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry_filename in entries:
+            if total_size <= self.max_disk_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry_filename)
+            total_size -= size
+            removed += 1
+
+        if removed:
+            with self.lock:
+                self.counters['evictions'] += removed
+        return removed
+
+    def purge(self) -> int:
+        """
+        Remove all the entries. Return the number of entries removed from disk.
+        """
+        entries = self._entries()
+        for _, _, entry_filename in entries:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry_filename)
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        return len(entries)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the counters (of this process) and the size of the cache.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self.memory)
+            stats['memory_bytes'] = self.memory_bytes
+
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        entries = self._entries()
+        stats['disk_entries'] = len(entries)
+        stats['disk_bytes'] = sum(size for _, size, _ in entries)
+        stats['max_memory_bytes'] = self.max_memory_bytes
+        stats['max_disk_bytes'] = self.max_disk_bytes
+        return stats
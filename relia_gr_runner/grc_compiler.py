@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import logging
+import signal
+import socket
+import select
+import subprocess
+
+from typing import Optional, Tuple
+
+from .compile_cache import blocks_fingerprint
+from .worker_service import WorkerService
+from . import grc_compiler_worker
+from .grc_compiler_worker import COMPILATION_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class CompilationRequest:
+    """
+    A compilation running in the GrcCompilerService.
+
+    It provides the same methods as subprocess.Popen that the Processor uses (poll, terminate, kill, wait
+    and communicate) so it can be supervised in the same way as the grcc process.
+    """
+    def __init__(self, connection: socket.socket, directory: str):
+        self.connection = connection
+        self.directory = directory
+        self.returncode: Optional[int] = None
+        self._stdout = ''
+        self._stderr = ''
+        self._response = b''
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+
+        try:
+            while True:
+                chunk = self.connection.recv(65536)
+                if not chunk:
+                    break
+                self._response += chunk
+        except BlockingIOError:
+            return None
+        except OSError as err:
+            self._finish(1, '', f"Error communicating with the GRC compiler service: {err}")
+            return self.returncode
+
+        try:
+            response = json.loads(self._response)
+        except ValueError:
+            self._finish(1, '', "The GRC compiler service closed the connection without a valid response")
+            return self.returncode
+
+        for py_filename, code in response.get('files', {}).items():
+            open(os.path.join(self.directory, os.path.basename(py_filename)), 'w').write(code)
+
+        self._finish(response.get('returncode', 1), response.get('stdout', ''), response.get('stderr', ''))
+        return self.returncode
+
+    def _finish(self, returncode: int, stdout: str, stderr: str):
+        self.returncode = returncode
+        self._stdout = stdout
+        self._stderr = stderr
+        self.connection.close()
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        t0 = time.time()
+        while self.poll() is None:
+            if timeout is not None and time.time() - t0 > timeout:
+                raise subprocess.TimeoutExpired('grc-compiler', timeout)
+            select.select([self.connection], [], [], 0.1)
+        return self.returncode
+
+    def terminate(self):
+        """
+        Closing the connection makes the compiling child fail when it replies, so it exits.
+        """
+        if self.returncode is None:
+            self._finish(-signal.SIGTERM, self._stdout, self._stderr)
+
+    def kill(self):
+        self.terminate()
+
+    def communicate(self) -> Tuple[str, str]:
+        self.wait()
+        return self._stdout, self._stderr
+
+class GrcCompilerService(WorkerService):
+    """
+    grcc loads every block definition (GNU Radio prefix and ~/.grc_gnuradio) every time it is called, which
+    is most of its running time. The GrcCompilerService keeps a worker process (grc_compiler_worker) which
+    loads the GRC platform once and forks a child for every compilation.
+
+    If the worker is not available (not started yet, crashed, or the GRC platform could not be loaded),
+    compile() returns None and the caller must use grcc.
+    """
+    name = 'grc-compiler'
+    worker_module = grc_compiler_worker
+
+    def __init__(self, gr_blocks_path: str, use_firejail: bool):
+        super().__init__(use_firejail)
+        self.gr_blocks_path = gr_blocks_path
+        self.blocks_fingerprint: Optional[str] = None
+
+    @staticmethod
+    def from_config(gr_blocks_path: str) -> Optional["GrcCompilerService"]:
+        """
+        Build the service from the Flask configuration, or return None if it is disabled.
+        """
+        from flask import current_app
+
+        if not current_app.config['USE_GRC_COMPILER_SERVICE']:
+            return None
+        return GrcCompilerService(gr_blocks_path, current_app.config['USE_FIREJAIL'])
+
+    def on_start(self):
+        self.blocks_fingerprint = blocks_fingerprint(self.gr_blocks_path)
+
+    def compile(self, directory: str, grc_filename: str) -> Optional[CompilationRequest]:
+        """
+        Send grc_filename to the worker. The generated Python files will be written in directory.
+        """
+        if not self.is_available():
+            return None
+
+        if blocks_fingerprint(self.gr_blocks_path) != self.blocks_fingerprint:
+            logger.warning("The blocks in %s changed. Restarting the GRC compiler service...", self.gr_blocks_path)
+            self.start()
+            return None
+
+        request = json.dumps({
+            'grc_content': open(grc_filename).read(),
+            'timeout': COMPILATION_TIMEOUT,
+        }).encode()
+
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.socket_path)
+            connection.sendall(request)
+            connection.shutdown(socket.SHUT_WR)
+        except OSError as err:
+            logger.error("Error connecting to the GRC compiler service: %s", err)
+            return None
+
+        connection.setblocking(False)
+        return CompilationRequest(connection, directory)
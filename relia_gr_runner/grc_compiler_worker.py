@@ -0,0 +1,202 @@
+"""
+Worker of the GrcCompilerService (see grc_compiler.py).
+
+It loads the GNU Radio Companion platform once and compiles every request in a forked child, so the state
+of a flowgraph never leaks into the next one. GRC runs code of the students while compiling (epy blocks
+and expressions), so the compilations run one at a time and, once a child finishes, every process it
+left behind is killed and the scratch directory is emptied before the next one starts.
+
+It only depends on the standard library and GNU Radio since it runs inside the sandbox, where the
+relia_gr_runner package is not available. It receives the listening socket as its stdin (see WorkerService):
+
+    $ python grc_compiler_worker.py
+"""
+import os
+import sys
+import glob
+import json
+import ctypes
+import ctypes.util
+import shutil
+import signal
+import socket
+import select
+import tempfile
+import traceback
+
+from typing import Dict
+
+# Maximum time that a single compilation can take inside the worker
+COMPILATION_TIMEOUT = 120
+
+READY_MESSAGE = 'relia-grc-compiler-ready'
+
+# prctl(2) option so the orphaned descendants of the children are reparented to the worker
+PR_SET_CHILD_SUBREAPER = 36
+
+def _compile_in_child(platform, connection: socket.socket, scratch_directory: str):
+    """
+    Run in a forked child of the worker: compile the GRC in the request and reply with the generated files.
+    """
+    request_data = b''
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        request_data += chunk
+
+    request = json.loads(request_data)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.alarm(request.get('timeout', COMPILATION_TIMEOUT))
+
+    directory = tempfile.mkdtemp(prefix='compilation-', dir=scratch_directory)
+    grc_filename = os.path.join(directory, 'user_file.grc')
+    open(grc_filename, 'w').write(request['grc_content'])
+
+    # Capture everything written by the GRC platform (errors are reported that way)
+    output_filename = os.path.join(directory, 'output.txt')
+    output_fd = os.open(output_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+
+    files: Dict[str, str] = {}
+    try:
+        _, py_filename = platform.load_and_generate_flow_graph(grc_filename, directory)
+        returncode = 0 if py_filename else 1
+    except Exception:
+        traceback.print_exc()
+        returncode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    if returncode == 0:
+        for py_filename in glob.glob(os.path.join(directory, '*.py')):
+            files[os.path.basename(py_filename)] = open(py_filename).read()
+
+    output = open(output_filename).read()
+    if returncode != 0 and not output:
+        output = 'Compilation error'
+
+    connection.sendall(json.dumps({
+        'returncode': returncode,
+        'files': files,
+        'stdout': output if returncode == 0 else '',
+        'stderr': output if returncode != 0 else '',
+    }).encode())
+    connection.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+def _become_subreaper():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+def _children():
+    """
+    Processes whose parent is this worker (with the subreaper, every orphaned descendant ends up here).
+    """
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open(f'/proc/{entry}/stat').read()
+        except OSError:
+            continue
+        # The name of the command (in parentheses) might contain spaces
+        if int(stat.rsplit(')', 1)[1].split()[1]) == os.getpid():
+            children.append(int(entry))
+    return children
+
+def _clean_up(pid: int, scratch_directory: str):
+    """
+    Wait for the child that compiled a request and kill whatever it left running.
+    """
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+    for _ in range(100):
+        children = _children()
+        if not children:
+            break
+        for child in children:
+            try:
+                os.kill(child, signal.SIGKILL)
+            except OSError:
+                pass
+        for child in children:
+            try:
+                os.waitpid(child, 0)
+            except ChildProcessError:
+                pass
+
+    for entry in os.listdir(scratch_directory):
+        path = os.path.join(scratch_directory, entry)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def serve():
+    """
+    Load the GRC platform once and compile every request in a forked child, one at a time.
+    """
+    from gnuradio import gr
+    from gnuradio.grc.core.platform import Platform
+
+    # Same as grcc
+    platform = Platform(
+        name='GNU Radio Companion Compiler',
+        prefs=gr.prefs(),
+        version=gr.version(),
+        version_parts=(gr.major_version(), gr.api_version(), gr.minor_version())
+    )
+    platform.build_library()
+
+    scratch_directory = os.getcwd()
+    _become_subreaper()
+
+    server = socket.socket(fileno=sys.stdin.fileno())
+    # The first connection is the runner's control connection (see WorkerService)
+    control, _ = server.accept()
+    control.sendall(f"{READY_MESSAGE}\n".encode())
+
+    while True:
+        readable, _, _ = select.select([server, control], [], [])
+        if control in readable and not control.recv(1):
+            # The runner closed the control connection (or died)
+            break
+
+        if server in readable:
+            connection, _ = server.accept()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                control.close()
+                exit_code = 0
+                try:
+                    os.setpgid(0, 0)
+                    _compile_in_child(platform, connection, scratch_directory)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+                finally:
+                    os._exit(exit_code)
+            connection.close()
+            _clean_up(pid, scratch_directory)
+
+    server.close()
+
+if __name__ == '__main__':
+    serve()
@@ -1,6 +1,11 @@
 import os
-import sys
-import time
+import ast
+import logging
+import hashlib
+import operator
+import threading
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 import yaml
 try:
@@ -10,88 +15,442 @@ except ImportError:
 
 from werkzeug.utils import secure_filename
 
+from .timeline import phase
+
+logger = logging.getLogger(__name__)
+
 # From gnuradio.core.Constants
 DEFAULT_HIER_BLOCK_LIB_DIR = os.path.expanduser('~/.grc_gnuradio')
 
+# Environment variables used by the rules (see BLOCK_RULES). They can be provided per device (see GrcManager)
+RULES_ENVIRONMENT_VARIABLES = ('ADALM_PLUTO_IP_ADDRESS', 'RED_PITAYA_IP_ADDRESS', 'RED_PITAYA_RATE')
+
+# Processed GRC files are cached with this in the key, so changing the rules invalidates them
+_RULES_FINGERPRINT = hashlib.sha256(open(__file__, 'rb').read()).hexdigest()
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+_FUNCTIONS = {
+    'int': int,
+    'round': round,
+    'min': min,
+    'max': max,
+}
+
+# Larger values (including intermediate results) are not evaluated by safe_eval, so a GRC file can not
+# make the runner build huge numbers
+MAX_EVALUATED_MAGNITUDE = 2 ** 64
+
+# FFTs planned in advance (see GrcManager.fft_plans). Larger sizes are left to the flowgraph itself
+MAX_PLANNED_FFT_SIZE = 2 ** 16
+MAX_PLANNED_FFT_THREADS = 16
+
+def safe_eval(expression: str, variables: Dict[str, str], evaluating: Optional[set] = None):
+    """
+    Evaluate a numeric GRC expression (numbers, arithmetic, int/round/min/max and other variables)
+    without running any code. Return None if it can not be evaluated this way.
+    """
+    evaluating = evaluating or set()
+
+    def evaluate(node):
+        value = _evaluate(node)
+        if abs(value) > MAX_EVALUATED_MAGNITUDE:
+            raise ValueError("Value too large")
+        return value
+
+    def _evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+            return node.value
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            left, right = evaluate(node.left), evaluate(node.right)
+            if isinstance(node.op, (ast.Pow, ast.LShift)) and abs(right) > 64:
+                raise ValueError("Exponent too large")
+            return _BINARY_OPERATORS[type(node.op)](left, right)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            return _UNARY_OPERATORS[type(node.op)](evaluate(node.operand))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and not node.keywords:
+            return _FUNCTIONS[node.func.id](*[evaluate(argument) for argument in node.args])
+        if isinstance(node, ast.Name) and node.id in variables and node.id not in evaluating:
+            value = safe_eval(variables[node.id], variables, evaluating | {node.id})
+            if value is None:
+                raise ValueError(f"Can not evaluate {node.id}")
+            return value
+        raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+    try:
+        return evaluate(ast.parse(str(expression).strip(), mode='eval'))
+    except (SyntaxError, ValueError, TypeError, ArithmeticError, MemoryError, RecursionError):
+        return None
+
+QT_TO_RELIA_CONVERSIONS = {
+    'qtgui_time_sink_x': 'relia_time_sink_x',
+    'qtgui_const_sink_x': 'relia_const_sink_x',
+    'qtgui_vector_sink_f': 'relia_vector_sink_f',
+    'qtgui_histogram_sink_x': 'relia_histogram_sink_x',
+    'variable_qtgui_range': 'variable_relia_range',
+    'variable_qtgui_check_box': 'variable_relia_check_box',
+    'variable_qtgui_push_button': 'variable_relia_push_button',
+    'variable_qtgui_chooser': 'variable_relia_chooser',
+    'qtgui_number_sink': 'relia_number_sink',
+    'eye_plot': 'relia_eye_plot_x',
+    'qtgui_freq_sink_x': 'relia_freq_sink_x',
+    'qtgui_auto_correlator_sink': 'relia_autocorr_sink',
+}
+
+class BlockRule(NamedTuple):
+    """
+    A rewrite of the blocks with any of block_ids. If needs_directory, it depends on the directory where
+    the GRC file is saved, so it only runs in save().
+    """
+    block_ids: Tuple[str, ...]
+    function: Callable[["GrcManager", dict, Optional[str]], None]
+    needs_directory: bool
+
+# Block id: rules for that block id, in registration order
+BLOCK_RULES: Dict[str, List[BlockRule]] = {}
+
+def block_rule(*block_ids: str, needs_directory: bool = False):
+    """
+    Register the decorated function(grc_manager, block, directory) as a BlockRule.
+    """
+    def decorator(function):
+        rule = BlockRule(block_ids, function, needs_directory)
+        for block_id in block_ids:
+            BLOCK_RULES.setdefault(block_id, []).append(rule)
+        return function
+    return decorator
+
+@block_rule(*QT_TO_RELIA_CONVERSIONS)
+def _apply_qt2relia_conversion(grc_manager: "GrcManager", block: dict, directory: Optional[str]):
+    """
+    Apply file conversions from QT blocks to Relia blocks
+    """
+    new_block_id = QT_TO_RELIA_CONVERSIONS[block['id']]
+    if new_block_id not in grc_manager.block_definitions:
+        block_yml = os.path.join(grc_manager.gr_blocks_path, f"{new_block_id}.block.yml")
+        logger.warning("The file %s does not exists. Have you recently installed relia-blocks?", block_yml)
+        raise Exception(f"The file {block_yml} does not exists. Have you recently installed relia-blocks?")
+    grc_manager.change_block_id(block, new_block_id)
+
+@block_rule('iio_pluto_sink', 'iio_pluto_source')
+def _apply_adalm_pluto(grc_manager: "GrcManager", block: dict, directory: Optional[str]):
+    """
+    If there is any ADALM Pluto module, reassign the IP address to the configured one.
+    """
+    block['parameters']['uri'] = f'"{grc_manager.environment.get("ADALM_PLUTO_IP_ADDRESS")}"'
+
+@block_rule('red_pitaya_sink', 'red_pitaya_source')
+def _apply_red_pitaya(grc_manager: "GrcManager", block: dict, directory: Optional[str]):
+    """
+    If there is any Red Pitaya module, reassign the IP address and rate to the configured ones.
+    """
+    block['parameters']['addr'] = f'"{grc_manager.environment.get("RED_PITAYA_IP_ADDRESS")}"'
+    block['parameters']['rate'] = f'{grc_manager.environment.get("RED_PITAYA_RATE")}'
+
+@block_rule('blocks_file_sink', needs_directory=True)
+def _apply_file_conversion(grc_manager: "GrcManager", block: dict, directory: Optional[str]):
+    """
+    Move the files written by file sinks to the files directory of the task
+    """
+    # Based on the original name, so the GRC can be saved in several directories
+    original_filename = grc_manager.original_files.setdefault(block['name'], block['parameters']['file'])
+    block['parameters']['file'] = os.path.join(directory, 'files', secure_filename(original_filename))
+
+class BlockDefinitionIndex:
+    """
+    In-memory index of the block definitions (*.block.yml) in a directory (and its subdirectories, if recursive,
+    as GRC loads them), so checking if a block exists does not touch the disk. It is rebuilt when the modification
+    time of the directory (or of one of its subdirectories) changes (a file is added, removed or renamed).
+    """
+    _indexes: Dict[Tuple[str, bool], "BlockDefinitionIndex"] = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path: str, recursive: bool = False):
+        self.path = path
+        self.recursive = recursive
+        self.mtime_ns: Optional[int] = None
+        # Modification time of every directory indexed, if recursive
+        self.directories: Dict[str, Optional[int]] = {}
+        self.block_ids = frozenset()
+        self.refresh()
+
+    @classmethod
+    def for_path(cls, path: str, recursive: bool = False) -> "BlockDefinitionIndex":
+        """
+        Shared index of path (built the first time).
+        """
+        path = os.path.abspath(path)
+        with cls._lock:
+            index = cls._indexes.get((path, recursive))
+            if index is None:
+                index = cls._indexes[path, recursive] = BlockDefinitionIndex(path, recursive)
+            return index
+
+    @staticmethod
+    def _mtime_ns(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def refresh(self):
+        mtime_ns = self._mtime_ns(self.path)
+        changed = mtime_ns != self.mtime_ns or mtime_ns is None
+        if self.recursive and not changed:
+            changed = any(self._mtime_ns(directory) != directory_mtime_ns for directory, directory_mtime_ns in self.directories.items())
+        if not changed:
+            return
+
+        if self.recursive:
+            self.directories = {}
+            block_ids = set()
+            for directory, _, filenames in os.walk(self.path):
+                self.directories[directory] = self._mtime_ns(directory)
+                block_ids.update(filename[:-len('.block.yml')] for filename in filenames if filename.endswith('.block.yml'))
+            self.block_ids = frozenset(block_ids)
+        else:
+            try:
+                filenames = os.listdir(self.path)
+            except OSError:
+                filenames = []
+            self.block_ids = frozenset(filename[:-len('.block.yml')] for filename in filenames if filename.endswith('.block.yml'))
+        self.mtime_ns = mtime_ns
+
+    def __contains__(self, block_id: str) -> bool:
+        return block_id in self.block_ids
+
+# Blocks that use a radio (or other hardware) of the device, by prefix of their id
+HARDWARE_BLOCK_PREFIXES = ('iio_', 'red_pitaya_', 'uhd_', 'soapy_', 'osmosdr_')
+
+def is_enabled(block: dict) -> bool:
+    return (block.get('states') or {}).get('state', True) not in (False, 'disabled')
+
+class FftPlan(NamedTuple):
+    """
+    An FFT that a flowgraph will plan with FFTW when it starts.
+    """
+    block: str
+    size: int
+    forward: bool
+    nthreads: int
+    window: str
+    # complex (fft_vcc) or float (fft_vfc, a real to complex plan)
+    fft_type: str
+
 class GrcManager:
     """
     GrcManager is a GNU Radio file parser that manages the utilities related to this file.
     """
-    def __init__(self, grc_serialized_content: str, target_filename: str = 'target_file', gr_blocks_path: str = DEFAULT_HIER_BLOCK_LIB_DIR):
-        self.grc_content = yaml.load(grc_serialized_content, Loader=Loader)
+    def __init__(self, grc_serialized_content: str, target_filename: str = 'target_file', gr_blocks_path: str = DEFAULT_HIER_BLOCK_LIB_DIR, cache=None,
+                 environment: Optional[Dict[str, Optional[str]]] = None):
+        self.grc_serialized_content = grc_serialized_content
+        # Values of RULES_ENVIRONMENT_VARIABLES (by default, from the environment)
+        self.environment: Dict[str, Optional[str]] = {name: os.environ.get(name) for name in RULES_ENVIRONMENT_VARIABLES}
+        self.environment.update(environment or {})
         self.target_filename = target_filename
         self.gr_blocks_path = gr_blocks_path
+        self.block_definitions = BlockDefinitionIndex.for_path(gr_blocks_path)
+        self.processed = False
+        # Block name: file parameter before _apply_file_conversion
+        self.original_files: Dict[str, str] = {}
 
-    def _apply_qt2relia_conversions(self):
-        """
-        Apply file conversions from QT blocks to Relia blocks
-        """
-        conversions = {
-            'qtgui_time_sink_x': 'relia_time_sink_x',
-            'qtgui_const_sink_x': 'relia_const_sink_x',
-            'qtgui_vector_sink_f': 'relia_vector_sink_f',
-            'qtgui_histogram_sink_x': 'relia_histogram_sink_x',
-            'variable_qtgui_range': 'variable_relia_range',
-            'variable_qtgui_check_box': 'variable_relia_check_box',
-            'variable_qtgui_push_button': 'variable_relia_push_button',
-            'variable_qtgui_chooser': 'variable_relia_chooser',
-            'qtgui_number_sink': 'relia_number_sink',      
-            'eye_plot': 'relia_eye_plot_x',      
-            'qtgui_freq_sink_x': 'relia_freq_sink_x',
-            'qtgui_auto_correlator_sink': 'relia_autocorr_sink',            
-        }
+        # A ProcessedGrcCache (see grc_cache.py). With it, the file is only parsed if it is not in the cache.
+        self.cache = cache
+        self._cache_key: Optional[str] = None
+        self._cache_lookup_done = False
+        self._cached_entry = None
+        self._grc_content: Optional[dict] = None
+        self._blocks_by_id: Optional[Dict[str, List[dict]]] = None
+        if cache is None:
+            self._parse()
 
-        for block in self.grc_content['blocks']:
-            if block['id'] in conversions:
-                block['id'] = conversions[block['id']]
-                block_yml = os.path.join(self.gr_blocks_path, f"{block['id']}.block.yml")
-                if not os.path.exists(block_yml):
-                    print(f"[{time.asctime()}] The file {block_yml} does not exists. Have you recently installed relia-blocks?", file=sys.stdout, flush=True)
-                    print(f"[{time.asctime()}] The file {block_yml} does not exists. Have you recently installed relia-blocks?", file=sys.stderr, flush=True)
-                    raise Exception(f"The file {block_yml} does not exists. Have you recently installed relia-blocks?")
+    def _parse(self):
+        with phase('parse_yaml'):
+            self._grc_content = yaml.load(self.grc_serialized_content, Loader=Loader)
+        self._blocks_by_id = {}
+        for block in self._grc_content['blocks']:
+            self._blocks_by_id.setdefault(block['id'], []).append(block)
+
+    @property
+    def grc_content(self) -> dict:
+        if self._grc_content is None:
+            self._parse()
+        return self._grc_content
+
+    @property
+    def blocks_by_id(self) -> Dict[str, List[dict]]:
+        if self._blocks_by_id is None:
+            self._parse()
+        return self._blocks_by_id
 
-    def _apply_adalm_pluto(self):
+    def cache_key(self) -> str:
         """
-        If there is any ADALM Pluto module, reassign the IP address to the configured one.
+        Hash of everything the processed file depends on: the original file, the target filename, the
+        block definitions available, the environment used by the rules and the rules themselves.
         """
-        for block in self.grc_content['blocks']:
-            if block['id'] in ('iio_pluto_sink', 'iio_pluto_source'):
-                block['parameters']['uri'] = f'"{os.environ.get("ADALM_PLUTO_IP_ADDRESS")}"'
+        if self._cache_key is None:
+            self.block_definitions.refresh()
+            key = hashlib.sha256(self.grc_serialized_content.encode())
+            key.update(repr((self.target_filename, self.block_definitions.path, self.block_definitions.mtime_ns, _RULES_FINGERPRINT)).encode())
+            key.update(repr([self.environment.get(name) for name in RULES_ENVIRONMENT_VARIABLES]).encode())
+            self._cache_key = key.hexdigest()
+        return self._cache_key
+
+    def _cached(self):
+        # Only while the file has not been parsed: otherwise it might have been changed
+        if self.cache is None or self._grc_content is not None:
+            return None
+        if not self._cache_lookup_done:
+            self._cached_entry = self.cache.lookup(self.cache_key())
+            self._cache_lookup_done = True
+        return self._cached_entry
 
-    def _apply_red_pitaya(self):
+    def from_cache(self) -> bool:
+        """
+        Whether the processed file is taken from the cache (so the file is not parsed).
         """
-        If there is any ADALM Pluto module, reassign the IP address to the configured one.
+        return self._cached() is not None
+
+    def change_block_id(self, block: dict, new_block_id: str):
+        self.blocks_by_id[block['id']].remove(block)
+        if not self.blocks_by_id[block['id']]:
+            del self.blocks_by_id[block['id']]
+        block['id'] = new_block_id
+        self.blocks_by_id.setdefault(new_block_id, []).append(block)
+
+    def variables(self) -> Dict[str, str]:
         """
+        Expressions of the variables and parameters of the flowgraph (by name).
+        """
+        variables = {}
         for block in self.grc_content['blocks']:
-            if block['id'] in ('red_pitaya_sink', 'red_pitaya_source'):
-                block['parameters']['addr'] = f'"{os.environ.get("RED_PITAYA_IP_ADDRESS")}"'
-                block['parameters']['rate'] = f'{os.environ.get("RED_PITAYA_RATE")}'
+            parameters = block.get('parameters') or {}
+            if (block['id'].startswith('variable') or block['id'] == 'parameter') and 'value' in parameters:
+                variables[block['name']] = parameters['value']
+        return variables
 
-    def process(self):
+    def fft_plans(self) -> List[FftPlan]:
         """
-        Process the YAML file. Called in save()
+        Every FFT size (and window) that the enabled fft_vxx and frequency sink blocks will use.
+
+        Sizes that can not be evaluated statically (e.g., they depend on a function call) are skipped.
         """
-        self.grc_content['options']['parameters']['id'] = self.target_filename
-        self.grc_content['options']['parameters']['generate_options'] = 'no_gui'
+        cached = self._cached()
+        if cached is not None:
+            return [FftPlan(*plan) for plan in cached.fft_plans]
+
+        variables = self.variables()
+        plans = []
+        blocks = [block for block_id in ('fft_vxx', 'qtgui_freq_sink_x', 'relia_freq_sink_x') for block in self.blocks_by_id.get(block_id, [])]
+        for block in blocks:
+            if not is_enabled(block):
+                continue
+
+            parameters = block.get('parameters') or {}
+            if block['id'] == 'fft_vxx':
+                size = safe_eval(parameters.get('fft_size'), variables)
+                forward = safe_eval(parameters.get('forward', 'True'), variables)
+                nthreads = safe_eval(parameters.get('nthreads', '1'), variables)
+                window = parameters.get('window', '')
+                fft_type = 'float' if parameters.get('type') == 'float' else 'complex'
+            elif block['id'] in ('qtgui_freq_sink_x', 'relia_freq_sink_x'):
+                size = safe_eval(parameters.get('fftsize'), variables)
+                forward, nthreads = True, 1
+                window = parameters.get('wintype', '')
+                # The sinks compute complex FFTs, also of float inputs
+                fft_type = 'complex'
+            else:
+                continue
 
-        self._apply_qt2relia_conversions()
-        self._apply_adalm_pluto()
-        self._apply_red_pitaya()
+            if isinstance(size, float) and size.is_integer():
+                size = int(size)
+            if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+                logger.warning("FFT size of %s can not be evaluated: %s", block['name'], parameters.get('fft_size') or parameters.get('fftsize'))
+                continue
+            if size > MAX_PLANNED_FFT_SIZE:
+                logger.warning("FFT size of %s (%s) is over %s. It is not planned in advance.", block['name'], size, MAX_PLANNED_FFT_SIZE)
+                continue
 
-    def _apply_file_conversions(self, directory: str):
+            nthreads = int(nthreads) if isinstance(nthreads, (int, float)) else 1
+            plans.append(FftPlan(block['name'], size, bool(forward) if forward is not None else True,
+                                 min(max(nthreads, 1), MAX_PLANNED_FFT_THREADS), str(window), fft_type))
+        return plans
+
+    def is_hardware_bound(self) -> bool:
         """
-        Apply file conversions to filesink and filesource
+        Whether any enabled block uses the hardware (see HARDWARE_BLOCK_PREFIXES). Otherwise the flowgraph
+        only does DSP, so it can run at the same time as other flowgraphs.
         """
-        for block in self.grc_content['blocks']:
-            if block['id'] == 'blocks_file_sink':
-                secured_filename = secure_filename(block['parameters']['file'])
-                block['parameters']['file'] = os.path.join(directory, 'files', secured_filename)
+        cached = self._cached()
+        if cached is not None:
+            return cached.hardware_bound
+
+        return any(block_id.startswith(HARDWARE_BLOCK_PREFIXES) and any(is_enabled(block) for block in blocks)
+                   for block_id, blocks in self.blocks_by_id.items())
+
+    def _rewrite(self, directory: Optional[str]):
+        """
+        Apply, in a single pass over the blocks with rules (see BLOCK_RULES), the rules of process() if
+        it has not been done yet, and the rules that need the directory if it is provided.
+        """
+        if self._grc_content is None:
+            # Parsed before, so the parse is not recorded as part of the rewrite
+            self._parse()
+        with phase('rewrite'):
+            self._apply_rules(directory)
+
+    def _apply_rules(self, directory: Optional[str]):
+        process = not self.processed
+        if process:
+            self.grc_content['options']['parameters']['id'] = self.target_filename
+            self.grc_content['options']['parameters']['generate_options'] = 'no_gui'
+            self.block_definitions.refresh()
+
+        # Rules are applied to the original block ids (the blocks might change their id)
+        for block_id in [block_id for block_id in self.blocks_by_id if block_id in BLOCK_RULES]:
+            rules = [rule for rule in BLOCK_RULES[block_id] if (process and not rule.needs_directory) or (rule.needs_directory and directory is not None)]
+            for block in list(self.blocks_by_id.get(block_id, [])):
+                for rule in rules:
+                    rule.function(self, block, directory)
+
+        self.processed = True
+
+    def process(self):
+        """
+        Process the YAML file. Called in save() (it is only applied once)
+        """
+        self._rewrite(None)
 
     def save(self, directory: str, filename: str):
         """
         Save the file with that filename in that directory
         """
         full_path = os.path.join(directory, filename)
-        self.process()
-        self._apply_file_conversions(directory)
-        open(full_path, 'w').write(yaml.dump(self.grc_content, Dumper=Dumper))
+        cached = self._cached()
+        if cached is not None:
+            with phase('save'):
+                open(full_path, 'w').write(cached.grc_for(directory))
+            return
+
+        self._rewrite(directory)
+        with phase('save'):
+            serialized = yaml.dump(self.grc_content, Dumper=Dumper)
+            open(full_path, 'w').write(serialized)
+        if self.cache is not None:
+            self.cache.store(self.cache_key(), serialized, directory, self.fft_plans(), self.is_hardware_bound())
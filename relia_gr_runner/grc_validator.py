@@ -0,0 +1,123 @@
+"""
+Static checks of GRC files, so broken flowgraphs are rejected in milliseconds instead of after setting up
+the sandbox and loading the GRC platform in grcc (whose errors are also hard to read for the users):
+
+- every block id is defined in a block.yml file of the blocks paths (or converted to a RELIA block that is),
+- the names of the blocks are unique,
+- the connections are between blocks of the flowgraph.
+
+Only what grcc itself rejects is checked, and only in the enabled blocks, as grcc does (e.g., an empty
+parameter is not an error: GRC evaluates it to None).
+"""
+import os
+import sys
+import logging
+
+from typing import Dict, List, NamedTuple, Optional
+
+from .grc_manager import QT_TO_RELIA_CONVERSIONS, BlockDefinitionIndex, is_enabled
+
+logger = logging.getLogger(__name__)
+
+# Blocks that GRC defines in Python, without a block.yml file
+BUILTIN_BLOCK_IDS = frozenset(('epy_block', 'epy_module', 'virtual_sink', 'virtual_source'))
+
+class GrcValidationError(NamedTuple):
+    # invalid_structure, duplicated_block, unknown_block or dangling_connection
+    kind: str
+    # Name of the block (None if it is not about a block)
+    block: Optional[str]
+    message: str
+
+def default_blocks_paths() -> List[str]:
+    """
+    Where GNU Radio installs the block.yml files of its blocks (plus GRC_BLOCKS_PATH, as grcc).
+    """
+    candidates = [path for path in os.environ.get('GRC_BLOCKS_PATH', '').split(os.pathsep) if path]
+    for prefix in (sys.prefix, '/usr/local', '/usr'):
+        candidates.append(os.path.join(prefix, 'share', 'gnuradio', 'grc', 'blocks'))
+    return list(dict.fromkeys(path for path in candidates if os.path.isdir(path)))
+
+def format_errors(errors: List[GrcValidationError]) -> str:
+    """
+    The errors as the message reported to the user.
+    """
+    lines = [f"Invalid GRC file ({len(errors)} {'error' if len(errors) == 1 else 'errors'}):"]
+    lines.extend(f"- [{error.kind}] {error.message}" for error in errors)
+    return '\n'.join(lines)
+
+class GrcValidator:
+    """
+    Checks GRC files against the block definitions of the RELIA blocks path and the GNU Radio blocks paths.
+
+    If no GNU Radio blocks path is found, only the RELIA blocks are checked to exist.
+    """
+    def __init__(self, relia_blocks_path: str, blocks_paths: List[str]):
+        self.relia_blocks_path = relia_blocks_path
+        self.blocks_paths = blocks_paths
+        # GRC loads the block.yml files of the subdirectories too
+        self.indexes: List[BlockDefinitionIndex] = [BlockDefinitionIndex.for_path(path, recursive=True) for path in [relia_blocks_path] + blocks_paths]
+
+    @staticmethod
+    def from_config(relia_blocks_path: str) -> Optional["GrcValidator"]:
+        from flask import current_app
+
+        if not current_app.config['USE_GRC_VALIDATOR']:
+            return None
+        configured_paths = current_app.config['GRC_BLOCKS_PATHS']
+        blocks_paths = [path for path in configured_paths.split(os.pathsep) if path] if configured_paths else default_blocks_paths()
+        if not blocks_paths:
+            logger.warning("No GNU Radio blocks path found (GRC_BLOCKS_PATHS). Only the RELIA blocks are checked to exist.")
+        return GrcValidator(relia_blocks_path, blocks_paths)
+
+    def _is_defined(self, block_id: str) -> bool:
+        return any(block_id in index for index in self.indexes)
+
+    def validate(self, grc_content) -> List[GrcValidationError]:
+        """
+        The errors of the (parsed) GRC file, before or after being processed by GrcManager.
+        """
+        if not isinstance(grc_content, dict) or not isinstance(grc_content.get('blocks'), list):
+            return [GrcValidationError('invalid_structure', None, "The file has no list of blocks")]
+
+        for index in self.indexes:
+            index.refresh()
+        check_every_block = bool(self.blocks_paths)
+
+        errors = []
+        # Enabled blocks by name. Connections to disabled blocks are valid (GRC ignores them)
+        names: Dict[str, dict] = {}
+        every_name = set()
+        for position, block in enumerate(grc_content['blocks']):
+            if not isinstance(block, dict) or not block.get('name') or not block.get('id'):
+                errors.append(GrcValidationError('invalid_structure', None, f"The block #{position + 1} has no name or id"))
+                continue
+            every_name.add(block['name'])
+            if not is_enabled(block):
+                continue
+            if block['name'] in names:
+                errors.append(GrcValidationError('duplicated_block', block['name'], f"There are several blocks named {block['name']}"))
+                continue
+            names[block['name']] = block
+
+        for name, block in names.items():
+            block_id = QT_TO_RELIA_CONVERSIONS.get(block['id'], block['id'])
+            if block_id in BUILTIN_BLOCK_IDS:
+                continue
+            if self._is_defined(block_id):
+                continue
+            if block_id != block['id']:
+                errors.append(GrcValidationError('unknown_block', name, f"{name}: {block['id']} is run as {block_id}, which is not installed in {self.relia_blocks_path}. Have you recently installed relia-blocks?"))
+            elif check_every_block or 'relia' in block_id:
+                errors.append(GrcValidationError('unknown_block', name, f"{name}: unknown block {block_id}"))
+
+        for connection in grc_content.get('connections') or []:
+            if not isinstance(connection, (list, tuple)) or len(connection) != 4:
+                errors.append(GrcValidationError('invalid_structure', None, f"Invalid connection: {connection}"))
+                continue
+            source, _, sink, _ = connection
+            for endpoint in (source, sink):
+                if endpoint not in every_name:
+                    errors.append(GrcValidationError('dangling_connection', None, f"The connection {source}:{connection[1]} -> {sink}:{connection[3]} uses the block {endpoint}, which does not exist"))
+
+        return errors
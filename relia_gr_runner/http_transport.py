@@ -0,0 +1,244 @@
+import time
+import logging
+import random
+import bisect
+import threading
+
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .timeline import phase
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the buckets of the latency histograms. The last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Responses which are worth retrying (the server is overloaded or restarting)
+RETRY_STATUS_CODES = (502, 503, 504)
+
+# (connect, read) timeout used for endpoints without their own
+DEFAULT_TIMEOUT = (5, 30)
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised without trying to connect when the server failed too many times in a row.
+    """
+
+class LatencyHistogram:
+    """
+    Cumulative histogram of request latencies, with the same buckets as a Prometheus histogram.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Upper bound of the bucket containing the q quantile (None if it is in the +Inf bucket or empty).
+        """
+        if not self.count:
+            return None
+        accumulated = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            accumulated += count
+            if accumulated >= q * self.count:
+                return bucket
+        return None
+
+    def to_dict(self) -> Dict:
+        cumulative = []
+        accumulated = 0
+        for bucket, count in zip(self.buckets + (float('inf'),), self.counts):
+            accumulated += count
+            cumulative.append(['+Inf' if bucket == float('inf') else bucket, accumulated])
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': cumulative,
+        }
+
+class CircuitBreaker:
+    """
+    After failure_threshold consecutive failures, the circuit opens and requests fail immediately
+    for reset_timeout seconds. Then a single request is let through (half open): if it succeeds the
+    circuit closes, otherwise it opens again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.failure_threshold and self.failures >= self.failure_threshold):
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker open after %s failures", self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class HttpTransport:
+    """
+    Shared HTTP transport: a requests.Session (so connections are kept alive and reused) with
+    per-endpoint timeouts, retries with exponential backoff and jitter, a circuit breaker and
+    per-endpoint latency histograms.
+
+    Idempotent requests are retried on connection errors, timeouts and 502/503/504. The rest are only
+    retried if the connection could not be established (so they were never sent).
+    """
+    def __init__(self, name: str, timeouts: Optional[Dict[str, Tuple[float, float]]] = None, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_max: float = 10, failure_threshold: int = 5, reset_timeout: float = 30,
+                 pool_size: int = 4):
+        self.name = name
+        self.timeouts = dict(timeouts or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.lock = threading.Lock()
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self.counters: Dict[str, int] = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0}
+
+    @staticmethod
+    def from_config(name: str, timeouts: Optional[Dict[str, Tuple[float, float]]] = None, pool_size: int = 4) -> "HttpTransport":
+        from flask import current_app
+
+        return HttpTransport(name, timeouts,
+                             max_retries=current_app.config['HTTP_MAX_RETRIES'],
+                             backoff_base=current_app.config['HTTP_BACKOFF_BASE'],
+                             backoff_max=current_app.config['HTTP_BACKOFF_MAX'],
+                             failure_threshold=current_app.config['HTTP_CIRCUIT_BREAKER_FAILURES'],
+                             reset_timeout=current_app.config['HTTP_CIRCUIT_BREAKER_RESET'],
+                             pool_size=pool_size)
+
+    def _observe(self, endpoint: str, elapsed: float, counter: Optional[str] = None):
+        with self.lock:
+            histogram = self.histograms.get(endpoint)
+            if histogram is None:
+                histogram = self.histograms[endpoint] = LatencyHistogram()
+            histogram.observe(elapsed)
+            if counter is not None:
+                self.counters[counter] += 1
+
+    def _count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Time to wait before the retry number attempt (1, 2...): exponential, with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def request(self, method: str, url: str, endpoint: str, idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        """
+        Perform a request. endpoint is the name used for the timeouts and the latency histograms.
+
+        Raise CircuitOpenError if the server is considered down, or the last error after the retries.
+
+        The request (with its retries) is recorded as a phase of the current task ({name}:{endpoint}).
+        """
+        with phase(f"{self.name}:{endpoint}"):
+            return self._request(method, url, endpoint, idempotent, **kwargs)
+
+    def _request(self, method: str, url: str, endpoint: str, idempotent: Optional[bool], **kwargs) -> requests.Response:
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+        kwargs.setdefault('timeout', self.timeouts.get(endpoint, DEFAULT_TIMEOUT))
+
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self._count('rejected')
+                raise CircuitOpenError(f"{self.name}: too many consecutive failures; not trying {method} {url}")
+
+            self._count('requests')
+            t0 = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                self._observe(endpoint, time.perf_counter() - t0, 'failures')
+                self.circuit_breaker.record_failure()
+                retriable = idempotent or isinstance(err, requests.exceptions.ConnectTimeout)
+                if not retriable or attempt >= self.max_retries:
+                    raise
+                error = str(err)
+            except BaseException:
+                # Any other error (e.g., an invalid response) also counts as a failure, or a half open
+                # circuit would never get the result of its trial request
+                self._observe(endpoint, time.perf_counter() - t0, 'failures')
+                self.circuit_breaker.record_failure()
+                raise
+            else:
+                self._observe(endpoint, time.perf_counter() - t0)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    self.circuit_breaker.record_success()
+                    return response
+
+                self._count('failures')
+                self.circuit_breaker.record_failure()
+                if not idempotent or attempt >= self.max_retries:
+                    return response
+                error = f"HTTP {response.status_code}"
+
+            attempt += 1
+            self._count('retries')
+            delay = self.backoff(attempt)
+            logger.warning("%s: %s %s failed (%s). Retrying in %.2f seconds (%s/%s)...", self.name, method, url, error, delay, attempt, self.max_retries)
+            time.sleep(delay)
+
+    def get(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def post(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, endpoint, **kwargs)
+
+    def delete(self, url: str, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, endpoint, **kwargs)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'name': self.name,
+                'circuit_breaker': self.circuit_breaker.state,
+                'counters': dict(self.counters),
+                'latency': {endpoint: histogram.to_dict() for endpoint, histogram in self.histograms.items()},
+            }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,109 @@
+"""
+Logging of the runner: every module logs with logging.getLogger(__name__), and the records are formatted
+as JSON lines and written by a background thread (see configure_logging), so logging never blocks a task
+on the disk.
+
+Each record includes the context of the task being processed in that thread (see log_context and set_phase).
+Threads started by a task must run in a copy of its context (contextvars.copy_context) to log with it.
+"""
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import contextlib
+import contextvars
+import logging.handlers
+
+from typing import Dict, Optional
+
+ROOT_LOGGER_NAME = 'relia_gr_runner'
+
+# Fields of the task being processed (device_id, task_id, session_id, phase...)
+_context: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar('relia_log_context', default={})
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Add the fields to the records logged inside the block (in this thread).
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def set_phase(phase: str):
+    """
+    Set the phase of the task (e.g., compile, run) in the current log context.
+    """
+    _context.set({**_context.get(), 'phase': phase})
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Runs in the thread that logs, so it captures its context
+        record.relia_context = _context.get()
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The records do not leave the process, so they are formatted by the listener (in its thread)
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'relia_context', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = 'INFO', filename: Optional[str] = None):
+    """
+    Send the records of the runner (at least of that level) to a queue, written as JSON lines to filename
+    (or stderr) by a background thread. Calling it again replaces the previous configuration.
+    """
+    global _listener
+
+    if filename:
+        sink = logging.FileHandler(filename)
+    else:
+        sink = logging.StreamHandler(sys.stderr)
+    sink.setFormatter(JsonFormatter())
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+
+    logger = logging.getLogger(ROOT_LOGGER_NAME)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    for previous_handler in list(logger.handlers):
+        logger.removeHandler(previous_handler)
+    logger.addHandler(handler)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(records, sink)
+    _listener.start()
+
+def stop_logging():
+    """
+    Write the pending records and stop the background thread.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,146 @@
+"""
+Metrics of the runner in the Prometheus text format, served in /metrics (see serve_metrics).
+
+Events (e.g., a task finished) are counted or observed in REGISTRY when they happen. The state of other
+components (e.g., the caches or the HTTP transports) is read when the metrics are scraped, by the
+collectors added with REGISTRY.add_collector.
+"""
+import logging
+import resource
+import threading
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .http_transport import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the buckets of the task phase histograms. The last bucket is +Inf
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# A metric read by a collector: (name, type, help, labels, value). The value of a histogram is LatencyHistogram.to_dict()
+Sample = Tuple[str, str, str, Dict[str, str], Union[float, Dict]]
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name: (type, help)
+        self.descriptions: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, LatencyHistogram]] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def inc(self, name: str, help: str, value: float = 1, **labels: str):
+        """
+        Add value to the counter name (with those labels).
+        """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.descriptions.setdefault(name, ('counter', help))
+            counter = self.counters.setdefault(name, {})
+            counter[key] = counter.get(key, 0) + value
+
+    def observe(self, name: str, help: str, value: float, buckets: Tuple[float, ...] = DURATION_BUCKETS, **labels: str):
+        """
+        Add value to the histogram name (with those labels).
+        """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.descriptions.setdefault(name, ('histogram', help))
+            histograms = self.histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = LatencyHistogram(buckets)
+            histogram.observe(value)
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        All the metrics in the Prometheus text exposition format (version 0.0.4).
+        """
+        # name: (type, help, [(labels, value)])
+        metrics: Dict[str, Tuple[str, str, List[Tuple[Dict[str, str], Union[float, Dict]]]]] = {}
+        with self.lock:
+            for name, values in self.counters.items():
+                metric_type, help = self.descriptions[name]
+                metrics[name] = (metric_type, help, [(dict(key), value) for key, value in values.items()])
+            for name, histograms in self.histograms.items():
+                metric_type, help = self.descriptions[name]
+                metrics[name] = (metric_type, help, [(dict(key), histogram.to_dict()) for key, histogram in histograms.items()])
+            collectors = list(self.collectors)
+
+        for collector in collectors:
+            try:
+                for name, metric_type, help, labels, value in collector():
+                    metrics.setdefault(name, (metric_type, help, []))[2].append((labels, value))
+            except Exception as err:
+                logger.exception("Error collecting metrics: %s", err)
+
+        lines = []
+        for name, (metric_type, help, samples) in sorted(metrics.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                if metric_type == 'histogram':
+                    for bucket, count in value['buckets']:
+                        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': str(bucket)})} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def resource_usage() -> Iterable[Sample]:
+    """
+    CPU time and peak RSS of the runner and of its finished subprocesses (grcc and the flowgraphs not
+    run by the zygote, which are children of the zygote instead).
+    """
+    for who, name in ((resource.RUSAGE_SELF, 'relia_runner_process'), (resource.RUSAGE_CHILDREN, 'relia_runner_subprocesses')):
+        usage = resource.getrusage(who)
+        yield (f'{name}_cpu_seconds_total', 'counter', 'User and system CPU time', {}, usage.ru_utime + usage.ru_stime)
+        # ru_maxrss is in kilobytes on Linux
+        yield (f'{name}_max_rss_bytes', 'gauge', 'Peak resident set size', {}, usage.ru_maxrss * 1024)
+
+REGISTRY = MetricsRegistry()
+REGISTRY.add_collector(resource_usage)
+
+def serve_metrics(app, host: str, port: int) -> Optional[threading.Thread]:
+    """
+    Serve the Flask app (and so its /metrics) in a background thread.
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        # Scraped every few seconds, so the requests are not logged
+        def log_request(self, *args, **kwargs):
+            pass
+
+    try:
+        server = make_server(host, port, app, threaded=True, request_handler=QuietRequestHandler)
+    except OSError as err:
+        logger.error("Error serving the metrics in %s:%s: %s", host, port, err)
+        return None
+
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.info("Serving the metrics in http://%s:%s/metrics", host, server.port)
+    return thread
@@ -0,0 +1,48 @@
+import time
+import logging
+import threading
+
+from typing import List
+
+from flask import current_app
+
+from .devices import DeviceConfig
+from .processor import Processor, SharedResources
+
+logger = logging.getLogger(__name__)
+
+class MultiDeviceRunner:
+    """
+    Runs the tasks of several devices (e.g., from an inventory, see load_inventory) in a single process.
+
+    Each device has its own Processor (its scheduler identity, hardware addresses and current task) running
+    in a thread, while GNU Radio is imported once and the caches, the FFTW wisdom, the services (compiler
+    and zygote), the workspaces and the HTTP connection pools are shared (see SharedResources). Idle, a
+    device is just a thread waiting on a long polling request.
+    """
+    def __init__(self, devices: List[DeviceConfig]):
+        self.devices = devices
+        self.app = current_app._get_current_object()
+        self.shared = SharedResources(number_of_devices=len(devices))
+        self.processors = [Processor(running_single_task=False, device=device, shared=self.shared) for device in devices]
+        self.threads: List[threading.Thread] = []
+
+    def _run(self, processor: Processor):
+        with self.app.app_context():
+            while True:
+                try:
+                    processor.run_forever()
+                except Exception as err:
+                    # run_forever handles the errors of the tasks, so this should not happen
+                    logger.exception("Device %s stopped: %s. Restarting it...", processor.device_id, err)
+                    time.sleep(5)
+
+    def run_forever(self):
+        for processor in self.processors:
+            logger.info("Starting the %s %s", processor.device_type, processor.device_id)
+            thread = threading.Thread(target=self._run, args=(processor,), name=f"device-{processor.device_id}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,187 @@
+import os
+import time
+import logging
+import threading
+import selectors
+
+from typing import Dict, Optional, Tuple
+
+from .supervision import SelectableEvent
+
+logger = logging.getLogger(__name__)
+
+class HeadTailBuffer:
+    """
+    Keeps the first head_bytes and the last tail_bytes written, and counts what was dropped in between.
+    """
+    def __init__(self, head_bytes: int, tail_bytes: int):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total_bytes = 0
+
+    def write(self, data: bytes):
+        self.total_bytes += len(data)
+        if len(self.head) < self.head_bytes:
+            missing = self.head_bytes - len(self.head)
+            self.head += data[:missing]
+            data = data[missing:]
+
+        if data:
+            self.tail += data
+            # Trimmed from time to time rather than in every write
+            if len(self.tail) > 2 * self.tail_bytes:
+                del self.tail[:-self.tail_bytes]
+
+    @property
+    def dropped_bytes(self) -> int:
+        return max(0, self.total_bytes - len(self.head) - min(len(self.tail), self.tail_bytes))
+
+    def text(self) -> str:
+        tail = self.tail[-self.tail_bytes:] if self.tail_bytes else b''
+        if self.dropped_bytes:
+            return self.head.decode(errors='replace') + f"\n[... {self.dropped_bytes} bytes omitted ...]\n" + bytes(tail).decode(errors='replace')
+        return (self.head + tail).decode(errors='replace')
+
+class RotatingLogFile:
+    """
+    Append-only file that is rotated (filename.1, filename.2...) when it grows over max_bytes.
+    """
+    def __init__(self, filename: str, max_bytes: int, backups: int):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(filename, 'ab')
+
+    def write(self, data: bytes):
+        if self.max_bytes and self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+
+    def rotate(self):
+        self.file.close()
+        for backup in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.filename}.{backup}"):
+                os.replace(f"{self.filename}.{backup}", f"{self.filename}.{backup + 1}")
+        if self.backups:
+            os.replace(self.filename, f"{self.filename}.1")
+        else:
+            os.remove(self.filename)
+        self.file = open(self.filename, 'ab')
+
+    def close(self):
+        self.file.close()
+
+def truncate_message(message: str, max_bytes: int) -> str:
+    """
+    Keep the beginning and the end of message, so it is at most (approximately) max_bytes long.
+    """
+    encoded = message.encode(errors='replace')
+    if len(encoded) <= max_bytes:
+        return message
+    half = max_bytes // 2
+    omitted = len(encoded) - 2 * half
+    return encoded[:half].decode(errors='replace') + f"\n[... {omitted} bytes omitted ...]\n" + encoded[-half:].decode(errors='replace')
+
+class OutputCapture:
+    """
+    Drains the stdout and stderr of a process in a background thread while it runs, so it never blocks
+    on a full pipe and its output is never fully kept in memory: only the head and the tail of each stream
+    are kept. Optionally, everything is also written to (rotating) log files.
+    """
+    def __init__(self, process, head_bytes: int, tail_bytes: int, log_prefix: Optional[str] = None, log_max_bytes: int = 0, log_backups: int = 0):
+        self.process = process
+        self.buffers: Dict[str, HeadTailBuffer] = {
+            'stdout': HeadTailBuffer(head_bytes, tail_bytes),
+            'stderr': HeadTailBuffer(head_bytes, tail_bytes),
+        }
+        self.log_files: Dict[str, RotatingLogFile] = {}
+        # time.perf_counter() when the process wrote for the first time (see first_output_time)
+        self.first_output_time: Optional[float] = None
+        if log_prefix is not None:
+            for stream_name in self.buffers:
+                try:
+                    self.log_files[stream_name] = RotatingLogFile(f"{log_prefix}.{stream_name}.log", log_max_bytes, log_backups)
+                except OSError as err:
+                    logger.error("Error opening the log file %s.%s.log: %s", log_prefix, stream_name, err)
+
+        # Processes such as the GRC compiler service do not have pipes, and return their output in communicate()
+        self.streams = {}
+        for stream_name in self.buffers:
+            stream = getattr(process, stream_name, None)
+            if stream is not None and hasattr(stream, 'fileno'):
+                self.streams[stream_name] = stream
+
+        self.stop_event = SelectableEvent()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def from_config(process, log_prefix: Optional[str] = None) -> "OutputCapture":
+        from flask import current_app
+
+        if current_app.config['TASK_LOGS_DIRECTORY'] is None:
+            log_prefix = None
+        elif log_prefix is not None:
+            os.makedirs(current_app.config['TASK_LOGS_DIRECTORY'], exist_ok=True)
+            log_prefix = os.path.join(current_app.config['TASK_LOGS_DIRECTORY'], log_prefix)
+
+        return OutputCapture(process, current_app.config['OUTPUT_HEAD_BYTES'], current_app.config['OUTPUT_TAIL_BYTES'],
+                             log_prefix, current_app.config['TASK_LOG_MAX_BYTES'], current_app.config['TASK_LOG_BACKUPS'])
+
+    def _write(self, stream_name: str, data: bytes):
+        if self.first_output_time is None and data:
+            self.first_output_time = time.perf_counter()
+        self.buffers[stream_name].write(data)
+        log_file = self.log_files.get(stream_name)
+        if log_file is not None:
+            try:
+                log_file.write(data)
+            except OSError as err:
+                logger.error("Error writing the log file %s: %s", log_file.filename, err)
+                self.log_files.pop(stream_name).close()
+
+    def _read(self):
+        selector = selectors.DefaultSelector()
+        for stream_name, stream in self.streams.items():
+            selector.register(stream.fileno(), selectors.EVENT_READ, stream_name)
+        selector.register(self.stop_event, selectors.EVENT_READ, None)
+
+        try:
+            while len(selector.get_map()) > 1:
+                for key, _ in selector.select():
+                    if key.data is None:
+                        return
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        self._write(key.data, data)
+                    else:
+                        selector.unregister(key.fd)
+        finally:
+            selector.close()
+
+    def communicate(self, timeout: float = 10) -> Tuple[str, str]:
+        """
+        Wait for the process and return the head and the tail of its stdout and stderr.
+
+        If some other process keeps the pipes open after the process has finished, the reader is stopped after timeout.
+        """
+        self.process.wait()
+        self.thread.join(timeout)
+        self.stop_event.set()
+        self.thread.join()
+
+        if self.streams:
+            for stream in self.streams.values():
+                stream.close()
+        else:
+            stdout, stderr = self.process.communicate()
+            self._write('stdout', (stdout or '').encode())
+            self._write('stderr', (stderr or '').encode())
+
+        for log_file in self.log_files.values():
+            log_file.close()
+        self.stop_event.close()
+
+        return self.buffers['stdout'].text(), self.buffers['stderr'].text()
@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+
+from typing import Callable, Optional
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from .scheduler import TaskAssignment
+from .grc_manager import GrcManager
+from .supervision import EXITED
+from .logs import log_context
+from .timeline import TaskTimeline, recording
+
+logger = logging.getLogger(__name__)
+
+class PrefetchedTask:
+    """
+    A task assigned to this device while the previous one was running.
+
+    If it was prepared, directory contains its GRC already processed (by grc_manager) and compiled.
+    Otherwise both are None and it is prepared as any other task when it runs.
+
+    fetch_start is when the assignment was requested (time.perf_counter()), recorded in its timeline.
+    """
+    def __init__(self, device_data: TaskAssignment, init_time: float, release_workspace: Callable[[str], None],
+                 fetch_start: Optional[float] = None, device_id: Optional[str] = None):
+        self.device_data = device_data
+        self.init_time = init_time
+        self.timeline = TaskTimeline(device_data.taskIdentifier, device_data.sessionIdentifier, device_id)
+        if fetch_start is not None:
+            self.timeline.record('assignment_fetch', fetch_start, init_time)
+        self.release_workspace = release_workspace
+        self.directory: Optional[str] = None
+        self.grc_manager: Optional[GrcManager] = None
+
+    def discard(self):
+        if self.directory is not None:
+            self.release_workspace(self.directory)
+            self.directory = None
+
+class Prefetcher:
+    """
+    While a flowgraph runs, the Prefetcher requests the next assignment and prepares it (processing and
+    compiling the GRC, and planning its FFTs) in a second workspace, so it starts right after the current task finishes.
+
+    The scheduler assigns the task to this device as soon as it is received, so its time (maxTime) starts
+    counting then. If it is cancelled (deleted or completed) before the current task finishes, its workspace
+    is discarded and it is never run.
+    """
+    def __init__(self, processor):
+        self.processor = processor
+        self.app = current_app._get_current_object()
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+        self.prefetched: Optional[PrefetchedTask] = None
+
+    def start(self):
+        """
+        Start requesting the next assignment in the background (called once the flowgraph is running).
+        """
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.prefetched = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                while not self.stop_event.is_set():
+                    fetch_start = time.perf_counter()
+                    device_data: Optional[TaskAssignment] = self.processor.scheduler.get_assignments()
+                    if device_data and device_data.taskIdentifier:
+                        self.prefetched = PrefetchedTask(device_data, time.perf_counter(), self.processor.release_workspace,
+                                                         fetch_start, self.processor.device_id)
+                        with log_context(device_id=self.processor.device_id, task_id=device_data.taskIdentifier,
+                                         session_id=device_data.sessionIdentifier, phase='prefetch'), recording(self.prefetched.timeline):
+                            logger.info("Task %s prefetched.", device_data.taskIdentifier)
+                            self._prepare(self.prefetched)
+                        return
+
+                    if not device_data:
+                        self.stop_event.wait(5)
+            except Exception as err:
+                logger.exception("Error prefetching the next assignment: %s", err)
+
+    def _prepare(self, prefetched: PrefetchedTask):
+        device_data = prefetched.device_data
+        if device_data.fileType == 'py':
+            # Nothing to compile
+            return
+
+        t0 = time.perf_counter()
+        grc_manager = self.processor.create_grc_manager(device_data)
+        if self.processor.validate_grc(grc_manager):
+            # The errors are reported when the task runs
+            logger.warning("Task %s is not valid. It is not prepared in advance.", device_data.taskIdentifier)
+            return
+
+        directory = self.processor.create_workspace()
+        reason, returncode, _, _ = self.processor.compile_grc(directory, grc_manager, None, prefetched.init_time + device_data.maxTime,
+                                                              log_prefix=f"{secure_filename(device_data.taskIdentifier)}-prefetch-grcc")
+        if reason != EXITED or returncode != 0:
+            # The errors are reported when the task runs, by compiling it again in a clean workspace
+            logger.warning("Task %s could not be prepared in advance.", device_data.taskIdentifier)
+            self.processor.release_workspace(directory)
+            return
+
+        self.processor.plan_fft_wisdom(grc_manager)
+
+        prefetched.directory = directory
+        prefetched.grc_manager = grc_manager
+        logger.info("Task %s prepared in %s in %.2f seconds.", device_data.taskIdentifier, directory, time.perf_counter() - t0)
+
+    def take(self) -> Optional[PrefetchedTask]:
+        """
+        Stop prefetching and return the prefetched task, waiting for it to be prepared. Return None if there
+        is none, or if it was cancelled meanwhile (in which case it is rolled back).
+        """
+        if self.thread is None:
+            return None
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        prefetched, self.prefetched = self.prefetched, None
+        if prefetched is None:
+            return None
+
+        task_identifier = prefetched.device_data.taskIdentifier
+        try:
+            status = self.processor.scheduler.check_assignment_status(task_identifier)
+        except Exception as err:
+            # The scheduler polling thread of the task will stop it if it was cancelled
+            logger.error("Error checking the status of the prefetched task %s: %s", task_identifier, err)
+            status = None
+
+        if status in ('deleted', 'completed'):
+            logger.info("The prefetched task %s was cancelled (%s). Discarding it...", task_identifier, status)
+            prefetched.discard()
+            return None
+
+        return prefetched
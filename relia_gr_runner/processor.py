@@ -1,245 +1,479 @@
 import os
 import sys
-import glob
 import json
 import time
-import platform
+import atexit
+import logging
+import contextvars
+import shutil
 import tempfile
 import threading
-import traceback
 import subprocess
 
-from typing import List, Optional
-
-import requests
+from typing import Iterable, List, Optional, Tuple
 
 from flask import current_app
+from werkzeug.utils import secure_filename
 
+from .devices import DEVICE_TYPES, DeviceConfig
+from .http_transport import HttpTransport
 from .scheduler import AbstractSchedulerClient, NoSchedulerClient, SchedulerClient, TaskAssignment
 from .grc_manager import GrcManager
+from .compile_cache import CompileCache
+from .grc_cache import ProcessedGrcCache
+from .grc_compiler import GrcCompilerService
+from .grc_validator import GrcValidationError, GrcValidator, format_errors
+from .zygote import ZygoteService
+from .supervision import EXITED, SelectableEvent, supervise
+from .task_status import watch_task_status
+from .output_capture import OutputCapture, truncate_message
+from .file_streaming import FileSinkStreamer
+from .sandbox_manager import SandboxManager
+from .workspace_pool import WorkspacePool
+from .prefetch import PrefetchedTask, Prefetcher
+from .concurrency import ConcurrentTaskRunner, ProcessLimits
+from .fft_wisdom import WisdomGenerator, wisdom_key
+from .logs import log_context, set_phase
+from .timeline import FlightRecorder, TaskTimeline, phase, record_phase, recording, set_outcome
+from .metrics import REGISTRY, Sample
 import math
 
-class Processor:
-    def __init__(self, running_single_task: bool = False):
-        self.device_id: str = current_app.config['DEVICE_ID']
-        self.password: str = current_app.config['PASSWORD']
-        self.device_type: str = current_app.config['DEVICE_TYPE']
+logger = logging.getLogger(__name__)
+
+class SharedResources:
+    """
+    What every Processor of this runner shares (see MultiDeviceRunner): caches, services, the sandbox,
+    the workspaces and the HTTP connection pools.
+    """
+    def __init__(self, number_of_devices: int = 1):
         self.uploader_base_url: str = current_app.config['DATA_UPLOADER_BASE_URL']
         self.default_hier_block_lib_dir: str = os.environ.get('RELIA_GR_BLOCKS_PATH')
         if not self.default_hier_block_lib_dir:
             self.default_hier_block_lib_dir: str = os.path.expanduser("~/.grc_gnuradio")
         
         if not os.path.exists(self.default_hier_block_lib_dir):
-            print(f"Error: RELIA_GR_BLOCKS_PATH not properly configured, path: {self.default_hier_block_lib_dir} not found.", file=sys.stderr, flush=True)
+            logger.error("Error: RELIA_GR_BLOCKS_PATH not properly configured, path: %s not found.", self.default_hier_block_lib_dir)
             sys.exit(1)
 
-        adalm_pluto_ip_address = current_app.config['ADALM_PLUTO_IP_ADDRESS']
-        red_pitaya_ip_address = current_app.config['RED_PITAYA_IP_ADDRESS']
-        if adalm_pluto_ip_address is None and red_pitaya_ip_address is None:
-            print(f"Error: ADALM_PLUTO_IP_ADDRESS or RED_PITAYA_IP_ADDRESS environment variable are required")
+        # Each device might have a long polling request and a task status subscription at the same time
+        self.scheduler_transport: HttpTransport = SchedulerClient.create_transport(pool_size=max(4, 2 * number_of_devices))
+        self.uploader_transport: HttpTransport = HttpTransport.from_config('uploader', pool_size=max(4, number_of_devices))
+        self.compile_cache: Optional[CompileCache] = CompileCache.from_config(self.default_hier_block_lib_dir)
+        self.grc_cache: Optional[ProcessedGrcCache] = ProcessedGrcCache.from_config()
+        self.grc_compiler: Optional[GrcCompilerService] = GrcCompilerService.from_config(self.default_hier_block_lib_dir)
+        if self.grc_compiler is not None:
+            self.grc_compiler.start()
+        self.grc_validator: Optional[GrcValidator] = GrcValidator.from_config(self.default_hier_block_lib_dir)
+
+        # Where the temporary directories of the tasks are created (None: the default temporary directory)
+        self.workspaces_directory: Optional[str] = current_app.config['WORKSPACES_DIRECTORY']
+        # Whether workspaces_directory was created for this runner, so it is removed at exit
+        self.temporary_workspaces_directory = False
+        if (current_app.config['USE_ZYGOTE'] or current_app.config['USE_WORKSPACE_POOL']) and self.workspaces_directory is None:
+            # Inside the sandbox of the zygote, only this directory is visible
+            self.workspaces_directory = tempfile.mkdtemp(prefix='relia-workspaces-')
+            self.temporary_workspaces_directory = True
+        if self.workspaces_directory is not None:
+            os.makedirs(self.workspaces_directory, exist_ok=True)
+        self.workspace_pool: Optional[WorkspacePool] = None
+        # Registered before the services using the workspaces, so it runs after they are stopped
+        atexit.register(self.stop)
+
+        self.sandbox: SandboxManager = SandboxManager.from_config()
+        self.sandbox.start()
+
+        # Workspaces reused across tasks (see Processor.create_workspace)
+        self.workspace_pool = WorkspacePool.from_config(self.workspaces_directory, self.scaffold_workspace)
+        if self.workspace_pool is not None:
+            self.workspace_pool.start()
+
+        self.zygote: Optional[ZygoteService] = ZygoteService.from_config(self.workspaces_directory)
+        if self.zygote is not None:
+            self.zygote.start()
+
+        # Plan the FFTs of each flowgraph before it runs (see Processor.plan_fft_wisdom)
+        self.fft_wisdom: Optional[WisdomGenerator] = WisdomGenerator() if current_app.config['PLAN_FFT_WISDOM'] else None
+        self.fft_wisdom_lock = threading.Lock()
+
+        # Timelines of the last tasks (see timeline.py)
+        self.flight_recorder: Optional[FlightRecorder] = FlightRecorder.from_config()
+
+        REGISTRY.add_collector(self.collect_metrics)
+
+    def stop(self):
+        """
+        Remove the workspaces of the pool, and the workspaces directory if it was created for this runner.
+        """
+        if self.workspace_pool is not None:
+            self.workspace_pool.stop()
+            self.workspace_pool = None
+        if self.temporary_workspaces_directory:
+            shutil.rmtree(self.workspaces_directory, ignore_errors=True)
+            self.temporary_workspaces_directory = False
+
+    def collect_metrics(self) -> Iterable[Sample]:
+        """
+        The latency of the requests to the scheduler and the uploader and the hit ratio of the caches (see metrics.py).
+        """
+        for transport in (self.scheduler_transport, self.uploader_transport):
+            stats = transport.stats()
+            for endpoint, histogram in stats['latency'].items():
+                yield ('relia_http_request_duration_seconds', 'histogram', 'Duration of the HTTP requests (each attempt)',
+                       {'transport': stats['name'], 'endpoint': endpoint}, histogram)
+            for counter, value in stats['counters'].items():
+                yield ('relia_http_requests_total', 'counter', 'HTTP requests by result (requests, retries, failures, rejected)',
+                       {'transport': stats['name'], 'result': counter}, value)
+
+        caches = []
+        if self.grc_cache is not None:
+            stats = self.grc_cache.stats()
+            caches.append(('grc', stats['memory_hits'] + stats['disk_hits'], stats['misses'], stats['hit_ratio']))
+        if self.compile_cache is not None:
+            stats = self.compile_cache.stats()
+            caches.append(('compile', stats['hits'], stats['misses'], stats['hit_ratio']))
+        for cache, hits, misses, hit_ratio in caches:
+            yield ('relia_cache_hits_total', 'counter', 'Cache hits', {'cache': cache}, hits)
+            yield ('relia_cache_misses_total', 'counter', 'Cache misses', {'cache': cache}, misses)
+            yield ('relia_cache_hit_ratio', 'gauge', 'Hits over lookups', {'cache': cache}, hit_ratio)
+
+    def scaffold_workspace(self, directory: str):
+        """
+        Create the parts of a workspace that do not depend on the device nor the task: the directory of the files
+        written by the flowgraph, relia.json (without them) and what the sandbox needs (e.g., a persistent jail).
+        """
+        os.makedirs(os.path.join(directory, 'files'), exist_ok=True)
+        open(os.path.join(directory, 'relia.json'), 'w').write(json.dumps({
+            'uploader_base_url': self.uploader_base_url,
+            'session_id': None,
+            'task_id': None,
+            'device_id': None,
+        }, indent=4))
+        self.sandbox.scaffold(directory)
+
+class Processor:
+    def __init__(self, running_single_task: bool = False, device: Optional[DeviceConfig] = None, shared: Optional[SharedResources] = None):
+        self.device: DeviceConfig = device or DeviceConfig.from_config()
+        self.device_id: str = self.device.device_id
+        self.password: str = self.device.password
+        self.device_type: str = self.device.device_type
+
+        if self.device.adalm_pluto_ip_address is None and self.device.red_pitaya_ip_address is None:
+            logger.error("Error: ADALM_PLUTO_IP_ADDRESS or RED_PITAYA_IP_ADDRESS environment variable are required (device %s)", self.device_id)
             sys.exit(1)
 
-        if self.device_type not in ('receiver', 'transmitter'):
-            print(f"Error: Unsupported device type: {self.device_type}", file=sys.stderr, flush=True)
+        if self.device_type not in DEVICE_TYPES:
+            logger.error("Error: Unsupported device type: %s", self.device_type)
             sys.exit(1)
 
+        self.shared: SharedResources = shared or SharedResources()
+        self.uploader_base_url: str = self.shared.uploader_base_url
+        self.default_hier_block_lib_dir: str = self.shared.default_hier_block_lib_dir
+        self.uploader_transport: HttpTransport = self.shared.uploader_transport
+        self.compile_cache: Optional[CompileCache] = self.shared.compile_cache
+        self.grc_cache: Optional[ProcessedGrcCache] = self.shared.grc_cache
+        self.grc_compiler: Optional[GrcCompilerService] = self.shared.grc_compiler
+        self.grc_validator: Optional[GrcValidator] = self.shared.grc_validator
+        self.workspaces_directory: Optional[str] = self.shared.workspaces_directory
+        self.sandbox: SandboxManager = self.shared.sandbox
+        self.workspace_pool: Optional[WorkspacePool] = self.shared.workspace_pool
+        self.zygote: Optional[ZygoteService] = self.shared.zygote
+        self.fft_wisdom: Optional[WisdomGenerator] = self.shared.fft_wisdom
+        self.fft_wisdom_lock = self.shared.fft_wisdom_lock
+        self.flight_recorder: Optional[FlightRecorder] = self.shared.flight_recorder
+
+        self.target_filename: str = 'target_file'
         self.task_is_running_event: threading.Event = threading.Event()
+        self.task_cancelled_event: SelectableEvent = SelectableEvent()
         self.running_single_task = running_single_task
         if running_single_task:
             self.scheduler: AbstractSchedulerClient = NoSchedulerClient()
         else:
-            self.scheduler: AbstractSchedulerClient = SchedulerClient()
+            self.scheduler: AbstractSchedulerClient = SchedulerClient(device=self.device, transport=self.shared.scheduler_transport)
         self.scheduler_polling_thread: Optional[threading.Thread] = None
 
-    def run_in_sandbox(self, command: List[str], directory: str) -> subprocess.Popen:
-        """
-        Run the command in a firejail sandbox
-        """
-        use_firejail = current_app.config['USE_FIREJAIL']
-        if use_firejail:
-            ip_address = current_app.config['FIREJAIL_IP_ADDRESS']
-            interface = current_app.config['FIREJAIL_INTERFACE']
-            user = os.getenv('USER') or 'relia'
-            profile = '\n'.join([
-                        f"net {interface}",
-                        f"ip {ip_address}",
-                        f"whitelist /home/{user}/.gr_fftw_wisdom",
-                        f"whitelist /home/{user}/relia-blocks",
-                        f"read-only /home/{user}/relia-blocks",
-                        f"whitelist /home/{user}/.gnuradio/prefs",
-                        f"read-only /home/{user}/.gnuradio/prefs",
-                        f"read-only /home/{user}/.bashrc",
-                        f"read-only /home/{user}/.profile",
-                        f"whitelist /home/{user}/.grc_gnuradio",
-                        f"read-only /home/{user}/.grc_gnuradio",
-                        f"whitelist /home/{user}/.cache/grc_gnuradio",                        
-                        f"whitelist /home/{user}/red-pitaya-notes",                        
-                        f"whitelist {directory}",
-                    ])
-            # net br0
-            # ip 10.10.20.2
-
-            # include /etc/firejail/disable-common.inc
-            # include /etc/firejail/disable-devel.inc
-            # include /etc/firejail/disable-exec.inc
-            # include /etc/firejail/disable-passwdmgr.inc
-            # include /etc/firejail/disable-xdg.inc
-            # whitelist /tmp/relia-*
-
-            # blacklist /home/relia/relia-gr-runner
-            # read-only /home/relia/.bashrc
-            # read-only /home/relia/.profile
-            open(os.path.join(directory, 'firejail.profile'), 'w').write(profile)
-
-            print(f"[{time.asctime()}] firejail.profile generated at {os.path.join(directory, 'firejail.profile')}")
-            print(f"[{time.asctime()}] The content:")
-            print(profile)
-
-            print(f"[{time.asctime()}] The contents of the folder now are:")
-            print(glob.glob(f"{directory}/*"))
-
-            firejail_command = ['firejail', '--profile=firejail.profile']
-            firejail_command.extend(command)
-            print(f"[{time.asctime()}] Running command inside the firejail sandbox: {' '.join(command)}")
-            print(f"[{time.asctime()}] So in reality it looks like: {' '.join(firejail_command)}")
-            print(f"[{time.asctime()}] Running command inside the firejail sandbox: {' '.join(command)}", file=sys.stderr)
-            print(f"[{time.asctime()}] So in reality it looks like: {' '.join(firejail_command)}", file=sys.stderr, flush=True)
-            command_to_run = firejail_command
-        else:
-            print(f"[{time.asctime()}] Running command outside any sandbox: {' '.join(command)}")
-            print(f"[{time.asctime()}] Running command outside any sandbox: {' '.join(command)}", file=sys.stderr, flush=True)
-            command_to_run = command
+        # Limits of the flowgraphs of this processor (see ConcurrentTaskRunner)
+        self.process_limits: Optional[ProcessLimits] = None
 
-        return subprocess.Popen(command_to_run, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    
-    def compile_grc_filename_into_python(self, directory: str, grc_manager: GrcManager, device_data: TaskAssignment, init_time: float) -> bool:
+        # Prepare the next assignment while the current flowgraph runs (when there are no concurrent tasks)
+        self.prefetcher: Optional[Prefetcher] = None
+        if current_app.config['PREFETCH_ASSIGNMENTS'] and not current_app.config['MAX_CONCURRENT_DSP_TASKS'] and not running_single_task:
+            self.prefetcher = Prefetcher(self)
+
+    def run_in_sandbox(self, command: List[str], directory: str, use_network: bool = True, limits: Optional[ProcessLimits] = None) -> subprocess.Popen:
         """
-        Compile the GRC into Python code
+        Run the command in the sandbox (see SandboxManager), with the limits if provided
+        """
+        if limits is None:
+            return self.sandbox.launch(command, directory, use_network)
+        return self.sandbox.launch(limits.wrap(command), directory, use_network, ip_address=limits.ip_address)
 
-        Return True if we have to finish this task immediately.
+    def report_sandbox_setup(self, p):
+        """
+        Log how long it took to set up the sandbox of p (if it was launched by run_in_sandbox)
+        """
+        latency = self.sandbox.setup_latency(p)
+        if latency is not None:
+            stats = self.sandbox.stats()
+            logger.info("Sandbox (%s) set up in %.1f ms (mean: %.1f ms over %s launches)", stats['backend'], latency * 1000, stats['mean_setup_seconds'] * 1000, stats['measured'])
+
+    def launch_flowgraph(self, directory: str, py_filename: str):
+        """
+        Run the generated Python file in a child of the zygote if available, or in a new process otherwise.
+
+        It runs with the process_limits of this processor (see ConcurrentTaskRunner).
+        """
+        limits = self.process_limits or ProcessLimits()
+        if self.zygote is not None and self.zygote.can_run_in(directory):
+            # When sandboxed, the zygote holds the sandbox IP address, so wait for it rather than starting a second sandbox
+            if not self.zygote.wait_until_ready():
+                logger.warning("The zygote is not available. Restarting it...")
+                self.zygote.start()
+
+            if self.zygote.wait_until_ready():
+                p = self.zygote.spawn(directory, py_filename, max_cpu_seconds=limits.max_cpu_seconds, cpu_affinity=limits.cores, niceness=limits.niceness)
+                if p is not None:
+                    logger.info("Running %s in a child of the zygote", py_filename)
+                    return p
+
+        return self.run_in_sandbox([sys.executable, py_filename], directory, limits=self.process_limits)
+
+    def compile_grc(self, directory: str, grc_manager: GrcManager, cancel_event: Optional[SelectableEvent], deadline: float, log_prefix: str) -> Tuple[str, Optional[int], str, str]:
+        """
+        Save the GRC of grc_manager in directory and compile it into Python code (or take it from the compile cache).
+
+        Return why the compilation stopped (see supervise), its return code and its output. If it did not
+        finish (cancelled or deadline), it is stopped.
         """
         grc_filename = os.path.join(directory, 'user_file.grc')
+        t0 = time.perf_counter()
         grc_manager.save(directory, 'user_file.grc')
+        if self.grc_cache is not None:
+            grc_cache_stats = self.grc_cache.stats()
+            logger.info("GRC file processed in %.1f ms (GRC cache hit ratio: %.2f, %s memory hits, %s disk hits, %s misses)", (time.perf_counter() - t0) * 1000, grc_cache_stats['hit_ratio'], grc_cache_stats['memory_hits'], grc_cache_stats['disk_hits'], grc_cache_stats['misses'])
 
         command = ['grcc', grc_filename, '-o', directory]
 
+        compile_cache_key: Optional[str] = None
+        if self.compile_cache is not None:
+            compile_cache_key = self.compile_cache.key_for(open(grc_filename).read(), directory)
+            if self.compile_cache.lookup(compile_cache_key, directory):
+                logger.info("GNU Radio Compiler output found in the compile cache (%s). Skipping grcc.", compile_cache_key)
+                return EXITED, 0, '', ''
+
+        grcc_start = time.perf_counter()
+        p = None
+        if self.grc_compiler is not None:
+            p = self.grc_compiler.compile(directory, grc_filename)
+            if p is not None:
+                logger.info("Compiling %s in the GRC compiler service", grc_filename)
+
+        if p is None:
+            # grcc does not need the network (and the sandbox IP address might be in use by a running flowgraph)
+            p = self.run_in_sandbox(command, directory, use_network=False)
+
+        output = OutputCapture.from_config(p, log_prefix=log_prefix)
+        reason = supervise(p, cancel_event, deadline=deadline)
+        self.report_sandbox_setup(p)
+        if reason != EXITED:
+            p.terminate()
+            self._wait_or_kill(p)
+            stdout, stderr = output.communicate()
+            record_phase('grcc', grcc_start)
+            return reason, p.returncode, stdout, stderr
+
+        stdout, stderr = output.communicate()
+        record_phase('grcc', grcc_start)
+        if p.returncode == 0 and compile_cache_key is not None:
+            try:
+                self.compile_cache.store(compile_cache_key, directory)
+            except Exception as err:
+                logger.exception("Error storing the GNU Radio Compiler output in the compile cache: %s", err)
+
+        return reason, p.returncode, stdout, stderr
+
+    def validate_grc(self, grc_manager: GrcManager) -> List[GrcValidationError]:
+        """
+        Check the GRC file before compiling it (see GrcValidator). Files in the GRC cache are not checked again:
+        they were checked before being stored.
+        """
+        if self.grc_validator is None or grc_manager.from_cache():
+            return []
+
+        with phase('validate'):
+            return self.grc_validator.validate(grc_manager.grc_content)
+
+    def compile_grc_filename_into_python(self, directory: str, grc_manager: GrcManager, device_data: TaskAssignment, init_time: float) -> bool:
+        """
+        Compile the GRC into Python code
+
+        Return True if we have to finish this task immediately.
+        """
+        set_phase('compile')
         if self.must_stop_task(device_data, init_time):
             self.report_and_stop_task(device_data, init_time)
             return True
 
-        p = self.run_in_sandbox(command, directory)
-        while p.poll() is None:
-            if self.must_stop_task(device_data, init_time):
-                p.terminate()
-                self.report_and_stop_task(device_data, init_time)
-                return True
-            
-            time.sleep(0.1)
-
-        stdout, stderr = p.communicate()
-        if p.returncode != 0:                 
-            print(f"[{time.asctime()}] The process (GNU Radio Compiler) stopped with return code: {p.returncode}. Calling self.early_terminate...", file=sys.stderr, flush=True)
-            print(f"[{time.asctime()}] Output: {stdout}", file=sys.stderr, flush=True)
-            print(f"[{time.asctime()}] Error: {stderr}", file=sys.stderr, flush=True)
-            self.scheduler.error_message_delivery(device_data.taskIdentifier, stdout + "\n" + stderr)
+        errors = self.validate_grc(grc_manager)
+        if errors:
+            set_outcome('failed')
+            error_message = format_errors(errors)
+            logger.warning("The GRC file is not valid. Calling self.early_terminate... %s", error_message)
+            self.scheduler.error_message_delivery(device_data.taskIdentifier, truncate_message(error_message, current_app.config['ERROR_MESSAGE_MAX_BYTES']))
+            self.early_terminate(device_data.taskIdentifier)
+            return True
+
+        reason, returncode, stdout, stderr = self.compile_grc(directory, grc_manager, self.task_cancelled_event, init_time + device_data.maxTime,
+                                                              log_prefix=f"{secure_filename(device_data.taskIdentifier)}-grcc")
+        if reason != EXITED:
+            self.report_and_stop_task(device_data, init_time)
+            return True
+
+        if returncode != 0:
+            set_outcome('failed')
+            logger.warning("The process (GNU Radio Compiler) stopped with return code: %s. Calling self.early_terminate...", returncode)
+            logger.warning("Output: %s", stdout)
+            logger.warning("Error: %s", stderr)
+            self.scheduler.error_message_delivery(device_data.taskIdentifier, truncate_message(stdout + "\n" + stderr, current_app.config['ERROR_MESSAGE_MAX_BYTES']))
             self.early_terminate(device_data.taskIdentifier)
             return True
         
-        print(f"[{time.asctime()}] The process (GNU Radio Compiler) finished successfully.", file=sys.stderr, flush=True)
-        
+        logger.info("The process (GNU Radio Compiler) finished successfully.")
         return False
 
-    def run_task_in_directory(self, directory: str, grc_manager: Optional[GrcManager], device_data: TaskAssignment, init_time: float, target_filename: str):
+    def plan_fft_wisdom(self, grc_manager: GrcManager):
+        """
+        FFTW plans the FFTs of the flowgraph when it starts, which might take longer than the whole execution.
+        Plan here the sizes that are not in the wisdom yet (see WisdomIndex), before the execution time starts.
+        """
+        if self.fft_wisdom is None:
+            return
+
+        set_phase('plan_fft')
+        plans = grc_manager.fft_plans()
+        keys = sorted({wisdom_key(plan.size, plan.forward, plan.nthreads, plan.fft_type) for plan in plans})
+        with self.fft_wisdom_lock:
+            # Other processes (e.g., create-gnuradio-fft-caches) might have planned more
+            self.fft_wisdom.index.load()
+            missing = self.fft_wisdom.index.missing(keys)
+            if not missing:
+                return
+
+            logger.info("FFTs not in the FFTW wisdom yet: %s (used by %s). Planning them...", ', '.join(missing), ', '.join(f'{plan.block} with {plan.window}' for plan in plans))
+            t0 = time.perf_counter()
+            try:
+                self.fft_wisdom.generate(missing, timeout=current_app.config['FFT_WISDOM_PLANNING_TIMEOUT'])
+            except Exception as err:
+                logger.exception("Error planning the FFTs: %s", err)
+            logger.info("FFTs planned in %.2f seconds", time.perf_counter() - t0)
+
+    def run_task_in_directory(self, directory: str, grc_manager: Optional[GrcManager], device_data: TaskAssignment, init_time: float, target_filename: str, compiled: bool = False):
         """
         Run a particular GRC file (from grc_manager) in a directory.
+
+        If compiled, the GRC file was already compiled in that directory (see Prefetcher).
         """
         py_filename = os.path.join(directory, f'{target_filename}.py')
 
-        relia_json = json.dumps({
-            'uploader_base_url': self.uploader_base_url,
-            'session_id': device_data.sessionIdentifier,
-            'task_id': device_data.taskIdentifier,
-            'device_id': self.device_id,
-        }, indent=4)
+        relia_json = self.relia_json(device_data)
 
-        print(f"[{time.asctime()}] relia.json generated in directory {directory}", file=sys.stderr, flush=True)
-        print(relia_json, file=sys.stderr, flush=True)
+        logger.info("relia.json generated in directory %s", directory)
+        logger.debug("relia.json: %s", relia_json)
 
         open(os.path.join(directory, 'relia.json'), 'w').write(relia_json) 
 
         if device_data.fileType == 'py':
             file_content = device_data.fileContent
-            if current_app.config['ADALM_PLUTO_IP_ADDRESS']:
-                file_content = file_content.replace("**RELIA_REPLACE_WITH_ADALM_PLUTO_IP_ADDRESS**", current_app.config['ADALM_PLUTO_IP_ADDRESS'])
-            if current_app.config['RED_PITAYA_IP_ADDRESS']:
-                file_content = file_content.replace("**RELIA_REPLACE_WITH_RED_PITAYA_IP_ADDRESS**", current_app.config['RED_PITAYA_IP_ADDRESS'])
-                file_content = file_content.replace('12895205601289519655', current_app.config['RED_PITAYA_RATE'])
+            if self.device.adalm_pluto_ip_address:
+                file_content = file_content.replace("**RELIA_REPLACE_WITH_ADALM_PLUTO_IP_ADDRESS**", self.device.adalm_pluto_ip_address)
+            if self.device.red_pitaya_ip_address:
+                file_content = file_content.replace("**RELIA_REPLACE_WITH_RED_PITAYA_IP_ADDRESS**", self.device.red_pitaya_ip_address)
+                file_content = file_content.replace('12895205601289519655', self.device.red_pitaya_rate)
             # It was already compiled, no need to re-compile
             open(py_filename, 'w').write(file_content)
-        else:
+        elif not compiled:
             if self.compile_grc_filename_into_python(directory, grc_manager, device_data, init_time):
                 return
 
+        if grc_manager is not None:
+            self.plan_fft_wisdom(grc_manager)
+
         # TODO: in the future, instead of waiting a fixed time, stop the process 10 seconds AFTER the t.start() in the Python code inside the code
-        gr_python_initial_time: float = time.time()
-        p = self.run_in_sandbox([sys.executable, py_filename], directory)
+        set_phase('run')
+        with phase('flowgraph_spawn'):
+            p = self.launch_flowgraph(directory, py_filename)
+        spawned = time.perf_counter()
         if p.poll() is None:
-            print(f"[{time.asctime()}] The process ({py_filename}) started.", file=sys.stderr, flush=True)
-
-        last_message = time.time()
-
-        while p.poll() is None:
+            logger.info("The process (%s) started.", py_filename)
+
+        if self.prefetcher is not None:
+            self.prefetcher.start()
+
+        max_gr_python_execution_time = current_app.config['MAX_GR_PYTHON_EXECUTION_TIME']
+        deadline = min(init_time + device_data.maxTime, time.perf_counter() + max_gr_python_execution_time)
+
+        def still_running():
+            logger.debug("The process (%s) is still running.", py_filename)
+
+        output = OutputCapture.from_config(p, log_prefix=f"{secure_filename(device_data.taskIdentifier)}-flowgraph")
+        # Upload what the file sinks write while the flowgraph runs (see file_streaming.py)
+        file_streamer = FileSinkStreamer.from_config(directory, self.uploader_transport, self.uploader_base_url, device_data.sessionIdentifier,
+                                                     self.device_id, device_data.taskIdentifier)
+        reason = supervise(p, self.task_cancelled_event, deadline=deadline,
+                            heartbeat=still_running if logger.isEnabledFor(logging.DEBUG) else None)
+        termination_start = time.perf_counter()
+        record_phase('run', spawned, termination_start)
+        if output.first_output_time is not None:
+            record_phase('first_output', spawned, output.first_output_time)
+        self.report_sandbox_setup(p)
+        if reason != EXITED:
+            p.terminate()
             if self.must_stop_task(device_data, init_time):
-                p.terminate()
                 self.report_and_stop_task(device_data, init_time)
-                break
-            
-            if time.time() - last_message > 5:
-                print(f"[{time.asctime()}] The process ({py_filename}) is still running.", file=sys.stderr, flush=True)
-                last_message = time.time()
-            
-            time.sleep(0.1)
-            elapsed = time.time() - gr_python_initial_time
-            max_gr_python_execution_time = current_app.config['MAX_GR_PYTHON_EXECUTION_TIME']
-            if elapsed > max_gr_python_execution_time:
-                p.terminate()
-                print(f"[{time.asctime()}] Running the GR Python code for over {max_gr_python_execution_time} seconds (value from MAX_GR_PYTHON_EXECUTION_TIME)... Calling self.early_terminate...", file=sys.stderr, flush=True)
+            else:
+                set_outcome('completed')
+                logger.info("Running the GR Python code for over %s seconds (value from MAX_GR_PYTHON_EXECUTION_TIME)... Calling self.early_terminate...", max_gr_python_execution_time)
                 self.early_terminate(device_data.taskIdentifier)
-                break
 
-        print(f"[{time.asctime()}] Waiting for the process to finish...", file=sys.stderr, flush=True)
-        try:
-            p.wait(timeout=10)
-        except Exception as err:
-            traceback.print_exc()
+        logger.info("Waiting for the process to finish...")
+        self._wait_or_kill(p)
 
-        # If terminate() was not enough, kill it
-        if p.poll() is None:
-            try:
-                p.kill()
-                p.wait(timeout=10)
-            except:
-                traceback.print_exc()
+        if file_streamer is not None:
+            # Before the workspace (and the files) are removed
+            with phase('file_streaming_flush'):
+                file_streamer.finish()
 
-        stdout, stderr = p.communicate()
+        stdout, stderr = output.communicate()
+        record_phase('termination', termination_start)
         if p.returncode != 0:
-            print(f"[{time.asctime()}] The process (GNU Radio) stopped with return code: {p.returncode}. Calling self.early_terminate...", file=sys.stderr, flush=True)
-            print(f"[{time.asctime()}] Output: {stdout}", file=sys.stderr, flush=True)
-            print(f"[{time.asctime()}] Error: {stderr}", file=sys.stderr, flush=True)
-            self.scheduler.error_message_delivery(device_data.taskIdentifier, stdout + "\n" + stderr)
+            set_outcome('failed')
+            logger.warning("The process (GNU Radio) stopped with return code: %s. Calling self.early_terminate...", p.returncode)
+            logger.warning("Output: %s", stdout)
+            logger.warning("Error: %s", stderr)
+            self.scheduler.error_message_delivery(device_data.taskIdentifier, truncate_message(stdout + "\n" + stderr, current_app.config['ERROR_MESSAGE_MAX_BYTES']))
             self.early_terminate(device_data.taskIdentifier)
             return
         
-        print(f"[{time.asctime()}] The process ({py_filename}) finished successfully.", file=sys.stderr, flush=True)
-        print(f"[{time.asctime()}] Output: {stdout}", file=sys.stderr, flush=True)
-        print(f"[{time.asctime()}] Error: {stderr}", file=sys.stderr, flush=True)
+        logger.info("The process (%s) finished successfully.", py_filename)
+        logger.debug("Output: %s", stdout)
+        logger.debug("Error: %s", stderr)
         
+    def _wait_or_kill(self, p):
+        """
+        Give the process (typically already terminated) 10 seconds to finish. Otherwise, kill it.
+        """
+        if supervise(p, None, deadline=time.perf_counter() + 10) != EXITED:
+            try:
+                p.kill()
+                p.wait(timeout=10)
+            except:
+                logger.exception("Error killing the process %s", p.pid)
+
     def must_stop_task(self, device_data: TaskAssignment, init_time: float) -> bool:
         """
         If the scheduler has cancelled the task for any reason (user, other device, whatever)
         OR if the max time has passed, then this task must stop.
         """
-        if not self.scheduler_reports_task_still_active() or time.perf_counter() - init_time > device_data.maxTime:
+        if not self.scheduler_reports_task_still_active() or time.perf_counter() - init_time >= device_data.maxTime:
             return True
         return False
     
@@ -248,9 +482,11 @@ class Processor:
         Print a message indicating that the task has finished and call early_terminate()
         """
         if not self.scheduler_reports_task_still_active():
-            print(f"[{time.asctime()}] Scheduler stopped. Stopping task {device_data.taskIdentifier}...", file=sys.stderr, flush=True)
+            set_outcome('cancelled')
+            logger.info("Scheduler stopped. Stopping task %s...", device_data.taskIdentifier)
         else:
-            print(f"[{time.asctime()}] Timed out (time elapsed: {time.perf_counter() - init_time}; max time: {device_data.maxTime}", file=sys.stderr, flush=True)
+            set_outcome('timed_out')
+            logger.info("Timed out (time elapsed: %s; max time: %s", time.perf_counter() - init_time, device_data.maxTime)
         self.early_terminate(device_data.taskIdentifier)
 
     def scheduler_reports_task_still_active(self) -> bool:
@@ -263,10 +499,8 @@ class Processor:
         if self.running_single_task:
             return True
         
-        # TODO: clean this logic at some point
-        if self.scheduler_polling_thread.is_alive():
-            return True
-        return False
+        # The scheduler polling thread sets it whenever it stops
+        return not self.task_cancelled_event.is_set()
     
     def _delete_existing_data_from_server(self, device_data: TaskAssignment):
         """
@@ -276,119 +510,200 @@ class Processor:
         session_id = device_data.sessionIdentifier
 
         delete_url = self.uploader_base_url + f"api/download/sessions/{session_id}/devices/{self.device_id}"
-        print(f"[{time.asctime()}] Resetting device {self.device_id}: {delete_url}", flush=True)
-        print(f"[{time.asctime()}] Resetting device {self.device_id}: {delete_url}", file=sys.stderr, flush=True)
-        delete_response = requests.delete(delete_url, timeout=(30,30))
+        logger.info("Resetting device %s: %s", self.device_id, delete_url)
+        delete_response = self.uploader_transport.delete(delete_url, 'delete_device_data')
         try:
             delete_response.raise_for_status()
         except Exception as err:
-            print(f"[{time.asctime()}] Error deleting previous device data: {err}; {delete_response.content}", file=sys.stderr, flush=True)
+            logger.error("Error deleting previous device data: %s; %s", err, delete_response.content)
         else:
-            print(f"[{time.asctime()}] Result of resetting device {self.device_id}:")
-            print(f"[{time.asctime()}] Result of resetting device {self.device_id}:", file=sys.stderr, flush=True)
-            print(json.dumps(delete_response.json(), indent=4))
-            print(json.dumps(delete_response.json(), indent=4), file=sys.stderr, flush=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Result of resetting device %s: %s", self.device_id, json.dumps(delete_response.json(), indent=4))
 
-    def run_task(self, device_data: TaskAssignment):
+    def create_grc_manager(self, device_data: TaskAssignment) -> GrcManager:
         """
-        Runs a task on this device.
+        Create a GRC Manager that will modify the YAML as needed to adapt to RELIA
         """
-        init_time = time.perf_counter()
+        return GrcManager(device_data.fileContent, self.target_filename, self.default_hier_block_lib_dir, cache=self.grc_cache,
+                          environment=self.device.rules_environment())
 
-        # Launch a separate thread that polls on the scheduler (to notify that we are processing the request)
-        self.task_is_running_event.clear()
-        self.scheduler_polling_thread = threading.Thread(target=self.scheduler_poll, args=(device_data.taskIdentifier, self.task_is_running_event), daemon=True)
-        self.scheduler_polling_thread.start()
+    def relia_json(self, device_data: Optional[TaskAssignment]) -> str:
+        return json.dumps({
+            'uploader_base_url': self.uploader_base_url,
+            'session_id': device_data.sessionIdentifier if device_data is not None else None,
+            'task_id': device_data.taskIdentifier if device_data is not None else None,
+            'device_id': self.device_id,
+        }, indent=4)
 
-        target_filename = 'target_file'
-        if device_data.fileType == 'py':
-            grc_manager = None
+    def create_workspace(self) -> str:
+        """
+        Create (or take from the pool) a directory where a task runs. The caller must give it back with release_workspace.
+        """
+        if self.workspace_pool is not None:
+            return self.workspace_pool.acquire()
+        directory = tempfile.mkdtemp(prefix='relia-', dir=self.workspaces_directory)
+        os.mkdir(os.path.join(directory, 'files'))
+        return directory
+
+    def release_workspace(self, directory: str):
+        """
+        Remove the workspace (or give it back to the pool, which resets it in the background).
+        """
+        # Nothing the task started in the sandbox survives it
+        self.sandbox.release(directory)
+        if self.workspace_pool is not None:
+            self.workspace_pool.release(directory)
         else:
-            grc_file_content = device_data.fileContent
-            
-            # Create a GRC Manager that will modify the YAML as needed to adapt to RELIA
-            grc_manager = GrcManager(grc_file_content, target_filename, self.default_hier_block_lib_dir)
-
-        # Report to the server that we are starting fresh and therefore we do want to delete any existing data
-        # of the particular device in the particular session
-        # self._delete_existing_data_from_server(device_data)
-        # TODO: Maybe we do not need to delete data anymore in this step
-
-        tmpdir_kwargs = {}
-        if os.name == 'nt' or "microsoft" in platform.platform().lower():
-            tmpdir_kwargs['ignore_cleanup_errors'] = True
-        
-        # Create a temporary directory and run the task inside
-        with tempfile.TemporaryDirectory(prefix='relia-', **tmpdir_kwargs) as tmpdir:
-            print(f"[{time.asctime()}] {self.device_type.title()} running in temporary directory {tmpdir}...", flush=True)
-            print(f"[{time.asctime()}] {self.device_type.title()} running in temporary directory {tmpdir}...", file=sys.stderr, flush=True)
-            self.run_task_in_directory(tmpdir, grc_manager, device_data, init_time, target_filename)
-        
-        # We have finished: notify other threads that this is over and report to the scheduler server that this is over
-        self.task_is_running_event.set()
-        print(f"{self.device_type.title()} completing task", flush=True)
-        print(f"{self.device_type.title()} completing task", file=sys.stderr, flush=True)
-        self.scheduler.complete_assignments(device_data.taskIdentifier)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run_task(self, device_data: TaskAssignment, prefetched: Optional[PrefetchedTask] = None):
+        """
+        Runs a task on this device.
+
+        If the task was prefetched, its time started counting when it was assigned, and it might be
+        already prepared in its own directory.
+        """
+        timeline = prefetched.timeline if prefetched is not None else TaskTimeline(device_data.taskIdentifier, device_data.sessionIdentifier, self.device_id)
+        with log_context(device_id=self.device_id, task_id=device_data.taskIdentifier, session_id=device_data.sessionIdentifier), recording(timeline):
+            set_phase('prepare')
+            init_time = prefetched.init_time if prefetched is not None else time.perf_counter()
+            # Since it was assigned (e.g., while the previous task was running, see Prefetcher)
+            record_phase('queue_wait', init_time)
+
+            # Launch a separate thread that polls on the scheduler (to notify that we are processing the request)
+            self.task_is_running_event.clear()
+            self.task_cancelled_event.clear()
+            # It runs in a copy of the context, so its logs and its round-trips are those of this task
+            self.scheduler_polling_thread = threading.Thread(target=contextvars.copy_context().run, args=(self.scheduler_poll, device_data.taskIdentifier, self.task_is_running_event, init_time + device_data.maxTime), daemon=True)
+            self.scheduler_polling_thread.start()
+
+            target_filename = self.target_filename
+            if device_data.fileType == 'py':
+                grc_manager = None
+            elif prefetched is not None and prefetched.grc_manager is not None:
+                grc_manager = prefetched.grc_manager
+            else:
+                grc_manager = self.create_grc_manager(device_data)
+
+            # Report to the server that we are starting fresh and therefore we do want to delete any existing data
+            # of the particular device in the particular session
+            # self._delete_existing_data_from_server(device_data)
+            # TODO: Maybe we do not need to delete data anymore in this step
+
+            if prefetched is not None and prefetched.directory is not None:
+                # Already compiled while the previous task was running
+                try:
+                    logger.info("%s running in prefetched directory %s...", self.device_type.title(), prefetched.directory)
+                    self.run_task_in_directory(prefetched.directory, grc_manager, device_data, init_time, target_filename, compiled=True)
+                finally:
+                    with phase('cleanup'):
+                        prefetched.discard()
+            else:
+                # Take a workspace and run the task inside
+                tmpdir = self.create_workspace()
+                try:
+                    logger.info("%s running in temporary directory %s...", self.device_type.title(), tmpdir)
+                    self.run_task_in_directory(tmpdir, grc_manager, device_data, init_time, target_filename)
+                finally:
+                    with phase('cleanup'):
+                        self.release_workspace(tmpdir)
+
+            # We have finished: notify other threads that this is over and report to the scheduler server that this is over
+            self.task_is_running_event.set()
+            set_phase('complete')
+            timeline_summary = timeline.summary()
+            logger.info("%s completing task (timeline: %s)", self.device_type.title(), timeline_summary)
+            self.scheduler.complete_assignments(device_data.taskIdentifier, timeline_summary)
+            if self.flight_recorder is not None:
+                self.flight_recorder.add(timeline)
+            self.record_task_metrics(timeline)
+
+    def record_task_metrics(self, timeline: TaskTimeline):
+        """
+        Count the task by outcome and observe the duration of its main phases (see metrics.py).
+        """
+        summary = timeline.summary()
+        REGISTRY.inc('relia_tasks_total', 'Tasks processed by outcome (completed, failed, cancelled, timed_out)',
+                     device_id=self.device_id, outcome=summary['outcome'])
+        REGISTRY.observe('relia_task_duration_seconds', 'Time from the assignment to the completion of the task',
+                         summary['total_ms'] / 1000, device_id=self.device_id)
+        for phase_name, metric, help in (('queue_wait', 'relia_task_queue_wait_seconds', 'Time from the assignment until the task started'),
+                                         ('grcc', 'relia_task_compile_seconds', 'Time compiling the GRC file (grcc)'),
+                                         ('run', 'relia_task_run_seconds', 'Time running the flowgraph')):
+            if phase_name in summary['phases']:
+                REGISTRY.observe(metric, help, summary['phases'][phase_name]['ms'] / 1000, device_id=self.device_id)
+
+    def stop_scheduler_polling(self):
+        """
+        Stop the scheduler polling thread of the last task, if any.
+        """
+        if self.scheduler_polling_thread is not None:
+            self.task_is_running_event.set()
+            self.scheduler_polling_thread.join()
+            self.scheduler_polling_thread = None
+            logger.info("Scheduler polling thread stopped.")
+
+        self.task_is_running_event.clear()
 
     def run_forever(self):
+        concurrent_task_runner = ConcurrentTaskRunner.from_config(self) if not self.running_single_task else None
+        if concurrent_task_runner is not None:
+            concurrent_task_runner.run_forever()
+            return
+
         while True:
-            print(f"[{time.asctime()}] {self.device_type.title()} requesting assignment...", flush=True)
-            print(f"[{time.asctime()}] {self.device_type.title()} requesting assignment...", file=sys.stderr, flush=True)
+            logger.info("%s requesting assignment...", self.device_type.title())
             try:
-                if self.scheduler_polling_thread is not None:
-                    self.task_is_running_event.set()
-                    self.scheduler_polling_thread.join()
-                    self.scheduler_polling_thread = None
-                    print(f"[{time.asctime()}] Scheduler polling thread stopped.", file=sys.stderr, flush=True)
+                self.stop_scheduler_polling()
 
-                self.task_is_running_event.clear()
+                prefetched: Optional[PrefetchedTask] = self.prefetcher.take() if self.prefetcher is not None else None
+                if prefetched is not None:
+                    logger.info("%s running prefetched task %s", self.device_type.title(), prefetched.device_data.taskIdentifier)
+                    self.run_task(prefetched.device_data, prefetched)
+                    continue
 
+                fetch_start = time.perf_counter()
                 device_data: Optional[TaskAssignment] = self.scheduler.get_assignments()
                 if not device_data:
-                    print(f"Error trying to get assignments. Waiting a bit...")
+                    logger.error("Error trying to get assignments. Waiting a bit...")
                     time.sleep(5)
                     continue
 
                 if device_data.taskIdentifier:
-                    self.run_task(device_data)
+                    self.run_task(device_data, PrefetchedTask(device_data, time.perf_counter(), self.release_workspace, fetch_start, self.device_id))
                 else:
-                    print("No assignments", file=sys.stderr, flush=True)
+                    logger.info("No assignments")
+                    self.record_idle_time(time.perf_counter() - fetch_start)
 
             except Exception as err:
-                print(f"Uncaught processing tasks: {err}", file=sys.stderr, flush=True)
-                traceback.print_exc()
-                sys.stderr.flush()
+                logger.exception("Uncaught processing tasks: %s", err)
                 time.sleep(2)
 
+    def record_idle_time(self, seconds: float):
+        """
+        Count time waiting for an assignment that did not come (see metrics.py).
+        """
+        REGISTRY.inc('relia_device_idle_seconds_total', 'Time waiting for assignments without getting any', seconds, device_id=self.device_id)
+
     def early_terminate(self, task_identifier):
         """
         Terminate the current execution and report to the scheduler and to the scheduler poll thread.
         """
-        print(f"[{time.asctime()}] Task being purged due to deletion", flush=True)
-        print(f"[{time.asctime()}] Task being purged due to deletion", file=sys.stderr, flush=True)
+        logger.info("Task being purged due to deletion")
         self.task_is_running_event.set()
         self.scheduler.complete_assignments(task_identifier)
 
-    def scheduler_poll(self, task_identifier: str, task_is_running_event: threading.Event):
+    def scheduler_poll(self, task_identifier: str, task_is_running_event: threading.Event, deadline: Optional[float] = None):
         """
-        This function is launched in a different thread. It will be checking the status of the task.
-        Whenever the statusi s delete or completed, it will stop running.
+        This function is launched in a different thread. It will be checking the status of the task
+        (see watch_task_status). Whenever the status is deleted or completed, it will stop running.
 
         If the server stops at any point, there are several points that are checking it to know if
-        they should stop everything.
-        """
-        while not task_is_running_event.is_set():
-            event_set = task_is_running_event.wait(timeout=5)
-            if event_set:
-                print(f"[{time.asctime()}] Thread event set. Stopping task status checking thread", flush=True)
-                print(f"[{time.asctime()}] Thread event set. Stopping task status checking thread", file=sys.stderr, flush=True)
-                break
-
-            task_assignment_status = self.scheduler.check_assignment_status(task_identifier)
-            print(f"[{time.asctime()}] Status of the task {task_identifier}: {task_assignment_status}", flush=True)
-            print(f"[{time.asctime()}] Status of the task {task_identifier}: {task_assignment_status}", file=sys.stderr, flush=True)
-            # If the status is completed or deleted, stop
-            if task_assignment_status in ("deleted", "completed"):
-                print(f"[{time.asctime()}] Stopping task polling thread", flush=True)
-                print(f"[{time.asctime()}] Stopping task polling thread", file=sys.stderr,  flush=True)
-                break
+        they should stop everything: when this thread finishes, task_cancelled_event is set.
+        """
+        try:
+            # The cancellation is reported right away, without waiting for this thread to finish
+            watch_task_status(self.scheduler, task_identifier, task_is_running_event, self.task_cancelled_event.set, deadline)
+        finally:
+            # Any task still running must stop (see scheduler_reports_task_still_active)
+            self.task_cancelled_event.set()
@@ -0,0 +1,71 @@
+import os
+
+from typing import List
+
+# Files of the home directory visible in the sandbox: (rule, path relative to the home directory)
+HOME_RULES = [
+    ('whitelist', '.gr_fftw_wisdom'),
+    ('whitelist', 'relia-blocks'),
+    ('read-only', 'relia-blocks'),
+    ('whitelist', '.gnuradio/prefs'),
+    ('read-only', '.gnuradio/prefs'),
+    ('read-only', '.bashrc'),
+    ('read-only', '.profile'),
+    ('whitelist', '.grc_gnuradio'),
+    ('read-only', '.grc_gnuradio'),
+    ('whitelist', '.cache/grc_gnuradio'),
+    ('whitelist', 'red-pitaya-notes'),
+]
+
+def firejail_profile(directories: List[str], ip_address: str, interface: str) -> str:
+    """
+    Build the firejail profile used to run code submitted by the students.
+
+    Only the GNU Radio and RELIA files and the provided directories are visible. If ip_address
+    is None, the sandbox has no network at all.
+    """
+    user = os.getenv('USER') or 'relia'
+    if ip_address is None:
+        lines = ["net none"]
+    else:
+        lines = [
+            f"net {interface}",
+            f"ip {ip_address}",
+        ]
+
+    lines.extend(f"{rule} /home/{user}/{path}" for rule, path in HOME_RULES)
+    for directory in directories:
+        lines.append(f"whitelist {directory}")
+
+    # include /etc/firejail/disable-common.inc
+    # include /etc/firejail/disable-devel.inc
+    # include /etc/firejail/disable-exec.inc
+    # include /etc/firejail/disable-passwdmgr.inc
+    # include /etc/firejail/disable-xdg.inc
+    # whitelist /tmp/relia-*
+
+    # blacklist /home/relia/relia-gr-runner
+    # read-only /home/relia/.bashrc
+    # read-only /home/relia/.profile
+    return '\n'.join(lines)
+
+
+def bubblewrap_arguments(directories: List[str]) -> List[str]:
+    """
+    Build the bubblewrap (bwrap) arguments of a sandbox equivalent to firejail_profile without network: the
+    system is read-only, and of the home directories and /tmp only the HOME_RULES files and the provided
+    directories (writable) are visible.
+
+    bubblewrap can not restrict the network to an interface and address, so the sandbox never has network.
+    """
+    user = os.getenv('USER') or 'relia'
+    read_only = {path for rule, path in HOME_RULES if rule == 'read-only'}
+    arguments = ['bwrap', '--ro-bind', '/', '/', '--dev', '/dev', '--proc', '/proc', '--tmpfs', '/home', '--tmpfs', '/tmp',
+                 '--unshare-pid', '--unshare-ipc', '--unshare-net', '--die-with-parent', '--new-session']
+
+    for rule, path in HOME_RULES:
+        if rule == 'whitelist':
+            arguments.extend(['--ro-bind-try' if path in read_only else '--bind-try', f"/home/{user}/{path}", f"/home/{user}/{path}"])
+    for directory in directories:
+        arguments.extend(['--bind', directory, directory])
+    return arguments
@@ -0,0 +1,320 @@
+import os
+import glob
+import time
+import logging
+import shutil
+import atexit
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from .sandbox import firejail_profile, bubblewrap_arguments
+from .timeline import record_phase
+
+logger = logging.getLogger(__name__)
+
+# Created by every sandboxed command once the sandbox is ready (its modification time is when it started)
+READY_MARKER = '.relia-sandbox-ready'
+
+# Maximum time to start a persistent jail
+JAIL_STARTUP_TIMEOUT = 30
+
+class SandboxManager:
+    """
+    Runs commands submitted by the students (grcc and the flowgraphs) in a sandbox.
+
+    Every command is wrapped so it creates READY_MARKER in its directory right before starting, so the
+    time spent setting up the sandbox is measured on every launch (see setup_latency).
+    """
+    name = 'none'
+    # Whether the commands with network use the configured IP address (so only one can run at a time)
+    exclusive_ip_address = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # pid: (time of the launch, time.perf_counter() of the launch, directory)
+        self.launches: Dict[int, Tuple[float, float, str]] = {}
+        self.counters = {'launches': 0, 'measured': 0, 'total_setup_seconds': 0.0, 'max_setup_seconds': 0.0}
+
+    @staticmethod
+    def from_config() -> "SandboxManager":
+        """
+        Build the sandbox configured in USE_FIREJAIL and SANDBOX_BACKEND.
+        """
+        if not current_app.config['USE_FIREJAIL']:
+            return SandboxManager()
+
+        backend = current_app.config['SANDBOX_BACKEND']
+        ip_address = current_app.config['FIREJAIL_IP_ADDRESS']
+        interface = current_app.config['FIREJAIL_INTERFACE']
+        if backend == 'bubblewrap':
+            return BubblewrapSandbox(ip_address, interface)
+        if backend == 'firejail-join':
+            return PersistentFirejailSandbox(ip_address, interface)
+        if backend != 'firejail':
+            logger.warning("Unknown SANDBOX_BACKEND %s. Using firejail.", backend)
+        return FirejailSandbox(ip_address, interface)
+
+    def start(self):
+        """
+        Prepare what the sandbox needs before the first launch.
+        """
+
+    def stop(self):
+        pass
+
+    def scaffold(self, directory: str):
+        """
+        Prepare a workspace for this sandbox (see WorkspacePool).
+        """
+
+    def release(self, directory: str):
+        """
+        The task of the workspace finished: stop whatever it left running in the sandbox.
+        """
+
+    def wrap(self, command: List[str], directory: str, use_network: bool, ip_address: Optional[str] = None) -> List[str]:
+        """
+        Return the command that runs command in directory inside the sandbox (with ip_address instead of the
+        configured one, if the sandbox has its own address).
+        """
+        return command
+
+    def launch(self, command: List[str], directory: str, use_network: bool = True, ip_address: Optional[str] = None) -> subprocess.Popen:
+        marker = os.path.join(directory, READY_MARKER)
+        if os.path.exists(marker):
+            os.remove(marker)
+
+        # Once inside the sandbox, mark it and replace the shell by the command
+        command_in_sandbox = ['/bin/sh', '-c', f'cd "$0" && : > {READY_MARKER} && exec "$@"', directory] + command
+        command_to_run = self.wrap(command_in_sandbox, directory, use_network, ip_address)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Running command in the sandbox (%s): %s", self.name, ' '.join(command))
+            logger.debug("So in reality it looks like: %s", ' '.join(command_to_run))
+
+        launch_time = time.time()
+        launch_perf_counter = time.perf_counter()
+        p = subprocess.Popen(command_to_run, cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        with self.lock:
+            self.launches[p.pid] = (launch_time, launch_perf_counter, directory)
+            self.counters['launches'] += 1
+        return p
+
+    def setup_latency(self, p) -> Optional[float]:
+        """
+        Seconds from launching p to its command starting inside the sandbox, or None if it is unknown (p
+        was not launched by launch(), or it failed before starting). The resolution is that of the file
+        modification times (a few milliseconds). It is recorded as the sandbox_setup phase of the current task.
+        """
+        with self.lock:
+            launch = self.launches.pop(getattr(p, 'pid', None), None)
+        if launch is None:
+            return None
+
+        launch_time, launch_perf_counter, directory = launch
+        try:
+            latency = max(0.0, os.stat(os.path.join(directory, READY_MARKER)).st_mtime - launch_time)
+        except FileNotFoundError:
+            return None
+        record_phase('sandbox_setup', launch_perf_counter, launch_perf_counter + latency)
+
+        with self.lock:
+            self.counters['measured'] += 1
+            self.counters['total_setup_seconds'] += latency
+            self.counters['max_setup_seconds'] = max(self.counters['max_setup_seconds'], latency)
+        return latency
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            stats = dict(self.counters)
+        stats['mean_setup_seconds'] = stats['total_setup_seconds'] / stats['measured'] if stats['measured'] else 0.0
+        stats['backend'] = self.name
+        return stats
+
+class FirejailSandbox(SandboxManager):
+    """
+    A new firejail jail for every command.
+
+    The profile is written right before every launch in a directory of the runner, which is blacklisted in the
+    sandbox: the workspace is writable from the sandbox (e.g., by the embedded Python blocks while grcc runs), so a
+    profile stored there could be replaced before the next launch.
+    """
+    name = 'firejail'
+    exclusive_ip_address = True
+
+    def __init__(self, ip_address: str, interface: str):
+        super().__init__()
+        self.ip_address = ip_address
+        self.interface = interface
+        self.runtime_directory: Optional[str] = None
+        atexit.register(self.stop)
+
+    def start(self):
+        with self.lock:
+            if self.runtime_directory is None:
+                self.runtime_directory = tempfile.mkdtemp(prefix='relia-sandbox-')
+
+    def stop(self):
+        with self.lock:
+            runtime_directory, self.runtime_directory = self.runtime_directory, None
+        if runtime_directory is not None:
+            shutil.rmtree(runtime_directory, ignore_errors=True)
+
+    def _profile_prefix(self, directory: str) -> str:
+        return os.path.join(self.runtime_directory, os.path.basename(os.path.abspath(directory)))
+
+    def wrap(self, command: List[str], directory: str, use_network: bool, ip_address: Optional[str] = None) -> List[str]:
+        self.start()
+        if use_network:
+            ip_address = ip_address or self.ip_address
+            profile_filename = f"{self._profile_prefix(directory)}-{ip_address}.profile"
+        else:
+            ip_address = None
+            profile_filename = f"{self._profile_prefix(directory)}-no-network.profile"
+        profile = firejail_profile([directory], ip_address, self.interface) + f"\nblacklist {self.runtime_directory}\n"
+        open(profile_filename, 'w').write(profile)
+        return ['firejail', f'--profile={profile_filename}'] + command
+
+    def release(self, directory: str):
+        with self.lock:
+            if self.runtime_directory is None:
+                return
+            prefix = self._profile_prefix(directory)
+        for profile_filename in glob.glob(f"{glob.escape(prefix)}-*.profile"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(profile_filename)
+
+class BubblewrapSandbox(SandboxManager):
+    """
+    A bubblewrap sandbox for every command without network (see bubblewrap_arguments). It does not need a
+    setuid binary nor a network namespace on a bridge, so it is much faster to set up than firejail.
+
+    bubblewrap can not restrict the network to the sandbox interface and IP address, so the commands with
+    network (the flowgraphs) run in a new firejail jail, as in FirejailSandbox.
+    """
+    name = 'bubblewrap'
+    exclusive_ip_address = True
+
+    def __init__(self, ip_address: str, interface: str):
+        super().__init__()
+        self.fallback = FirejailSandbox(ip_address, interface)
+
+    def start(self):
+        self.fallback.start()
+
+    def stop(self):
+        self.fallback.stop()
+
+    def release(self, directory: str):
+        self.fallback.release(directory)
+
+    def wrap(self, command: List[str], directory: str, use_network: bool, ip_address: Optional[str] = None) -> List[str]:
+        if use_network:
+            return self.fallback.wrap(command, directory, use_network, ip_address)
+        return bubblewrap_arguments([directory]) + ['--chdir', directory] + command
+
+class PersistentFirejailSandbox(SandboxManager):
+    """
+    A firejail jail per workspace, started when the workspace is scaffolded (in the background by the
+    WorkspacePool) and stopped when it is released, so the commands without network (grcc) enter it with
+    firejail --join instead of setting up a new sandbox.
+
+    Each jail only sees its own workspace, and stopping it kills everything left inside (the jail has its
+    own PID namespace), so nothing survives the task. The commands with network run in a new jail every
+    time, as in FirejailSandbox: the sandbox IP address can only be used by one jail at a time, so a
+    networked jail can not be started in advance for every workspace.
+    """
+    name = 'firejail-join'
+    exclusive_ip_address = True
+
+    def __init__(self, ip_address: str, interface: str):
+        super().__init__()
+        self.fallback = FirejailSandbox(ip_address, interface)
+        self.interface = interface
+        self.runtime_directory: Optional[str] = None
+        # workspace: the process keeping its jail alive, and whether it is ready
+        self.jails: Dict[str, Tuple[subprocess.Popen, threading.Event]] = {}
+        atexit.register(self.stop)
+
+    @staticmethod
+    def jail_name(directory: str) -> str:
+        return f"relia-{os.getpid()}-{os.path.basename(os.path.abspath(directory))}"
+
+    def start(self):
+        self.fallback.start()
+        self.runtime_directory = tempfile.mkdtemp(prefix='relia-sandbox-')
+
+    def scaffold(self, directory: str):
+        if self.runtime_directory is not None:
+            self._start_jail(os.path.abspath(directory))
+
+    def _start_jail(self, directory: str):
+        self.release(directory)
+
+        name = self.jail_name(directory)
+        # Whatever the task leaves running in the jail must not reach the profiles of the next launches
+        profile = firejail_profile([directory], None, self.interface) + f"\nblacklist {self.runtime_directory}\nblacklist {self.fallback.runtime_directory}\n"
+        profile_filename = os.path.join(self.runtime_directory, f'{name}.profile')
+        open(profile_filename, 'w').write(profile)
+
+        command = ['firejail', f'--name={name}', f'--profile={profile_filename}', '--quiet', 'sleep', 'infinity']
+        logger.debug("Starting the persistent sandbox %s: %s", name, ' '.join(command))
+        jail = subprocess.Popen(command, cwd=self.runtime_directory, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        ready = threading.Event()
+        with self.lock:
+            self.jails[directory] = (jail, ready)
+        threading.Thread(target=self._wait_for_jail, args=(name, jail, ready), daemon=True).start()
+
+    def _wait_for_jail(self, name: str, jail: subprocess.Popen, ready: threading.Event):
+        t0 = time.time()
+        while jail.poll() is None and time.time() - t0 < JAIL_STARTUP_TIMEOUT:
+            result = subprocess.run(['firejail', '--quiet', f'--join={name}', 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode == 0:
+                logger.debug("The persistent sandbox %s is ready (started in %.2f seconds)", name, time.time() - t0)
+                ready.set()
+                return
+            time.sleep(0.2)
+        if jail.poll() is None:
+            logger.warning("The persistent sandbox %s could not be started. Using a new sandbox for every command.", name)
+
+    def wrap(self, command: List[str], directory: str, use_network: bool, ip_address: Optional[str] = None) -> List[str]:
+        with self.lock:
+            jail, ready = self.jails.get(os.path.abspath(directory), (None, None))
+        if not use_network and jail is not None and jail.poll() is None and ready.is_set():
+            return ['firejail', '--quiet', f'--join={self.jail_name(directory)}'] + command
+        return self.fallback.wrap(command, directory, use_network, ip_address)
+
+    def release(self, directory: str):
+        """
+        Stop the jail of the workspace, killing whatever the task left running inside.
+        """
+        with self.lock:
+            jail, _ = self.jails.pop(os.path.abspath(directory), (None, None))
+        if jail is not None:
+            _stop_jail(jail)
+        self.fallback.release(directory)
+
+    def stop(self):
+        with self.lock:
+            jails = [jail for jail, _ in self.jails.values()]
+            self.jails = {}
+        for jail in jails:
+            _stop_jail(jail)
+        self.fallback.stop()
+        if self.runtime_directory is not None:
+            shutil.rmtree(self.runtime_directory, ignore_errors=True)
+            self.runtime_directory = None
+
+def _stop_jail(jail: subprocess.Popen):
+    if jail.poll() is None:
+        jail.terminate()
+        try:
+            jail.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            jail.kill()
+            jail.wait()
@@ -1,13 +1,17 @@
 import abc
-import sys
-import requests
 import time
-import traceback
-from typing import NamedTuple, Optional
+import logging
+from typing import Callable, Dict, NamedTuple, Optional
 from datetime import datetime
 
 from flask import current_app
 
+from .devices import DeviceConfig
+from .http_transport import HttpTransport
+from .task_status import TaskStatusSubscription
+
+logger = logging.getLogger(__name__)
+
 class TaskAssignment(NamedTuple):
     taskIdentifier: str
     sessionIdentifier: str
@@ -31,10 +35,17 @@ class AbstractSchedulerClient:
         Check the status of the currently assigned task
         """
 
+    def subscribe_assignment_status(self, task_identifier: str, on_status: Callable[[str], None]) -> Optional[TaskStatusSubscription]:
+        """
+        Subscribe to the changes of status of the task, if supported. Otherwise, return None.
+        """
+        return None
+
     @abc.abstractmethod
-    def complete_assignments(self, task_identifier: str, session_identifier: str) -> None:
+    def complete_assignments(self, task_identifier: str, timeline_summary: Optional[Dict] = None) -> None:
         """
-        Report that the assignment has finished successfully.
+        Report that the assignment has finished successfully. The summary of its timeline (see TaskTimeline.summary) is
+        only sent if SEND_TASK_TIMELINES.
         """
 
     @abc.abstractmethod
@@ -47,30 +58,46 @@ class SchedulerClient(AbstractSchedulerClient):
     """
     The SchedulerClient wraps all the communications with the RELIA Scheduler.
     """
-    def __init__(self):
-        self.base_url = current_app.config['SCHEDULER_BASE_URL']
-        self.device_id = current_app.config['DEVICE_ID']
-        self.device_type = current_app.config['DEVICE_TYPE']
-        self.password = current_app.config['PASSWORD']
+    def __init__(self, base_url: Optional[str] = None, device: Optional[DeviceConfig] = None, transport: Optional[HttpTransport] = None):
+        self.base_url = base_url or current_app.config['SCHEDULER_BASE_URL']
+        device = device or DeviceConfig.from_config()
+        self.device_id = device.device_id
+        self.device_type = device.device_type
+        self.password = device.password
+        # Several devices can share the transport (see SharedResources)
+        self.transport = transport or SchedulerClient.create_transport()
+        # None until we know if the scheduler supports task status events
+        self.use_events = current_app.config['USE_TASK_STATUS_EVENTS']
+        # Only the fake scheduler (see the load-test command) reads the timelines by default
+        self.send_timelines = current_app.config['SEND_TASK_TIMELINES']
+        self.events_supported: Optional[bool] = None
+
+    @staticmethod
+    def create_transport(pool_size: int = 4) -> HttpTransport:
+        # get_assignments is a long polling request (up to max_seconds), the rest should be fast
+        return HttpTransport.from_config('scheduler', timeouts={
+            'get_assignments': (5, 30),
+            'check_assignment_status': (5, 10),
+            'complete_assignments': (5, 30),
+            'error_message_delivery': (5, 30),
+            # The scheduler sends a heartbeat comment at least every 30 seconds
+            'task_status_events': (5, 60),
+        }, pool_size=pool_size)
 
     def get_assignments(self) -> Optional[TaskAssignment]:
         try:
             url = f"{self.base_url}scheduler/devices/tasks/{self.device_type}?max_seconds=5"
-            response = requests.get(url, headers={'relia-device': self.device_id, 'relia-password': self.password}, timeout=(30,30))
+            # The scheduler assigns a task when answering, so a retry could lose that task
+            response = self.transport.get(url, 'get_assignments', idempotent=False, headers={'relia-device': self.device_id, 'relia-password': self.password})
             try:
                 device_data = response.json()
             except Exception as err:
-                print("Error processing request {url}", file=sys.stdout)
-                print("Error processing request {url}", file=sys.stderr)
-                print(response.text, file=sys.stdout, flush=True)
-                print(response.text, file=sys.stderr, flush=True)
+                logger.error("Error processing request %s: %s", url, response.text)
                 raise
         except Exception as e:
             if str(e)[0] == '5':
                 time.sleep(2)
-            print(f"Error in get_assignments(): {e}")
-            print(f"Error in get_assignments(): {e}", file=sys.stderr, flush=True)
-            traceback.print_exc()
+            logger.exception("Error in get_assignments(): %s", e)
             return None
         else:
             if device_data.get('success'):
@@ -81,31 +108,62 @@ class SchedulerClient(AbstractSchedulerClient):
                               fileType=device_data.get('filetype'),
                               maxTime=device_data.get('maxTime'))
             
-            print(f"Scheduler server failed: {device_data}")
+            logger.error("Scheduler server failed: %s", device_data)
             return None
             
     def check_assignment_status(self, task_identifier: str) -> str:
         """
         Check the status of the currently assigned task
         """
-        device_data = requests.get(f"{self.base_url}scheduler/devices/tasks/{self.device_type}/{task_identifier}", headers={'relia-device': self.device_id, 'relia-password': self.password}, timeout=(30,30)).json()
+        device_data = self.transport.get(f"{self.base_url}scheduler/devices/tasks/{self.device_type}/{task_identifier}", 'check_assignment_status', headers={'relia-device': self.device_id, 'relia-password': self.password}).json()
         return device_data.get('status')
 
-    def complete_assignments(self, task_identifier: str) -> None:
+    def subscribe_assignment_status(self, task_identifier: str, on_status: Callable[[str], None]) -> Optional[TaskStatusSubscription]:
+        """
+        Subscribe to the server-sent events of the status of the task. Return None if the scheduler does not support them.
+        """
+        if not self.use_events or self.events_supported is False:
+            return None
+
+        url = f"{self.base_url}scheduler/devices/tasks/{self.device_type}/{task_identifier}/events"
+        try:
+            response = self.transport.get(url, 'task_status_events', stream=True, headers={'relia-device': self.device_id, 'relia-password': self.password, 'Accept': 'text/event-stream'})
+        except Exception as err:
+            logger.warning("Error subscribing to the task status events: %s. Polling instead.", err)
+            return None
+
+        if response.status_code in (404, 405, 501):
+            logger.info("The scheduler does not support task status events. Polling instead.")
+            self.events_supported = False
+            response.close()
+            return None
+
+        if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+            logger.warning("Unexpected response subscribing to the task status events (%s). Polling instead.", response.status_code)
+            response.close()
+            return None
+
+        self.events_supported = True
+        return TaskStatusSubscription(response, on_status)
+
+    def complete_assignments(self, task_identifier: str, timeline_summary: Optional[Dict] = None) -> None:
         """
         Report that the assignment has finished successfully.
         """
-        device_data = requests.post(f"{self.base_url}scheduler/devices/tasks/{self.device_type}/{task_identifier}", headers={'relia-device': self.device_id, 'relia-password': self.password}, timeout=(30,30)).json()
+        # Completing a task twice is harmless, so it is retried as any idempotent request
+        kwargs = {}
+        if self.send_timelines and timeline_summary is not None:
+            kwargs['json'] = {'timeline': timeline_summary}
+        device_data = self.transport.post(f"{self.base_url}scheduler/devices/tasks/{self.device_type}/{task_identifier}", 'complete_assignments', idempotent=True, headers={'relia-device': self.device_id, 'relia-password': self.password}, **kwargs).json()
 
     def error_message_delivery(self, task_identifier: str, error_message: str) -> None:
         """
         Report an error in the assignment
         """
         now = datetime.now()
-        device_data = requests.post(f"{self.base_url}scheduler/devices/tasks/error_message/{task_identifier}", \
+        device_data = self.transport.post(f"{self.base_url}scheduler/devices/tasks/error_message/{task_identifier}", 'error_message_delivery', \
                                     headers={'relia-device': self.device_id, 'relia-password': self.password}, \
-                                    json={'errorMessage': error_message, 'errorTime': now.isoformat()}, \
-                                    timeout=(30,30)).json()
+                                    json={'errorMessage': error_message, 'errorTime': now.isoformat()}).json()
 
 class NoSchedulerClient(AbstractSchedulerClient):
     """
@@ -117,7 +175,7 @@ class NoSchedulerClient(AbstractSchedulerClient):
     def check_assignment_status(self, task_identifier: str) -> None:
         pass
 
-    def complete_assignments(self, task_identifier: str) -> None:
+    def complete_assignments(self, task_identifier: str, timeline_summary: Optional[Dict] = None) -> None:
         pass
 
     def error_message_delivery(self, task_identifier: str, error_message: str) -> None:
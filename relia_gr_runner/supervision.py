@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+import selectors
+
+from typing import Callable, Optional, Tuple
+
+# Reasons why supervise() returns
+EXITED = 'exited'
+CANCELLED = 'cancelled'
+DEADLINE = 'deadline'
+
+# Used only if the process can not be waited for with a file descriptor (no pidfd support)
+FALLBACK_POLLING_INTERVAL = 0.1
+
+class SelectableEvent:
+    """
+    A threading.Event that can also be waited for with select(), together with other file descriptors.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+
+    def fileno(self) -> int:
+        return self._read_fd
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def set(self):
+        if not self._event.is_set():
+            self._event.set()
+            try:
+                os.write(self._write_fd, b'x')
+            except BlockingIOError:
+                pass
+
+    def clear(self):
+        self._event.clear()
+        try:
+            while os.read(self._read_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+    def close(self):
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+def _exit_fd(process) -> Tuple[Optional[int], bool]:
+    """
+    Return a file descriptor that becomes readable when the process finishes, and whether it must be closed.
+
+    The GRC compiler service and the zygote processes provide their own (their connection).
+    """
+    if hasattr(process, 'fileno'):
+        # -1 once the connection is closed (when the process has already finished)
+        fd = process.fileno()
+        return (fd, False) if fd >= 0 else (None, False)
+    try:
+        return os.pidfd_open(process.pid), True
+    except (AttributeError, OSError):
+        return None, False
+
+def supervise(process, cancel_event: Optional[SelectableEvent], deadline: Optional[float],
+              heartbeat: Optional[Callable[[], None]] = None, heartbeat_interval: float = 5) -> str:
+    """
+    Block until the process exits (EXITED), cancel_event is set (CANCELLED) or time.perf_counter() reaches
+    the deadline (DEADLINE), whatever happens first. Meanwhile, heartbeat is called every heartbeat_interval
+    seconds.
+
+    The process is not stopped: it is the responsibility of the caller. Its output must be drained by
+    other means (see OutputCapture).
+    """
+    if process.poll() is not None:
+        return EXITED
+
+    selector = selectors.DefaultSelector()
+    exit_fd, close_exit_fd = _exit_fd(process)
+    if exit_fd is not None:
+        selector.register(exit_fd, selectors.EVENT_READ, 'exit')
+    if cancel_event is not None:
+        selector.register(cancel_event, selectors.EVENT_READ, 'cancel')
+
+    next_heartbeat = time.perf_counter() + heartbeat_interval
+    try:
+        while True:
+            if process.poll() is not None:
+                return EXITED
+            if cancel_event is not None and cancel_event.is_set():
+                return CANCELLED
+
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return DEADLINE
+
+            if heartbeat is not None and now >= next_heartbeat:
+                heartbeat()
+                next_heartbeat = now + heartbeat_interval
+
+            timeouts = []
+            if deadline is not None:
+                timeouts.append(deadline - now)
+            if heartbeat is not None:
+                timeouts.append(next_heartbeat - now)
+            if exit_fd is None:
+                timeouts.append(FALLBACK_POLLING_INTERVAL)
+
+            selector.select(timeout=min(timeouts) if timeouts else None)
+    finally:
+        selector.close()
+        if close_exit_fd:
+            os.close(exit_fd)
@@ -0,0 +1,141 @@
+import json
+import time
+import logging
+import threading
+
+from typing import Callable, Iterable, Iterator, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Statuses of a task that mean the runner must stop it
+FINAL_STATUSES = ('deleted', 'completed')
+
+# Without events, the status is polled every MAX_POLLING_INTERVAL seconds, and more often (down to
+# MIN_POLLING_INTERVAL) as the deadline of the task approaches
+MIN_POLLING_INTERVAL = 0.5
+MAX_POLLING_INTERVAL = 5
+
+# With events, the status is still polled from time to time in case an event is lost
+SAFETY_POLLING_INTERVAL = 30
+
+# How often the watcher checks that the event stream is still alive
+SUBSCRIPTION_CHECK_INTERVAL = 1
+
+def polling_interval(deadline: Optional[float], now: float) -> float:
+    """
+    Time until the next status request when there are no events.
+    """
+    if deadline is None:
+        return MAX_POLLING_INTERVAL
+    return min(MAX_POLLING_INTERVAL, max(MIN_POLLING_INTERVAL, (deadline - now) / 4))
+
+def parse_event_stream(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Parse a text/event-stream and yield the status carried by each event, either as JSON ({"status": ...})
+    or as plain text. Comments (heartbeats) and other fields are ignored.
+    """
+    data = []
+    for line in lines:
+        if line:
+            if line.startswith('data:'):
+                data.append(line[5:].lstrip(' '))
+            continue
+
+        # A blank line dispatches the event
+        if data:
+            payload = '\n'.join(data)
+            data = []
+            try:
+                status = json.loads(payload)
+            except ValueError:
+                status = payload.strip()
+            if isinstance(status, dict):
+                status = status.get('status')
+            if status:
+                yield status
+
+class TaskStatusSubscription:
+    """
+    Reads the server-sent events of the status of a task in a background thread, and calls on_status
+    with every status received until it is closed.
+    """
+    def __init__(self, response: requests.Response, on_status: Callable[[str], None]):
+        self.response = response
+        self.on_status = on_status
+        self.lock = threading.Lock()
+        self.closed = False
+        self.active = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            # chunk_size=1: otherwise each read waits for a full chunk, delaying small events
+            for status in parse_event_stream(self.response.iter_lines(chunk_size=1, decode_unicode=True)):
+                with self.lock:
+                    if self.closed:
+                        return
+                    self.on_status(status)
+        except Exception as err:
+            if not self.closed:
+                logger.info("Task status event stream stopped: %s", err)
+        finally:
+            self.active = False
+
+    def close(self):
+        """
+        Stop calling on_status. The thread stops when the stream is closed.
+        """
+        with self.lock:
+            self.closed = True
+        try:
+            self.response.close()
+        except Exception:
+            pass
+
+def watch_task_status(scheduler, task_identifier: str, finished_event: threading.Event, cancel: Callable[[], None], deadline: Optional[float] = None):
+    """
+    Follow the status of the task in the scheduler until the runner finishes it (finished_event is set)
+    or the scheduler reports it as deleted or completed, in which case cancel() is called right away.
+
+    If the scheduler supports server-sent events, cancellations arrive as soon as they happen. Otherwise
+    (or if the event stream drops), the status is polled, more often as the deadline (time.perf_counter()) approaches.
+    """
+    final_status_event = threading.Event()
+
+    def on_status(status: str):
+        logger.info("Status of the task %s: %s", task_identifier, status)
+        # If the status is completed or deleted, stop
+        if status in FINAL_STATUSES and not final_status_event.is_set():
+            final_status_event.set()
+            cancel()
+
+    subscription: Optional[TaskStatusSubscription] = scheduler.subscribe_assignment_status(task_identifier, on_status)
+    if subscription is not None:
+        logger.info("Subscribed to the status events of the task %s", task_identifier)
+
+    last_poll = time.perf_counter()
+    try:
+        while True:
+            subscribed = subscription is not None and subscription.active
+            interval = SAFETY_POLLING_INTERVAL if subscribed else polling_interval(deadline, time.perf_counter())
+            timeout = last_poll + interval - time.perf_counter()
+            if subscribed:
+                timeout = min(timeout, SUBSCRIPTION_CHECK_INTERVAL)
+
+            if finished_event.wait(timeout=max(0, timeout)):
+                logger.info("Thread event set. Stopping task status checking thread")
+                return
+
+            if not final_status_event.is_set() and time.perf_counter() - last_poll >= interval:
+                last_poll = time.perf_counter()
+                on_status(scheduler.check_assignment_status(task_identifier))
+
+            if final_status_event.is_set():
+                logger.info("Stopping task polling thread")
+                return
+    finally:
+        if subscription is not None:
+            subscription.close()
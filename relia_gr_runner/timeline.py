@@ -0,0 +1,212 @@
+"""
+Flight recorder of the tasks: every task records a timeline of its phases (assignment fetch, YAML parse,
+grcc, run, scheduler round-trips...) with their monotonic (time.perf_counter) start and end times.
+
+The timeline of the task being processed is kept in a context variable, so any module can record a phase
+(see phase) without receiving it. Threads started by the task must run in a copy of its context
+(contextvars.copy_context) to record their phases in it.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+import collections
+
+from typing import Dict, List, NamedTuple, Optional
+
+from werkzeug.utils import secure_filename
+
+_current: contextvars.ContextVar[Optional["TaskTimeline"]] = contextvars.ContextVar('relia_task_timeline', default=None)
+
+class Phase(NamedTuple):
+    name: str
+    start: float
+    end: float
+    thread: str
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class TaskTimeline:
+    """
+    The phases of a task. Phases might overlap (e.g., the scheduler round-trips while the flowgraph runs).
+    """
+    def __init__(self, task_id: str, session_id: Optional[str] = None, device_id: Optional[str] = None):
+        self.task_id = task_id
+        self.session_id = session_id
+        self.device_id = device_id
+        self.wall_time = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        # completed, failed, cancelled or timed_out (see set_outcome)
+        self.outcome: Optional[str] = None
+        self.phases: List[Phase] = []
+        self.lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: Optional[float] = None):
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.phases.append(Phase(name, start, end, threading.current_thread().name))
+            self.start = min(self.start, start)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def set_outcome(self, outcome: str):
+        """
+        Set how the task ended, unless it was already set (e.g., a cancelled flowgraph also fails).
+        """
+        with self.lock:
+            if self.outcome is None:
+                self.outcome = outcome
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def summary(self) -> Dict:
+        """
+        Total milliseconds per phase (a phase might happen several times, e.g., scheduler round-trips).
+        """
+        with self.lock:
+            phases = list(self.phases)
+
+        totals: Dict[str, float] = {}
+        counts: Dict[str, int] = {}
+        for phase in phases:
+            totals[phase.name] = totals.get(phase.name, 0.0) + phase.duration
+            counts[phase.name] = counts.get(phase.name, 0) + 1
+
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            'task_id': self.task_id,
+            'outcome': self.outcome or 'completed',
+            'total_ms': round((end - self.start) * 1000, 3),
+            'phases': {name: {'ms': round(total * 1000, 3), 'count': counts[name]} for name, total in totals.items()},
+        }
+
+    def trace_events(self, pid: int, tid: int) -> List[Dict]:
+        """
+        The phases as Chrome trace events (complete events, with the times in microseconds).
+        """
+        with self.lock:
+            phases = list(self.phases)
+
+        # Overlapping events in the same row are not drawn properly, so each thread gets its own row
+        threads = {}
+        for phase in phases:
+            threads.setdefault(phase.thread, tid + len(threads))
+
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_tid, 'args': {'name': f'{self.task_id} ({thread})'}}
+                  for thread, thread_tid in threads.items()]
+        for phase in phases:
+            events.append({
+                'name': phase.name,
+                'cat': self.device_id or 'task',
+                'ph': 'X',
+                'pid': pid,
+                'tid': threads[phase.thread],
+                'ts': round(phase.start * 1e6, 3),
+                'dur': round(phase.duration * 1e6, 3),
+                'args': {'task_id': self.task_id, 'session_id': self.session_id},
+            })
+        return events
+
+def current_timeline() -> Optional[TaskTimeline]:
+    return _current.get()
+
+@contextlib.contextmanager
+def recording(timeline: Optional[TaskTimeline]):
+    """
+    Record the phases inside the block (in this context) in timeline.
+    """
+    token = _current.set(timeline)
+    try:
+        yield timeline
+    finally:
+        _current.reset(token)
+
+@contextlib.contextmanager
+def phase(name: str):
+    """
+    Record the block as a phase of the current task, if any.
+    """
+    timeline = _current.get()
+    if timeline is None:
+        yield
+        return
+
+    with timeline.phase(name):
+        yield
+
+def record_phase(name: str, start: float, end: Optional[float] = None):
+    """
+    Record a phase of the current task (if any) that was measured elsewhere.
+    """
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.record(name, start, end)
+
+def set_outcome(outcome: str):
+    """
+    Set how the current task (if any) ended (see TaskTimeline.set_outcome).
+    """
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.set_outcome(outcome)
+
+class FlightRecorder:
+    """
+    Keeps the timelines of the last tasks (TASK_TIMELINES_KEPT) and, if TASK_TRACES_DIRECTORY is set,
+    exports the timeline of every task in the Chrome trace event format (chrome://tracing or Perfetto).
+    """
+    def __init__(self, size: int, traces_directory: Optional[str] = None):
+        self.timelines: "collections.deque[TaskTimeline]" = collections.deque(maxlen=size)
+        self.traces_directory = traces_directory
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config() -> Optional["FlightRecorder"]:
+        from flask import current_app
+
+        if not current_app.config['TASK_TIMELINES_KEPT']:
+            return None
+        traces_directory = current_app.config['TASK_TRACES_DIRECTORY']
+        if traces_directory:
+            os.makedirs(traces_directory, exist_ok=True)
+        return FlightRecorder(current_app.config['TASK_TIMELINES_KEPT'], traces_directory)
+
+    def add(self, timeline: TaskTimeline):
+        timeline.finish()
+        with self.lock:
+            self.timelines.append(timeline)
+        if self.traces_directory:
+            filename = os.path.join(self.traces_directory, f"{timeline.wall_time:.0f}-{secure_filename(timeline.task_id) or 'task'}.trace.json")
+            self.export([timeline], filename)
+
+    def last(self) -> List[TaskTimeline]:
+        with self.lock:
+            return list(self.timelines)
+
+    def export(self, timelines: Optional[List[TaskTimeline]] = None, filename: Optional[str] = None) -> Dict:
+        """
+        The timelines (by default, all the recorded ones) in the Chrome trace event format. If filename
+        is provided, they are also written there.
+        """
+        timelines = self.last() if timelines is None else timelines
+        events = []
+        for position, timeline in enumerate(timelines):
+            events.extend(timeline.trace_events(os.getpid(), position * 100))
+
+        trace = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(trace, f)
+        return trace
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import socket
+import logging
+import shutil
+import atexit
+import tempfile
+import threading
+import subprocess
+
+from types import ModuleType
+from typing import List, Optional
+
+from .sandbox import firejail_profile
+
+logger = logging.getLogger(__name__)
+
+# Maximum time to start a worker (e.g., loading the GRC platform or importing GNU Radio)
+STARTUP_TIMEOUT = 300
+
+class WorkerService:
+    """
+    WorkerService manages a long-lived worker process which serves requests through a Unix socket.
+
+    The socket is bound by the runner in a runtime directory which is not visible in the sandbox, and
+    the worker receives it (listening) as its stdin, so nothing running in the sandbox can replace it.
+    The first connection accepted by the worker is the control connection: the worker sends its
+    READY_MESSAGE through it once it is ready, and it must finish when it is closed.
+
+    The worker module must only depend on the standard library and GNU Radio, since it is copied to
+    the read-only bin directory of the sandbox and run as a script in its scratch directory (the only
+    directories of the runner visible in the sandbox).
+    """
+    name = 'worker'
+    worker_module: ModuleType
+
+    def __init__(self, use_firejail: bool):
+        self.use_firejail = use_firejail
+        self.runtime_directory: Optional[str] = None
+        self.worker: Optional[subprocess.Popen] = None
+        self.control: Optional[socket.socket] = None
+        self.ready_event = threading.Event()
+        self.lock = threading.Lock()
+        atexit.register(self.stop)
+
+    @property
+    def socket_path(self) -> str:
+        return os.path.join(self.runtime_directory, f'{self.name}.sock')
+
+    @property
+    def bin_directory(self) -> str:
+        return os.path.join(self.runtime_directory, 'bin')
+
+    @property
+    def scratch_directory(self) -> str:
+        return os.path.join(self.runtime_directory, 'scratch')
+
+    def worker_arguments(self) -> List[str]:
+        """
+        Arguments passed to the worker.
+        """
+        return []
+
+    def sandbox_directories(self) -> List[str]:
+        """
+        Directories visible in the sandbox of the worker. By default, only the bin and scratch directories.
+        """
+        return [self.bin_directory, self.scratch_directory]
+
+    def firejail_profile(self) -> str:
+        """
+        Profile of the sandbox of the worker. By default, no network.
+        """
+        return firejail_profile(self.sandbox_directories(), None, None) + f"\nread-only {self.bin_directory}\n"
+
+    def on_start(self):
+        """
+        Called (with the lock acquired) before starting the worker.
+        """
+
+    def start(self):
+        """
+        Start the worker. Starting it might take a while, so it is done in the background.
+        """
+        with self.lock:
+            self._stop_worker()
+            self.runtime_directory = tempfile.mkdtemp(prefix=f'relia-{self.name}-')
+            self.on_start()
+
+            os.mkdir(self.bin_directory)
+            os.mkdir(self.scratch_directory)
+            worker_filename = os.path.join(self.bin_directory, os.path.basename(self.worker_module.__file__))
+            shutil.copy(self.worker_module.__file__, worker_filename)
+            os.chmod(worker_filename, 0o444)
+            command = [sys.executable, worker_filename] + self.worker_arguments()
+            if self.use_firejail:
+                profile_filename = os.path.join(self.runtime_directory, 'firejail.profile')
+                open(profile_filename, 'w').write(self.firejail_profile())
+                command = ['firejail', f'--profile={profile_filename}', '--quiet'] + command
+
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                server.bind(self.socket_path)
+                server.listen(16)
+                self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.control.connect(self.socket_path)
+
+                logger.info("Starting the %s service: %s", self.name, ' '.join(command))
+                self.worker = subprocess.Popen(command, cwd=self.scratch_directory, stdin=server, stdout=subprocess.DEVNULL)
+            finally:
+                # The worker has its own copy
+                server.close()
+            ready_event = self.ready_event = threading.Event()
+            threading.Thread(target=self._wait_for_worker, args=(self.control, ready_event), daemon=True).start()
+
+    def _wait_for_worker(self, control: socket.socket, ready_event: threading.Event):
+        t0 = time.time()
+        message = b''
+        try:
+            while b'\n' not in message:
+                chunk = control.recv(4096)
+                if not chunk:
+                    break
+                message += chunk
+        except OSError:
+            pass
+
+        if message.decode(errors='replace').strip() == self.worker_module.READY_MESSAGE:
+            logger.info("The %s service is ready (started in %.2f seconds)", self.name, time.time() - t0)
+            ready_event.set()
+        else:
+            logger.warning("The %s service stopped before being ready.", self.name)
+
+    def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT) -> bool:
+        """
+        Wait until the worker is ready. Return False if it failed or timed out.
+        """
+        worker, ready_event = self.worker, self.ready_event
+        t0 = time.time()
+        while worker is not None and not ready_event.wait(timeout=0.5):
+            if worker.poll() is not None or time.time() - t0 > timeout:
+                return False
+        return ready_event.is_set()
+
+    def is_available(self) -> bool:
+        """
+        Return True if the worker is ready. If it has stopped, it is restarted in the background.
+        """
+        if self.worker is None:
+            return False
+
+        if self.worker.poll() is not None:
+            logger.warning("The %s service stopped with code %s. Restarting it...", self.name, self.worker.returncode)
+            self.start()
+            return False
+
+        return self.ready_event.is_set()
+
+    def _stop_worker(self):
+        if self.control is not None:
+            self.ready_event.clear()
+            self.control.close()
+            self.control = None
+
+        if self.worker is not None:
+            try:
+                self.worker.wait(timeout=10)
+            except Exception:
+                self.worker.kill()
+            self.worker = None
+
+        if self.runtime_directory is not None:
+            shutil.rmtree(self.runtime_directory, ignore_errors=True)
+            self.runtime_directory = None
+
+    def stop(self):
+        with self.lock:
+            self._stop_worker()
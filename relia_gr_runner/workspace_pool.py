@@ -0,0 +1,167 @@
+import os
+import time
+import logging
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+
+from typing import Callable, List, Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+def is_tmpfs(directory: str) -> bool:
+    """
+    Whether directory is the mount point of a tmpfs.
+    """
+    directory = os.path.realpath(directory)
+    try:
+        mounts = open('/proc/mounts').read().splitlines()
+    except OSError:
+        return False
+    for mount in mounts:
+        fields = mount.split()
+        if len(fields) >= 3 and fields[1] == directory and fields[2] == 'tmpfs':
+            return True
+    return False
+
+def mount_tmpfs(directory: str, size: str) -> bool:
+    """
+    Mount a tmpfs limited to size (e.g. 256m) in directory, unless it is already there. Return whether
+    directory is a tmpfs.
+
+    Mounting requires root. Otherwise, it can be configured in /etc/fstab, e.g.:
+
+        tmpfs /home/relia/workspaces tmpfs size=256m,mode=0700,uid=relia,gid=relia 0 0
+    """
+    os.makedirs(directory, exist_ok=True)
+    if is_tmpfs(directory):
+        return True
+
+    if os.geteuid() != 0:
+        logger.warning("%s is not a tmpfs and only root can mount it. Add it to /etc/fstab (tmpfs %s tmpfs size=%s,mode=0700,uid=%s,gid=%s 0 0). Using the disk meanwhile.", directory, directory, size, os.getuid(), os.getgid())
+        return False
+
+    try:
+        subprocess.run(['mount', '-t', 'tmpfs', '-o', f'size={size},mode=0700', 'tmpfs', directory], check=True, timeout=30)
+    except Exception as err:
+        logger.error("Error mounting a tmpfs in %s: %s. Using the disk.", directory, err)
+        return False
+    return True
+
+def clear_directory(directory: str):
+    """
+    Remove everything inside directory (but not the directory itself).
+    """
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+class WorkspacePool:
+    """
+    Directories where the tasks run, created in advance in directory (ideally a tmpfs, see mount_tmpfs)
+    and reused: after a task, its workspace is emptied and prepared again by a background thread, so
+    neither creating nor removing it is done while tasks wait.
+
+    scaffold(directory) prepares the static parts of a workspace (the files directory, relia.json...).
+    If all the workspaces are in use, a new one is created; workspaces over size are removed once released.
+    """
+    def __init__(self, directory: str, size: int, scaffold: Callable[[str], None]):
+        self.directory = os.path.abspath(directory)
+        self.size = size
+        self.scaffold = scaffold
+        self.ready: "queue.Queue[str]" = queue.Queue()
+        self.released: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.workspaces: List[str] = []
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def from_config(directory: str, scaffold: Callable[[str], None]) -> Optional["WorkspacePool"]:
+        """
+        Build the WorkspacePool from the Flask configuration, or return None if it is disabled.
+        """
+        if not current_app.config['USE_WORKSPACE_POOL']:
+            return None
+
+        tmpfs_size = current_app.config['WORKSPACES_TMPFS_SIZE']
+        if tmpfs_size:
+            mount_tmpfs(directory, tmpfs_size)
+        return WorkspacePool(directory, current_app.config['WORKSPACE_POOL_SIZE'], scaffold)
+
+    def _create(self) -> str:
+        workspace = tempfile.mkdtemp(prefix='relia-', dir=self.directory)
+        self.scaffold(workspace)
+        with self.lock:
+            self.workspaces.append(workspace)
+        return workspace
+
+    def _remove(self, workspace: str):
+        shutil.rmtree(workspace, ignore_errors=True)
+        with self.lock:
+            if workspace in self.workspaces:
+                self.workspaces.remove(workspace)
+
+    def start(self):
+        for _ in range(self.size):
+            self.ready.put(self._create())
+        self.thread = threading.Thread(target=self._reset_released, daemon=True)
+        self.thread.start()
+        logger.info("%s workspaces ready in %s%s", self.size, self.directory, ' (tmpfs)' if is_tmpfs(self.directory) else '')
+
+    def _reset_released(self):
+        while True:
+            workspace = self.released.get()
+            if workspace is None:
+                return
+
+            try:
+                with self.lock:
+                    spare = len(self.workspaces) > self.size
+                if spare:
+                    self._remove(workspace)
+                    continue
+
+                t0 = time.perf_counter()
+                clear_directory(workspace)
+                self.scaffold(workspace)
+                self.ready.put(workspace)
+                logger.debug("Workspace %s reset in %.1f ms", workspace, (time.perf_counter() - t0) * 1000)
+            except Exception as err:
+                logger.error("Error resetting the workspace %s: %s. Removing it.", workspace, err)
+                self._remove(workspace)
+
+    def acquire(self) -> str:
+        """
+        Return an empty (but scaffolded) workspace. It must be given back with release().
+        """
+        try:
+            return self.ready.get_nowait()
+        except queue.Empty:
+            logger.info("No workspace ready in the pool. Creating a new one.")
+            return self._create()
+
+    def release(self, workspace: str):
+        """
+        Give the workspace back to be reset in the background.
+        """
+        self.released.put(workspace)
+
+    def stop(self):
+        if self.thread is not None:
+            self.released.put(None)
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            workspaces = list(self.workspaces)
+        for workspace in workspaces:
+            self._remove(workspace)
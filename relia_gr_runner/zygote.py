@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+import signal
+import socket
+import select
+import subprocess
+
+from typing import List, Optional, Tuple
+
+from .sandbox import firejail_profile
+from .worker_service import WorkerService
+from . import zygote_worker
+
+logger = logging.getLogger(__name__)
+
+class ZygoteProcess:
+    """
+    A flowgraph forked by the ZygoteService.
+
+    It provides the same methods as subprocess.Popen that the Processor uses (poll, terminate, kill,
+    wait and communicate, plus stdout and stderr as pipes), so it is supervised in the same way.
+    """
+    def __init__(self, connection: socket.socket, stdin_fd: int, stdout_fd: int, stderr_fd: int):
+        self.connection = connection
+        # The stdin is kept open (and empty) while the flowgraph runs: GNU Radio no_gui flowgraphs
+        # wait for input() to stop
+        self.stdin_fd = stdin_fd
+        self.stdout = os.fdopen(stdout_fd, 'r')
+        self.stderr = os.fdopen(stderr_fd, 'r')
+        self.pid: Optional[int] = None
+        self.returncode: Optional[int] = None
+        self._buffer = b''
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    def _process_messages(self, blocking: bool):
+        self.connection.setblocking(blocking)
+        try:
+            chunk = self.connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+
+        if not chunk:
+            # The zygote stopped without reporting the exit of the flowgraph
+            self._finish(-signal.SIGKILL)
+            return
+
+        self._buffer += chunk
+        while b'\n' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\n', 1)
+            message = json.loads(line)
+            if 'pid' in message:
+                self.pid = message['pid']
+            if 'returncode' in message:
+                self._finish(message['returncode'])
+
+    def _finish(self, returncode: int):
+        self.returncode = returncode
+        self.connection.close()
+        if self.stdin_fd is not None:
+            os.close(self.stdin_fd)
+            self.stdin_fd = None
+
+    def poll(self) -> Optional[int]:
+        while self.returncode is None:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if not readable:
+                break
+            self._process_messages(blocking=False)
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        t0 = time.time()
+        while self.poll() is None:
+            remaining = None if timeout is None else timeout - (time.time() - t0)
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired('zygote', timeout)
+            select.select([self.connection], [], [], remaining)
+        return self.returncode
+
+    def send_signal(self, signum: int):
+        if self.returncode is None:
+            try:
+                self.connection.sendall(json.dumps({'signal': signum}).encode() + b'\n')
+            except OSError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def communicate(self) -> Tuple[str, str]:
+        self.wait()
+        stdout, stderr = self.stdout.read(), self.stderr.read()
+        self.stdout.close()
+        self.stderr.close()
+        return stdout, stderr
+
+class ZygoteService(WorkerService):
+    """
+    Every flowgraph launched as a new process pays again for the Python startup and for importing
+    GNU Radio, numpy and the RELIA blocks. The ZygoteService keeps a worker process (zygote_worker)
+    which has already imported them and forks a child for every flowgraph.
+
+    When firejail is used, the zygote runs inside the sandbox (so all its children do too), and only the
+    workspaces_directory is visible, so the flowgraphs must run in subdirectories of it.
+    """
+    name = 'zygote'
+    worker_module = zygote_worker
+
+    def __init__(self, use_firejail: bool, workspaces_directory: str, preload_modules: List[str], relia_python_paths: List[str], ip_address: Optional[str] = None, interface: Optional[str] = None):
+        super().__init__(use_firejail)
+        self.workspaces_directory = os.path.abspath(workspaces_directory)
+        self.preload_modules = preload_modules
+        self.relia_python_paths = relia_python_paths
+        self.ip_address = ip_address
+        self.interface = interface
+
+    @staticmethod
+    def from_config(workspaces_directory: str) -> Optional["ZygoteService"]:
+        """
+        Build the service from the Flask configuration, or return None if it is disabled.
+        """
+        from flask import current_app
+
+        if not current_app.config['USE_ZYGOTE']:
+            return None
+
+        preload_modules = [module.strip() for module in current_app.config['ZYGOTE_PRELOAD_MODULES'].split(',') if module.strip()]
+        relia_python_paths = [path for path in (os.environ.get('RELIA_GR_PYTHON_PATH') or '').split(os.pathsep) if path]
+        return ZygoteService(current_app.config['USE_FIREJAIL'], workspaces_directory, preload_modules, relia_python_paths,
+                             current_app.config['FIREJAIL_IP_ADDRESS'], current_app.config['FIREJAIL_INTERFACE'])
+
+    def worker_arguments(self) -> List[str]:
+        return [','.join(self.preload_modules)] + self.relia_python_paths
+
+    def sandbox_directories(self) -> List[str]:
+        return super().sandbox_directories() + [self.workspaces_directory]
+
+    def firejail_profile(self) -> str:
+        # Unlike the compiler, the flowgraphs need the network (SDR and data uploader)
+        return firejail_profile(self.sandbox_directories(), self.ip_address, self.interface) + f"\nread-only {self.bin_directory}\n"
+
+    def can_run_in(self, directory: str) -> bool:
+        """
+        Outside the sandbox, any directory can be used. Inside, only the subdirectories of workspaces_directory.
+        """
+        if not self.use_firejail:
+            return True
+        return os.path.commonpath([self.workspaces_directory, os.path.abspath(directory)]) == self.workspaces_directory
+
+    def spawn(self, directory: str, py_filename: str, max_cpu_seconds: Optional[int] = None, cpu_affinity: Optional[List[int]] = None,
+              niceness: Optional[int] = None) -> Optional[ZygoteProcess]:
+        """
+        Run py_filename in directory in a child of the zygote. Return None if the zygote is not available.
+
+        The child is limited to max_cpu_seconds of CPU time and to the cpu_affinity cores, with that niceness (if provided).
+        """
+        if not self.is_available():
+            return None
+
+        stdin_read, stdin_write = os.pipe()
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        request = json.dumps({
+            'directory': directory,
+            'py_filename': py_filename,
+            'max_cpu_seconds': max_cpu_seconds,
+            'cpu_affinity': cpu_affinity,
+            'niceness': niceness,
+        }).encode()
+
+        try:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(self.socket_path)
+            socket.send_fds(connection, [request], [stdin_read, stdout_write, stderr_write])
+        except OSError as err:
+            logger.error("Error connecting to the zygote service: %s", err)
+            for fd in (stdin_read, stdin_write, stdout_read, stdout_write, stderr_read, stderr_write):
+                os.close(fd)
+            return None
+
+        # The child has its own copies of these
+        for fd in (stdin_read, stdout_write, stderr_write):
+            os.close(fd)
+
+        return ZygoteProcess(connection, stdin_write, stdout_read, stderr_read)
@@ -0,0 +1,274 @@
+"""
+Worker of the ZygoteService (see zygote.py).
+
+It imports GNU Radio, numpy and the RELIA blocks once, and then forks a child for every flowgraph, so
+each task does not pay again the Python startup and those imports. The child receives its stdin, stdout
+and stderr from the runner (through the Unix socket), moves to the workspace and runs the generated module.
+Once a child finishes, every process it left behind (even in another session) is killed, since the sandbox
+of the zygote outlives the task.
+It only depends on the standard library, since it runs inside the sandbox. It receives the listening socket
+as its stdin (see WorkerService):
+
+    $ python zygote_worker.py numpy,gnuradio.gr,... /home/relia/relia-blocks/python
+"""
+import os
+import sys
+import json
+import time
+import ctypes
+import ctypes.util
+import runpy
+import signal
+import socket
+import resource
+import importlib
+import selectors
+import traceback
+
+from typing import Dict, List
+
+READY_MESSAGE = 'relia-zygote-ready'
+
+# prctl(2) option so the orphaned descendants of a process are reparented to it instead of to init
+PR_SET_CHILD_SUBREAPER = 36
+
+def preload(modules: List[str], relia_python_paths: List[str]):
+    """
+    Import the modules used by most flowgraphs, plus every module of the RELIA blocks.
+    """
+    modules = list(modules)
+    original_sys_path = list(sys.path)
+    for relia_python_path in relia_python_paths:
+        if not os.path.isdir(relia_python_path):
+            continue
+        sys.path.insert(0, relia_python_path)
+        for name in sorted(os.listdir(relia_python_path)):
+            is_package = os.path.isfile(os.path.join(relia_python_path, name, '__init__.py'))
+            if name.startswith(('_', '.')) or not (name.endswith('.py') or is_package):
+                continue
+            modules.append(os.path.splitext(name)[0])
+
+    for module in modules:
+        t0 = time.time()
+        try:
+            importlib.import_module(module)
+        except Exception as err:
+            print(f"[{time.asctime()}] Error preloading {module}: {err}", file=sys.stderr, flush=True)
+        else:
+            print(f"[{time.asctime()}] {module} preloaded in {time.time() - t0:.2f} seconds", file=sys.stderr, flush=True)
+
+    # The modules are already in sys.modules, so the children see the same sys.path as a fresh interpreter
+    sys.path[:] = original_sys_path
+
+def _become_subreaper():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+def _children() -> List[int]:
+    """
+    Processes whose parent is this one.
+    """
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open(f'/proc/{entry}/stat').read()
+        except OSError:
+            continue
+        # The name of the command (in parentheses) might contain spaces
+        if int(stat.rsplit(')', 1)[1].split()[1]) == os.getpid():
+            children.append(int(entry))
+    return children
+
+def _kill_leftovers(running_children):
+    """
+    Kill and reap the processes left behind by the finished children. The zygote and every child are subreapers,
+    so the orphans of a running child stay under it, and those of a finished one end up under the zygote.
+    """
+    for _ in range(100):
+        leftovers = [pid for pid in _children() if pid not in running_children]
+        if not leftovers:
+            break
+        for pid in leftovers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        for pid in leftovers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+def _run_child(request: Dict, fds: List[int]):
+    """
+    Run in the forked child: it never returns.
+    """
+    exit_code = 1
+    try:
+        os.setsid()
+        _become_subreaper()
+        for fd, target_fd in zip(fds, (0, 1, 2)):
+            os.dup2(fd, target_fd)
+            os.close(fd)
+
+        for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT, signal.SIGPIPE):
+            signal.signal(signum, signal.SIG_DFL)
+
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        if request.get('max_cpu_seconds'):
+            max_cpu_seconds = int(request['max_cpu_seconds'])
+            resource.setrlimit(resource.RLIMIT_CPU, (max_cpu_seconds, max_cpu_seconds))
+        if request.get('cpu_affinity'):
+            os.sched_setaffinity(0, request['cpu_affinity'])
+        if request.get('niceness'):
+            os.nice(int(request['niceness']))
+
+        os.chdir(request['directory'])
+        sys.argv = [request['py_filename']]
+        sys.path[0] = request['directory']
+        try:
+            runpy.run_path(request['py_filename'], run_name='__main__')
+            exit_code = 0
+        except SystemExit as err:
+            if err.code is None:
+                exit_code = 0
+            elif isinstance(err.code, int):
+                exit_code = err.code
+            else:
+                print(err.code, file=sys.stderr)
+                exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+def serve(modules: List[str], relia_python_paths: List[str]):
+    preload(modules, relia_python_paths)
+    _become_subreaper()
+
+    server = socket.socket(fileno=sys.stdin.fileno())
+    # The first connection is the runner's control connection (see WorkerService)
+    control, _ = server.accept()
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ, ('accept', None))
+    selector.register(control, selectors.EVENT_READ, ('runner', None))
+
+    # pid: [connection, pidfd]. The connection is None if the runner stopped waiting for the child
+    children: Dict[int, List] = {}
+    use_pidfd = hasattr(os, 'pidfd_open')
+
+    def close_connection(pid: int):
+        connection = children[pid][0]
+        if connection is not None:
+            selector.unregister(connection)
+            connection.close()
+            children[pid][0] = None
+
+    def child_finished(pid: int, status: int):
+        connection, pidfd = children[pid]
+        if pidfd is not None:
+            selector.unregister(pidfd)
+            os.close(pidfd)
+        if connection is not None:
+            try:
+                connection.sendall(json.dumps({'returncode': os.waitstatus_to_exitcode(status)}).encode() + b'\n')
+            except OSError:
+                pass
+            close_connection(pid)
+        del children[pid]
+        _kill_leftovers(children)
+
+    control.sendall(f"{READY_MESSAGE}\n".encode())
+
+    while True:
+        # Without pidfd, children are checked periodically
+        events = selector.select(timeout=None if use_pidfd else 0.1)
+        for key, _ in events:
+            kind, pid = key.data
+            if kind == 'runner':
+                if not control.recv(1):
+                    # The runner closed the control connection (or died)
+                    for child_pid in children:
+                        try:
+                            os.killpg(child_pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    _kill_leftovers(())
+                    return
+
+            elif kind == 'accept':
+                connection, _ = server.accept()
+                message, fds, _, _ = socket.recv_fds(connection, 65536, 3)
+                request = json.loads(message)
+
+                pid = os.fork()
+                if pid == 0:
+                    selector.close()
+                    server.close()
+                    control.close()
+                    connection.close()
+                    for child_connection, pidfd in children.values():
+                        if child_connection is not None:
+                            child_connection.close()
+                        if pidfd is not None:
+                            os.close(pidfd)
+                    _run_child(request, fds)
+
+                for fd in fds:
+                    os.close(fd)
+
+                pidfd = os.pidfd_open(pid) if use_pidfd else None
+                children[pid] = [connection, pidfd]
+                selector.register(connection, selectors.EVENT_READ, ('control', pid))
+                if pidfd is not None:
+                    selector.register(pidfd, selectors.EVENT_READ, ('exit', pid))
+                connection.sendall(json.dumps({'pid': pid}).encode() + b'\n')
+
+            elif pid not in children:
+                # The child finished while processing other events
+                continue
+
+            elif kind == 'exit':
+                _, status = os.waitpid(pid, 0)
+                child_finished(pid, status)
+
+            elif kind == 'control':
+                connection = children[pid][0]
+                if connection is None:
+                    continue
+                try:
+                    message = connection.recv(4096)
+                except OSError:
+                    message = b''
+
+                if message:
+                    signals = [json.loads(line)['signal'] for line in message.splitlines() if line.strip()]
+                else:
+                    # The runner is not waiting for this child anymore
+                    signals = [signal.SIGKILL]
+                    close_connection(pid)
+
+                for signum in signals:
+                    try:
+                        os.killpg(pid, signum)
+                    except ProcessLookupError:
+                        pass
+
+        if not use_pidfd:
+            for pid in list(children):
+                finished_pid, status = os.waitpid(pid, os.WNOHANG)
+                if finished_pid:
+                    child_finished(pid, status)
+
+if __name__ == '__main__':
+    serve([module for module in sys.argv[1].split(',') if module], [path for path in sys.argv[2:] if path])